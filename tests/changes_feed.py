@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Consumidor incremental do log de mudanças (/changes) do Orthanc PACS Radiweb
+Autor: Manus AI
+Data: 2024-01-01
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import concurrent.futures
+from datetime import datetime
+
+try:
+    import requests
+    from requests.auth import HTTPBasicAuth
+except ImportError:
+    print("❌ requests não está instalado. Instale com: pip install requests")
+    sys.exit(1)
+
+def parse_orthanc_date(value):
+    """Converter '20240101T120000' em timestamp (None se inválido)"""
+    try:
+        return datetime.strptime(value, '%Y%m%dT%H%M%S').timestamp()
+    except (TypeError, ValueError):
+        return None
+
+class ChangesFeed:
+    """Paginação de /changes?since=N&limit=M com cursor persistido em disco
+
+    O cursor é o último `Seq` totalmente processado; é gravado de forma
+    atômica (arquivo temporário + rename) para que uma nova execução
+    continue exatamente de onde a anterior parou.
+    """
+
+    def __init__(self, base_url, username=None, password=None, cursor_file=None, limit=100,
+                 timeout=30, session=None):
+        self.base_url = base_url.rstrip('/')
+        self.cursor_file = cursor_file
+        self.limit = limit
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            session.auth = HTTPBasicAuth(username, password)
+        self.session = session
+        self.cursor = self._load_cursor()
+
+    def _load_cursor(self):
+        if self.cursor_file and os.path.exists(self.cursor_file):
+            with open(self.cursor_file) as f:
+                return int(json.load(f).get('since', 0))
+        return 0
+
+    def save_cursor(self, since):
+        """Persistir o cursor (somente se avançou)"""
+        if since <= self.cursor:
+            return
+        self.cursor = since
+        if self.cursor_file:
+            temp_file = f"{self.cursor_file}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump({'since': since, 'updated': datetime.now().isoformat()}, f)
+            os.replace(temp_file, self.cursor_file)
+
+    def get(self, path, **params):
+        response = self.session.get(f"{self.base_url}{path}", params=params or None,
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def head(self):
+        """Seq mais recente do servidor (/changes?last)"""
+        return self.get('/changes', last='')['Last']
+
+    def pages(self, follow=False, poll_interval=1.0, stop=None):
+        """Gerar páginas de mudanças a partir do cursor
+
+        Com `follow`, ao alcançar o fim (Done) aguarda `poll_interval`
+        segundos e consulta de novo, até `stop` (threading.Event) ser sinalizado.
+        """
+        since = self.cursor
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            data = self.get('/changes', since=since, limit=self.limit)
+            changes = data.get('Changes', [])
+            if changes:
+                yield changes
+                since = changes[-1]['Seq']
+            if data.get('Done', True) or not changes:
+                if not follow:
+                    return
+                stop.wait(poll_interval)
+
+class ChangesConsumer:
+    """Agrupa NewInstance em lotes por estudo e os despacha no StableStudy
+
+    Cada lote é entregue a `sink` (qualquer chamável que receba o dict
+    do lote) por um pool de `workers` threads, com no máximo
+    `max_in_flight` lotes pendentes: quando o pool está cheio, a leitura
+    do feed espera (contrapressão). O cursor só avança até antes da
+    mudança mais antiga ainda não entregue (entrega pelo menos uma vez):
+    um lote que esgota as tentativas continua segurando o cursor e é
+    reentregue na próxima execução. Um estudo removido entre o StableStudy
+    e a busca (404) não tem o que entregar: o lote é descartado sem novas
+    tentativas, assim como os lotes em andamento de um estudo que recebe
+    Deleted. NewInstance sem StableStudy (estudo removido antes de
+    estabilizar) sai de `pending` no Deleted ou após `pending_timeout`
+    segundos de log, para não prender o cursor.
+    """
+
+    def __init__(self, feed, sink, workers=4, max_in_flight=None, retries=3, pending_timeout=3600):
+        self.feed = feed
+        self.sink = sink
+        self.workers = workers
+        self.retries = retries
+        self.slots = threading.Semaphore(max_in_flight or workers * 2)
+        self.lock = threading.Lock()
+        self.pending = {}     # ID da instância -> Seq do NewInstance (em ordem de Seq)
+        self.pending_times = {}  # ID da instância -> data do NewInstance no log
+        self.pending_timeout = pending_timeout
+        self.in_flight = {}   # Seq do StableStudy -> Seq mais antigo coberto pelo lote
+        self.in_flight_studies = {}  # Seq do StableStudy -> ID do estudo
+        self.last_seq = feed.cursor
+        self.start_time = None
+        self.counters = {'events': 0, 'batches': 0, 'failed_batches': 0, 'instances': 0,
+                         'expired_instances': 0, 'gone_studies': 0}
+        self.head = feed.cursor
+        self.last_event_time = None
+
+    def study_batch(self, change):
+        """Montar o lote de um StableStudy (2 requisições por estudo, não por instância)"""
+        study_id = change['ID']
+        study = self.feed.get(f"/studies/{study_id}")
+        series = self.feed.get(f"/studies/{study_id}/series")
+
+        instance_ids = [i for s in series for i in s.get('Instances', [])]
+        with self.lock:
+            new_instances = [i for i in instance_ids if i in self.pending]
+            # As instâncias saem de `pending`, mas o lote segura o cursor até ser entregue
+            first_seq = min([self.pending.pop(i) for i in new_instances] + [change['Seq']])
+            for i in new_instances:
+                self.pending_times.pop(i, None)
+            self.in_flight[change['Seq']] = first_seq
+
+        tags = study.get('MainDicomTags', {})
+        patient = study.get('PatientMainDicomTags', {})
+        return {
+            'event': 'study.stable',
+            'seq': change['Seq'],
+            'study_id': study_id,
+            'study_instance_uid': tags.get('StudyInstanceUID'),
+            'patient_id': patient.get('PatientID'),
+            'patient_name': patient.get('PatientName'),
+            'study_date': tags.get('StudyDate'),
+            'study_description': tags.get('StudyDescription'),
+            'accession_number': tags.get('AccessionNumber'),
+            'modalities': sorted(set(s.get('MainDicomTags', {}).get('Modality', '')
+                                     for s in series) - {''}),
+            'new_instances': new_instances,
+            'total_instances': len(instance_ids),
+            'timestamp': change.get('Date')
+        }
+
+    def _deliver(self, change):
+        """Montar o lote e entregá-lo ao sink (em uma thread do pool), com novas tentativas"""
+        seq = change['Seq']
+        batch = None
+        delivered = False
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    if batch is None:
+                        try:
+                            batch = self.study_batch(change)
+                        except requests.exceptions.HTTPError as e:
+                            if e.response is None or e.response.status_code != 404:
+                                raise
+                            # Estudo removido depois do StableStudy: nada a entregar nem repetir
+                            with self.lock:
+                                self.counters['gone_studies'] += 1
+                            delivered = True
+                            return
+                    self.sink(batch)
+                    with self.lock:
+                        self.counters['batches'] += 1
+                        self.counters['instances'] += len(batch['new_instances'])
+                    delivered = True
+                    return
+                except Exception as e:
+                    if attempt == self.retries:
+                        with self.lock:
+                            # Estudo removido durante as tentativas: o lote já foi descartado
+                            gone = seq not in self.in_flight
+                            if not gone:
+                                self.counters['failed_batches'] += 1
+                        if not gone:
+                            # Sem remover de in_flight: o cursor não passa deste lote
+                            print(f"   ❌ Lote do estudo {change['ID']} não entregue (será repetido "
+                                  f"na próxima execução): {e}")
+                    else:
+                        time.sleep(0.5 * 2 ** attempt)
+        finally:
+            if delivered:
+                with self.lock:
+                    self.in_flight.pop(seq, None)
+                    self.in_flight_studies.pop(seq, None)
+            self.slots.release()
+
+    def _expire_pending(self):
+        """Descartar NewInstance mais antigos que `pending_timeout` segundos de log"""
+        if not self.pending_timeout or self.last_event_time is None:
+            return
+        limit = self.last_event_time - self.pending_timeout
+        with self.lock:
+            while self.pending:
+                instance_id = next(iter(self.pending))
+                if self.pending_times.get(instance_id, limit) > limit:
+                    break
+                del self.pending[instance_id]
+                self.pending_times.pop(instance_id, None)
+                self.counters['expired_instances'] += 1
+
+    def safe_cursor(self):
+        """Maior Seq tal que todas as mudanças até ele já foram entregues"""
+        with self.lock:
+            oldest = [seq for seq in self.in_flight.values()]
+            if self.pending:
+                oldest.append(next(iter(self.pending.values())))
+            return min(oldest) - 1 if oldest else self.last_seq
+
+    def metrics(self):
+        """Eventos/s, atraso em eventos (head - cursor) e em segundos, filas"""
+        elapsed = time.time() - self.start_time if self.start_time else 0
+        with self.lock:
+            counters = dict(self.counters)
+            pending, in_flight = len(self.pending), len(self.in_flight)
+        return {
+            **counters,
+            'events_per_second': counters['events'] / elapsed if elapsed else 0.0,
+            'cursor': self.feed.cursor,
+            'last_seq': self.last_seq,
+            'head': self.head,
+            'lag_events': max(self.head - self.last_seq, 0),
+            'lag_seconds': time.time() - self.last_event_time if self.last_event_time else None,
+            'pending_instances': pending,
+            'in_flight_batches': in_flight
+        }
+
+    def run(self, follow=False, poll_interval=1.0, duration=None, report_interval=10.0,
+            metrics_file=None):
+        """Consumir o feed; sem `follow`, termina ao alcançar o fim do log"""
+        stop = threading.Event()
+        if duration:
+            timer = threading.Timer(duration, stop.set)
+            timer.daemon = True
+            timer.start()
+        self.start_time = time.time()
+        last_report = self.start_time
+        self.head = self.feed.head()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                for changes in self.feed.pages(follow, poll_interval, stop):
+                    for change in changes:
+                        change_type = change['ChangeType']
+                        event_time = parse_orthanc_date(change.get('Date')) or time.time()
+                        if change_type == 'NewInstance':
+                            with self.lock:
+                                self.pending[change['ID']] = change['Seq']
+                                self.pending_times[change['ID']] = event_time
+                        elif change_type == 'Deleted' and change.get('ResourceType') == 'Instance':
+                            with self.lock:
+                                self.pending.pop(change['ID'], None)
+                                self.pending_times.pop(change['ID'], None)
+                        elif change_type == 'Deleted' and change.get('ResourceType') == 'Study':
+                            # Lotes ainda não entregues do estudo removido deixam de segurar o cursor
+                            with self.lock:
+                                for seq in [seq for seq, study_id in self.in_flight_studies.items()
+                                            if study_id == change['ID']]:
+                                    self.in_flight.pop(seq, None)
+                                    del self.in_flight_studies[seq]
+                                    self.counters['gone_studies'] += 1
+                        elif change_type == 'StableStudy':
+                            # Bloqueia quando há `max_in_flight` lotes pendentes
+                            self.slots.acquire()
+                            with self.lock:
+                                self.in_flight[change['Seq']] = change['Seq']
+                                self.in_flight_studies[change['Seq']] = change['ID']
+                            executor.submit(self._deliver, change)
+
+                        with self.lock:
+                            self.counters['events'] += 1
+                            self.last_seq = change['Seq']
+                        self.last_event_time = event_time
+
+                    self._expire_pending()
+                    self.feed.save_cursor(self.safe_cursor())
+                    now = time.time()
+                    if now - last_report >= report_interval:
+                        self.head = max(self.feed.head(), self.last_seq)
+                        self._report(metrics_file)
+                        last_report = now
+            finally:
+                stop.set()
+
+        self.head = max(self.head, self.last_seq)
+        self.feed.save_cursor(self.safe_cursor())
+        self._report(metrics_file)
+        return self.metrics()
+
+    def _report(self, metrics_file=None):
+        metrics = self.metrics()
+        lag = f"{metrics['lag_seconds']:.0f}s" if metrics['lag_seconds'] is not None else 'n/d'
+        print(f"   📈 {metrics['events']} eventos ({metrics['events_per_second']:.1f}/s), "
+              f"{metrics['batches']} lotes, cursor {metrics['cursor']}/{metrics['head']}, "
+              f"atraso {metrics['lag_events']} eventos / {lag}, "
+              f"pendentes {metrics['pending_instances']} instâncias")
+        if metrics_file:
+            with open(metrics_file, 'w') as f:
+                json.dump(metrics, f, indent=2)
+
+def print_sink(batch):
+    """Sink padrão: registrar o lote no terminal"""
+    print(f"   📥 Estudo estável {batch['study_id']} ({batch['patient_id']}, "
+          f"{'/'.join(batch['modalities'])}): {len(batch['new_instances'])} novas de "
+          f"{batch['total_instances']} instâncias")
+
+class WebhookSink:
+    """Sink que notifica o webhook Radiweb (handleStudyReceived em webhook-examples.js)"""
+
+    def __init__(self, url, secret, timeout=30):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['x-webhook-secret'] = secret or ''
+
+    def __call__(self, batch):
+        payload = {
+            'event': 'study_received',
+            'study_id': batch['study_id'],
+            'patient_id': batch['patient_id'],
+            'patient_name': batch['patient_name'],
+            'study_date': batch['study_date'],
+            'modality': '/'.join(batch['modalities']),
+            'timestamp': datetime.now().isoformat(),
+            'instances': batch['total_instances']
+        }
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+
+def main():
+    parser = argparse.ArgumentParser(description='Consumir o log de mudanças (/changes) do Orthanc')
+    parser.add_argument('--url', default='https://pacs.radiweb.com.br',
+                       help='URL base do Orthanc')
+    parser.add_argument('--username', default='admin',
+                       help='Nome de usuário')
+    parser.add_argument('--password', default='admin',
+                       help='Senha')
+    parser.add_argument('--cursor-file', default='.orthanc_changes_cursor',
+                       help='Arquivo onde o cursor (último Seq processado) é persistido')
+    parser.add_argument('--limit', type=int, default=100,
+                       help='Mudanças por página')
+    parser.add_argument('--workers', type=int, default=4,
+                       help='Threads que entregam lotes ao sink')
+    parser.add_argument('--sink', choices=['print', 'webhook'], default='print',
+                       help='Destino dos lotes StableStudy')
+    parser.add_argument('--webhook-url', default=os.environ.get('WEBHOOK_URL'),
+                       help='URL do webhook Radiweb (padrão: $WEBHOOK_URL)')
+    parser.add_argument('--webhook-secret', default=os.environ.get('WEBHOOK_SECRET'),
+                       help='Segredo enviado em x-webhook-secret (padrão: $WEBHOOK_SECRET)')
+    parser.add_argument('--pending-timeout', type=float, default=3600,
+                       help='Segundos de log até descartar NewInstance sem StableStudy (0 = nunca)')
+    parser.add_argument('--follow', action='store_true',
+                       help='Continuar aguardando novas mudanças ao alcançar o fim')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                       help='Espera entre consultas ao alcançar o fim (segundos)')
+    parser.add_argument('--duration', type=float,
+                       help='Encerrar após N segundos')
+    parser.add_argument('--metrics-file',
+                       help='Gravar métricas (JSON) a cada relatório')
+
+    args = parser.parse_args()
+
+    if args.sink == 'webhook':
+        if not args.webhook_url:
+            print("❌ Informe --webhook-url (ou WEBHOOK_URL) para o sink webhook")
+            sys.exit(1)
+        sink = WebhookSink(args.webhook_url, args.webhook_secret)
+    else:
+        sink = print_sink
+
+    feed = ChangesFeed(args.url, args.username, args.password, args.cursor_file, args.limit)
+    consumer = ChangesConsumer(feed, sink, args.workers, pending_timeout=args.pending_timeout)
+
+    print(f"🔄 Consumindo {args.url}/changes a partir do Seq {feed.cursor}")
+    try:
+        metrics = consumer.run(args.follow, args.poll_interval, args.duration,
+                               metrics_file=args.metrics_file)
+    except KeyboardInterrupt:
+        feed.save_cursor(consumer.safe_cursor())
+        metrics = consumer.metrics()
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Erro ao consultar /changes: {e}")
+        sys.exit(1)
+
+    print(f"✅ Cursor em {feed.cursor}: {metrics['events']} eventos, {metrics['batches']} lotes, "
+          f"{metrics['gone_studies']} estudos removidos antes da entrega")
+    sys.exit(0 if not metrics['failed_batches'] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -5,32 +5,107 @@ Autor: Manus AI
 Data: 2024-01-01
 """
 
+import io
 import os
+import re
+import copy
 import sys
+import json
+import time
+import zlib
+import hashlib
+import functools
+import random
+import struct
+import tempfile
 import numpy as np
-from datetime import datetime
+from datetime import datetime, timedelta
 import argparse
+import itertools
+import threading
+import concurrent.futures
 
 try:
     from pydicom.dataset import Dataset, FileDataset
     from pydicom.uid import ExplicitVRLittleEndian, generate_uid
-    from pydicom.uid import CTImageStorage, MRImageStorage, USImageStorage
+    from pydicom.uid import PYDICOM_IMPLEMENTATION_UID
+    from pydicom.uid import DeflatedExplicitVRLittleEndian, RLELossless
+    from pydicom.uid import JPEGLSLossless, JPEG2000Lossless
+    from pydicom.uid import CTImageStorage, MRImageStorage
+    from pydicom.uid import UltrasoundImageStorage as USImageStorage
+    from pydicom.uid import EnhancedCTImageStorage, EnhancedMRImageStorage
+    from pydicom.uid import UltrasoundMultiFrameImageStorage, BreastTomosynthesisImageStorage
 except ImportError:
     print("❌ pydicom não está instalado. Instale com: pip install pydicom")
     sys.exit(1)
 
-def create_test_image(rows=512, cols=512, pattern='gradient'):
+try:
+    from pydicom.pixels import get_encoder  # pydicom >= 3.0
+except ImportError:
+    from pydicom.encoders import get_encoder  # pydicom 2.x
+
+# Transfer syntaxes de saída (nome na linha de comando -> UID)
+TRANSFER_SYNTAXES = {
+    'explicit': ExplicitVRLittleEndian,
+    'deflate': DeflatedExplicitVRLittleEndian,
+    'rle': RLELossless,
+    'jpeg-ls': JPEGLSLossless,
+    'j2k': JPEG2000Lossless
+}
+
+def transfer_syntax_available(name):
+    """Verificar se há codificador instalado para a transfer syntax"""
+    uid = TRANSFER_SYNTAXES[name]
+    if not uid.is_compressed:
+        return True  # Nativa ou deflate: escrita direta pelo pydicom
+    try:
+        return get_encoder(uid).is_available
+    except (NotImplementedError, ValueError):
+        return False
+
+def create_test_image(rows=512, cols=512, pattern='gradient', rng=None):
     """Criar imagem de teste com diferentes padrões"""
-    image = np.zeros((rows, cols), dtype=np.uint16)
+    # Grades de índices (linha/coluna) com broadcast, sem laços Python
+    i = np.arange(rows, dtype=np.int64).reshape(-1, 1)
+    j = np.arange(cols, dtype=np.int64).reshape(1, -1)
     
     if pattern == 'gradient':
         # Gradiente diagonal
+        image = ((i + j) * 65535 / (rows + cols)).astype(np.uint16)
+    
+    elif pattern == 'checkerboard':
+        # Padrão xadrez
+        square_size = 32
+        mask = ((i // square_size) + (j // square_size)) % 2 == 1
+        image = np.where(mask, 65535, 0).astype(np.uint16)
+    
+    elif pattern == 'circles':
+        # Círculos concêntricos
+        # A soma dos quadrados é inteira e exata, então np.sqrt produz
+        # exatamente a mesma distância que o cálculo pixel a pixel.
+        center_x, center_y = rows // 2, cols // 2
+        distance = np.sqrt((i - center_x) ** 2 + (j - center_y) ** 2)
+        image = ((np.sin(distance / 20) + 1) * 32767).astype(np.uint16)
+    
+    elif pattern == 'noise':
+        # Ruído aleatório (rng permite ruído reprodutível)
+        image = (rng or np.random).randint(0, 65536, (rows, cols), dtype=np.uint16)
+    
+    else:
+        image = np.zeros((rows, cols), dtype=np.uint16)
+    
+    return image
+
+def _create_test_image_loop(rows=512, cols=512, pattern='gradient'):
+    """Implementação original pixel a pixel (referência para o benchmark)"""
+    image = np.zeros((rows, cols), dtype=np.uint16)
+    
+    if pattern == 'gradient':
         for i in range(rows):
             for j in range(cols):
                 image[i, j] = int((i + j) * 65535 / (rows + cols))
     
     elif pattern == 'checkerboard':
-        # Padrão xadrez
         square_size = 32
         for i in range(rows):
             for j in range(cols):
@@ -38,20 +113,65 @@ def create_test_image(rows=512, cols=512, pattern='gradient'):
                     image[i, j] = 65535
     
     elif pattern == 'circles':
-        # Círculos concêntricos
         center_x, center_y = rows // 2, cols // 2
         for i in range(rows):
             for j in range(cols):
                 distance = np.sqrt((i - center_x)**2 + (j - center_y)**2)
                 image[i, j] = int((np.sin(distance / 20) + 1) * 32767)
     
-    elif pattern == 'noise':
-        # Ruído aleatório
-        image = np.random.randint(0, 65536, (rows, cols), dtype=np.uint16)
-    
     return image
 
-def create_dicom_dataset(patient_name, patient_id, modality='CT', pattern='gradient'):
+def benchmark_test_image(sizes=((64, 64), (256, 256), (512, 512)),
+                         patterns=('gradient', 'checkerboard', 'circles'),
+                         repeat=5):
+    """Comparar a geração vetorizada com a implementação pixel a pixel"""
+    print("⏱️ Benchmark de create_test_image")
+    print(f"   {'Padrão':<14}{'Tamanho':>10}{'Laços (ms)':>14}"
+          f"{'NumPy (ms)':>14}{'Speedup':>10}  Idêntico")
+    
+    results = []
+    all_identical = True
+    
+    for pattern in patterns:
+        for rows, cols in sizes:
+            start_time = time.perf_counter()
+            reference = _create_test_image_loop(rows, cols, pattern)
+            loop_time = time.perf_counter() - start_time
+            
+            vector_times = []
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                image = create_test_image(rows, cols, pattern)
+                vector_times.append(time.perf_counter() - start_time)
+            vector_time = min(vector_times)
+            
+            identical = image.tobytes() == reference.tobytes()
+            all_identical = all_identical and identical
+            speedup = loop_time / vector_time if vector_time > 0 else float('inf')
+            
+            results.append({
+                'pattern': pattern,
+                'rows': rows,
+                'cols': cols,
+                'loop_ms': loop_time * 1000,
+                'numpy_ms': vector_time * 1000,
+                'speedup': speedup,
+                'identical': identical
+            })
+            
+            print(f"   {pattern:<14}{f'{rows}x{cols}':>10}{loop_time * 1000:>14.1f}"
+                  f"{vector_time * 1000:>14.3f}{speedup:>9.0f}x  "
+                  f"{'✅' if identical else '❌'}")
+    
+    if all_identical:
+        print("✅ Saída byte a byte idêntica à implementação original")
+    else:
+        print("❌ Saída difere da implementação original")
+    
+    return results
+
+def create_dicom_dataset(patient_name, patient_id, modality='CT', pattern='gradient',
+                         image=None, rows=512, cols=512):
     """Criar dataset DICOM completo"""
     
     # Dataset principal
@@ -106,7 +226,7 @@ def create_dicom_dataset(patient_name, patient_id, modality='CT', pattern='gradi
         ds.SequenceName = "T1_SE"
     elif modality == 'US':
         ds.SOPClassUID = USImageStorage
-        ds.TransducerFrequency = "5.0"
+        ds.TransducerFrequency = 5000  # kHz (VR UL)
         ds.MechanicalIndex = "0.5"
         ds.ThermalIndex = "0.3"
     else:
@@ -115,8 +235,8 @@ def create_dicom_dataset(patient_name, patient_id, modality='CT', pattern='gradi
     # Dados da imagem
     ds.SamplesPerPixel = 1
     ds.PhotometricInterpretation = "MONOCHROME2"
-    ds.Rows = 512
-    ds.Columns = 512
+    ds.Rows = rows
+    ds.Columns = cols
     ds.BitsAllocated = 16
     ds.BitsStored = 16
     ds.HighBit = 15
@@ -125,39 +245,133 @@ def create_dicom_dataset(patient_name, patient_id, modality='CT', pattern='gradi
     ds.WindowCenter = "32768"
     ds.WindowWidth = "65536"
     
-    # Criar imagem de teste
-    image = create_test_image(512, 512, pattern)
+    # Criar imagem de teste (ou usar a imagem fornecida)
+    if image is None:
+        image = create_test_image(rows, cols, pattern)
     ds.PixelData = image.tobytes()
     
     return ds
 
-def save_dicom_file(ds, filename):
-    """Salvar dataset como arquivo DICOM"""
+def _file_dataset(ds, filename='', transfer_syntax=ExplicitVRLittleEndian):
+    """Envolver dataset em FileDataset com os metadados Part-10
     
+    Para transfer syntaxes encapsuladas (RLE, JPEG-LS, J2K) o PixelData do
+    dataset é comprimido no próprio objeto.
+    """
     # Metadados do arquivo
     file_meta = Dataset()
     file_meta.MediaStorageSOPClassUID = ds.SOPClassUID
     file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
-    file_meta.ImplementationClassUID = generate_uid()
+    file_meta.ImplementationClassUID = PYDICOM_IMPLEMENTATION_UID
     file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
     
-    # Criar FileDataset
     file_ds = FileDataset(filename, ds, file_meta=file_meta, preamble=b"\0" * 128)
     
+    if transfer_syntax.is_compressed:
+        # Comprime o PixelData e atualiza o TransferSyntaxUID
+        file_ds.compress(transfer_syntax)
+    else:
+        file_meta.TransferSyntaxUID = transfer_syntax
+    
+    return file_ds
+
+def save_dicom_file(ds, filename, transfer_syntax=ExplicitVRLittleEndian):
+    """Salvar dataset como arquivo DICOM"""
+    
+    # Criar FileDataset
+    file_ds = _file_dataset(ds, filename, transfer_syntax)
+    
     # Salvar arquivo
     file_ds.save_as(filename)
     return filename
 
-def create_test_series(patient_name, patient_id, modality='CT', num_images=5, pattern='gradient'):
+def encode_dicom(ds, transfer_syntax=ExplicitVRLittleEndian):
+    """Codificar dataset como Part-10 em memória (BytesIO posicionado no início)"""
+    buffer = io.BytesIO()
+    _file_dataset(ds, transfer_syntax=transfer_syntax).save_as(buffer)
+    buffer.seek(0)
+    return buffer
+
+def encode_with_stats(ds, transfer_syntax=ExplicitVRLittleEndian):
+    """Codificar dataset e medir tempo de codificação e taxa de compressão
+    
+    A taxa compara o tamanho Part-10 na transfer syntax pedida com o
+    mesmo dataset em Explicit VR Little Endian.
+    """
+    native_bytes = encode_dicom(ds).getbuffer().nbytes
+    
+    start_time = time.perf_counter()
+    buffer = encode_dicom(ds, transfer_syntax)
+    encode_time = time.perf_counter() - start_time
+    
+    encoded_bytes = buffer.getbuffer().nbytes
+    stats = {
+        'transfer_syntax': str(transfer_syntax),
+        'native_bytes': native_bytes,
+        'encoded_bytes': encoded_bytes,
+        'ratio': native_bytes / encoded_bytes,
+        'encode_ms': encode_time * 1000
+    }
+    return buffer, stats
+
+def save_dicom_file_with_stats(ds, filename, transfer_syntax=ExplicitVRLittleEndian):
+    """Salvar arquivo DICOM e retornar as estatísticas de codificação"""
+    buffer, stats = encode_with_stats(ds, transfer_syntax)
+    with open(filename, 'wb') as f:
+        f.write(buffer.getbuffer())
+    return stats
+
+def _format_stats(stats):
+    return (f"{stats['encoded_bytes'] / 1024:.0f} KB, taxa {stats['ratio']:.2f}:1, "
+            f"codificação {stats['encode_ms']:.1f} ms")
+
+def benchmark_transfer_syntaxes(modality='CT', pattern='gradient', rows=512, cols=512):
+    """Comparar tamanho e tempo de codificação entre as transfer syntaxes disponíveis"""
+    print(f"🗜️ Transfer syntaxes ({modality}, {pattern}, {rows}x{cols})")
+    print(f"   {'Syntax':<10}{'KB':>10}{'Taxa':>10}{'Cod. (ms)':>12}")
+    
+    base = create_dicom_dataset('TESTE^RADIWEB', 'TEST001', modality, pattern,
+                                rows=rows, cols=cols)
+    results = {}
+    
+    for name in TRANSFER_SYNTAXES:
+        if not transfer_syntax_available(name):
+            print(f"   {name:<10}{'codificador não instalado':>32}")
+            continue
+        
+        _, stats = encode_with_stats(copy.deepcopy(base), TRANSFER_SYNTAXES[name])
+        results[name] = stats
+        print(f"   {name:<10}{stats['encoded_bytes'] / 1024:>10.0f}"
+              f"{stats['ratio']:>9.2f}x{stats['encode_ms']:>12.1f}")
+    
+    return results
+
+def create_slice_image(pattern, index, rows=512, cols=512, rng=None):
+    """Criar a imagem de uma fatia, com variação por fatia no gradiente"""
+    if pattern == 'gradient':
+        image = create_test_image(rows, cols, 'gradient')
+        # Adicionar variação por fatia (saturando em 65535)
+        image = image.astype(np.int64) + (index * 5000)
+        image = np.clip(image, 0, 65535).astype(np.uint16)
+    else:
+        image = create_test_image(rows, cols, pattern, rng=rng)
+    return image
+
+def create_test_series(patient_name, patient_id, modality='CT', num_images=5, pattern='gradient',
+                       output_dir='.', rows=512, cols=512,
+                       transfer_syntax=ExplicitVRLittleEndian):
     """Criar série de imagens DICOM de teste"""
     
+    output_dir = os.path.abspath(output_dir)
     series_uid = generate_uid()
     study_uid = generate_uid()
     filenames = []
     
     for i in range(num_images):
-        # Criar dataset
-        ds = create_dicom_dataset(patient_name, patient_id, modality, pattern)
+        # Criar dataset com a imagem da fatia
+        image = create_slice_image(pattern, i, rows, cols)
+        ds = create_dicom_dataset(patient_name, patient_id, modality, pattern, image=image,
+                                  rows=rows, cols=cols)
         
         # Usar mesmos UIDs para a série
         ds.StudyInstanceUID = study_uid
@@ -169,62 +383,604 @@ def create_test_series(patient_name, patient_id, modality='CT', num_images=5, pa
         ds.SliceLocation = str(i * 5.0)
         ds.ImagePositionPatient = [0, 0, i * 5.0]
         
-        # Criar imagem com variação
-        if pattern == 'gradient':
-            image = create_test_image(512, 512, 'gradient')
-            # Adicionar variação por fatia
-            image = image + (i * 5000)
-            image = np.clip(image, 0, 65535).astype(np.uint16)
-        else:
-            image = create_test_image(512, 512, pattern)
-        
-        ds.PixelData = image.tobytes()
-        
         # Salvar arquivo
-        filename = f"test_{modality.lower()}_{patient_id}_slice_{i+1:03d}.dcm"
-        save_dicom_file(ds, filename)
+        filename = os.path.join(output_dir, f"test_{modality.lower()}_{patient_id}_slice_{i+1:03d}.dcm")
         filenames.append(filename)
         
-        print(f"✅ Criado: {filename}")
+        if transfer_syntax == ExplicitVRLittleEndian:
+            save_dicom_file(ds, filename)
+            print(f"✅ Criado: {filename}")
+        else:
+            stats = save_dicom_file_with_stats(ds, filename, transfer_syntax)
+            print(f"✅ Criado: {filename} ({_format_stats(stats)})")
     
     return filenames
 
+def corpus_uid(seed, *parts):
+    """Gerar UID determinístico a partir da semente e da posição no corpus"""
+    return generate_uid(entropy_srcs=[str(seed)] + [str(part) for part in parts])
+
+def _corpus_tasks(num_patients, studies_per_patient, series_per_study, slices_per_series,
+                  chunk_size):
+    """Dividir o corpus em blocos de fatias (unidade de trabalho do pool)"""
+    for patient in range(num_patients):
+        for study in range(studies_per_patient):
+            for series in range(series_per_study):
+                for start in range(0, slices_per_series, chunk_size):
+                    end = min(start + chunk_size, slices_per_series)
+                    yield (patient, study, series, start, end)
+
+def create_corpus_dataset(seed, patient, study, series, index, modality='CT', pattern='gradient'):
+    """Criar o dataset de uma fatia do corpus (conteúdo determinado pela semente)"""
+    
+    patient_id = f"CORPUS{patient:06d}"
+    patient_name = f"CORPUS^PACIENTE{patient:06d}"
+    
+    # Data/hora do estudo derivadas da semente para que o corpus seja reprodutível
+    study_rng = random.Random(f"{seed}:{patient}:{study}")
+    study_datetime = datetime(2020, 1, 1) + timedelta(
+        days=study_rng.randrange(5 * 365), seconds=study_rng.randrange(86400))
+    
+    rng = np.random.RandomState(zlib.crc32(f"{seed}:{patient}:{study}:{series}:{index}".encode()))
+    image = create_slice_image(pattern, index, rng=rng)
+    ds = create_dicom_dataset(patient_name, patient_id, modality, pattern, image=image)
+    
+    ds.StudyInstanceUID = corpus_uid(seed, patient, study)
+    ds.SeriesInstanceUID = corpus_uid(seed, patient, study, series)
+    ds.SOPInstanceUID = corpus_uid(seed, patient, study, series, index)
+    ds.StudyID = str(study + 1)
+    ds.SeriesNumber = str(series + 1)
+    ds.InstanceNumber = str(index + 1)
+    ds.StudyDate = ds.SeriesDate = study_datetime.strftime("%Y%m%d")
+    ds.StudyTime = ds.SeriesTime = study_datetime.strftime("%H%M%S")
+    ds.AccessionNumber = f"ACC{patient:06d}{study:03d}"
+    ds.SliceLocation = str(index * 5.0)
+    ds.ImagePositionPatient = [0, 0, index * 5.0]
+    
+    return ds
+
+def _generate_corpus_chunk(task, output_dir, seed, modality, pattern,
+                           transfer_syntax=ExplicitVRLittleEndian):
+    """Gerar e gravar um bloco de fatias de uma série (executado nos workers)"""
+    patient, study, series, start, end = task
+    
+    series_dir = os.path.join(output_dir, f"CORPUS{patient:06d}", f"study_{study + 1:03d}",
+                              f"series_{series + 1:03d}")
+    os.makedirs(series_dir, exist_ok=True)
+    
+    total_bytes = 0
+    
+    for i in range(start, end):
+        ds = create_corpus_dataset(seed, patient, study, series, i, modality, pattern)
+        filename = os.path.join(series_dir, f"slice_{i + 1:05d}.dcm")
+        save_dicom_file(ds, filename, transfer_syntax)
+        total_bytes += os.path.getsize(filename)
+    
+    return end - start, total_bytes
+
+def create_test_corpus(output_dir, num_patients=10, studies_per_patient=1, series_per_study=1,
+                       slices_per_series=10, modality='CT', pattern='gradient', seed=0,
+                       workers=None, chunk_size=50, transfer_syntax=ExplicitVRLittleEndian):
+    """Criar corpus com muitos pacientes/estudos/séries em paralelo (multiprocesso)"""
+    
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    
+    total = num_patients * studies_per_patient * series_per_study * slices_per_series
+    tasks = _corpus_tasks(num_patients, studies_per_patient, series_per_study,
+                          slices_per_series, chunk_size)
+    
+    print(f"🏭 Gerando corpus: {total} instâncias com {workers} processos (semente {seed})")
+    
+    done = 0
+    total_bytes = 0
+    start_time = time.perf_counter()
+    
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_generate_corpus_chunk, task, output_dir, seed, modality,
+                                   pattern, transfer_syntax)
+                   for task in tasks]
+        
+        for future in concurrent.futures.as_completed(futures):
+            count, size = future.result()
+            done += count
+            total_bytes += size
+            
+            elapsed = time.perf_counter() - start_time
+            rate = done / elapsed if elapsed > 0 else 0.0
+            print(f"\r   Progresso: {done}/{total} ({done * 100 / total:.1f}%) - "
+                  f"{rate:.0f} inst/s", end='', flush=True)
+    
+    elapsed = time.perf_counter() - start_time
+    print()
+    print(f"✅ Corpus criado em {elapsed:.1f}s: {done} instâncias, "
+          f"{total_bytes / 1024 / 1024:.1f} MB em {output_dir}")
+    
+    return {
+        'instances': done,
+        'bytes': total_bytes,
+        'seconds': elapsed,
+        'output_dir': output_dir
+    }
+
+# SOP Classes multiframe por modalidade (MG = tomossíntese mamária)
+MULTIFRAME_SOP_CLASSES = {
+    'CT': EnhancedCTImageStorage,
+    'MR': EnhancedMRImageStorage,
+    'US': UltrasoundMultiFrameImageStorage,
+    'MG': BreastTomosynthesisImageStorage
+}
+
+def create_multiframe_pixels(frames, rows=512, cols=512, pattern='gradient', path=None):
+    """Criar volume de pixels em disco (numpy.memmap), preenchido quadro a quadro
+    
+    Apenas um quadro por vez é materializado em RAM, então volumes de
+    vários GB podem ser gerados. Sem path, usa um arquivo temporário que
+    deve ser removido pelo chamador (pixels.filename).
+    """
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.raw', prefix='multiframe_')
+        os.close(fd)
+    
+    # '<u2': pixels little endian, prontos para gravar em Explicit VR Little Endian
+    pixels = np.memmap(path, dtype='<u2', mode='w+', shape=(frames, rows, cols))
+    
+    for frame in range(frames):
+        pixels[frame] = create_slice_image(pattern, frame, rows, cols)
+    
+    pixels.flush()
+    return pixels
+
+def create_multiframe_dataset(patient_name, patient_id, pixels, modality='CT', pattern='gradient',
+                              frame_time=33.3):
+    """Criar dataset multiframe (Enhanced CT/MR, US cine ou tomossíntese) sem PixelData
+    
+    O PixelData não é incluído no dataset: save_multiframe_file grava os
+    quadros diretamente do memmap.
+    """
+    if modality not in MULTIFRAME_SOP_CLASSES:
+        raise ValueError(f"Modalidade sem suporte multiframe: {modality}")
+    
+    frames, rows, cols = pixels.shape
+    
+    ds = create_dicom_dataset(patient_name, patient_id, modality, pattern,
+                              image=pixels[0], rows=rows, cols=cols)
+    del ds.PixelData
+    
+    ds.SOPClassUID = MULTIFRAME_SOP_CLASSES[modality]
+    ds.NumberOfFrames = str(frames)
+    ds.SeriesDescription = f"Teste multiframe - {pattern} ({frames} quadros)"
+    
+    if modality == 'US':
+        # Cine: quadros indexados pelo tempo
+        ds.FrameTime = str(frame_time)
+        ds.CineRate = str(round(1000 / frame_time))
+        ds.FrameIncrementPointer = 0x00181063  # FrameTime
+        return ds
+    
+    # Enhanced CT/MR e tomossíntese: geometria em functional groups
+    ds.ImageType = ['ORIGINAL', 'PRIMARY', 'VOLUME', 'NONE']
+    for keyword in ('ImagePositionPatient', 'ImageOrientationPatient', 'SliceLocation',
+                    'SliceThickness', 'PixelSpacing'):
+        delattr(ds, keyword)
+    
+    pixel_measures = Dataset()
+    pixel_measures.PixelSpacing = [0.5, 0.5]
+    pixel_measures.SliceThickness = "5.0"
+    plane_orientation = Dataset()
+    plane_orientation.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    
+    shared = Dataset()
+    shared.PixelMeasuresSequence = [pixel_measures]
+    shared.PlaneOrientationSequence = [plane_orientation]
+    ds.SharedFunctionalGroupsSequence = [shared]
+    
+    per_frame = []
+    for frame in range(frames):
+        plane_position = Dataset()
+        plane_position.ImagePositionPatient = [0, 0, frame * 5.0]
+        frame_content = Dataset()
+        frame_content.InStackPositionNumber = frame + 1
+        frame_content.DimensionIndexValues = [1, frame + 1]
+        
+        item = Dataset()
+        item.PlanePositionSequence = [plane_position]
+        item.FrameContentSequence = [frame_content]
+        per_frame.append(item)
+    ds.PerFrameFunctionalGroupsSequence = per_frame
+    
+    return ds
+
+def save_multiframe_file(ds, pixels, filename):
+    """Salvar dataset multiframe gravando o PixelData em fluxo a partir do memmap"""
+    length = pixels.size * pixels.itemsize
+    if length > 0xFFFFFFFE:
+        raise ValueError(f"PixelData nativo limitado a 4 GB ({length} bytes solicitados)")
+    
+    # Cabeçalho e atributos via pydicom; PixelData (7FE0,0010) é o último elemento
+    save_dicom_file(ds, filename)
+    
+    with open(filename, 'ab') as f:
+        f.write(struct.pack('<HH2sHI', 0x7FE0, 0x0010, b'OW', 0, length))
+        for frame in pixels:
+            f.write(memoryview(np.ascontiguousarray(frame)).cast('B'))
+    
+    return filename
+
+def iter_test_instances(num_instances=None, modality='CT', pattern='gradient',
+                        slices_per_series=100, series_per_study=1, studies_per_patient=1,
+                        seed=0, output='dataset', transfer_syntax=ExplicitVRLittleEndian):
+    """Gerar instâncias sob demanda, sem gravar em disco
+    
+    Percorre pacientes/estudos/séries/fatias na mesma ordem do corpus e
+    produz uma instância por vez (memória constante). num_instances=None
+    gera indefinidamente. output: 'dataset' (pydicom Dataset), 'bytesio'
+    (Part-10 em BytesIO) ou 'memoryview' (Part-10 como memoryview);
+    transfer_syntax vale apenas para as saídas codificadas.
+    """
+    if output not in ('dataset', 'bytesio', 'memoryview'):
+        raise ValueError(f"Formato de saída inválido: {output}")
+    if min(slices_per_series, series_per_study, studies_per_patient) < 1:
+        # Com algum eixo vazio nenhum paciente produz instâncias: o laço nunca terminaria
+        raise ValueError("slices_per_series, series_per_study e studies_per_patient devem ser ≥ 1")
+    
+    produced = 0
+    for patient in itertools.count():
+        for study in range(studies_per_patient):
+            for series in range(series_per_study):
+                for i in range(slices_per_series):
+                    if num_instances is not None and produced >= num_instances:
+                        return
+                    
+                    ds = create_corpus_dataset(seed, patient, study, series, i, modality, pattern)
+                    produced += 1
+                    
+                    if output == 'dataset':
+                        yield ds
+                    elif output == 'bytesio':
+                        yield encode_dicom(ds, transfer_syntax)
+                    else:
+                        yield encode_dicom(ds, transfer_syntax).getbuffer()
+
+# Matrizes de teste: cada bloco é o produto cartesiano dos seus eixos
+TEST_MATRICES = {
+    'basic': [
+        {'modality': ['CT'], 'pattern': ['gradient']},
+        {'modality': ['MR'], 'pattern': ['circles']},
+        {'modality': ['US'], 'pattern': ['noise']}
+    ],
+    'full': [
+        {'modality': ['CT', 'MR', 'US'], 'pattern': ['gradient', 'circles', 'noise'],
+         'size': [256, 512], 'frames': [1, 8], 'transfer_syntax': ['explicit', 'rle']},
+        {'modality': ['MG'], 'pattern': ['gradient'], 'size': [[1024, 768]], 'frames': [16]}
+    ]
+}
+
+# Valor de cada eixo quando o bloco não o especifica
+MATRIX_DEFAULTS = {'modality': 'CT', 'pattern': 'gradient', 'size': 512, 'frames': 1,
+                   'transfer_syntax': 'explicit'}
+
+def load_test_matrix(spec):
+    """Matriz pelo nome (TEST_MATRICES), por arquivo JSON ou já como lista de blocos"""
+    if isinstance(spec, list):
+        return spec
+    if spec in TEST_MATRICES:
+        return TEST_MATRICES[spec]
+    with open(spec) as f:
+        return json.load(f)
+
+def expand_test_matrix(spec):
+    """Expandir os blocos da matriz em casos únicos, na ordem de declaração"""
+    cases = []
+    for block in load_test_matrix(spec):
+        unknown = set(block) - set(MATRIX_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Eixo desconhecido na matriz de teste: {', '.join(sorted(unknown))}")
+        
+        axes = []
+        for axis, default in MATRIX_DEFAULTS.items():
+            values = block.get(axis, [default])
+            axes.append(values if isinstance(values, list) else [values])
+        
+        for values in itertools.product(*axes):
+            case = dict(zip(MATRIX_DEFAULTS, values))
+            size = case['size']
+            case['size'] = [size, size] if isinstance(size, int) else list(size)
+            if case['transfer_syntax'] not in TRANSFER_SYNTAXES:
+                raise ValueError(f"Transfer syntax desconhecida: {case['transfer_syntax']}")
+            if case['frames'] > 1 and case['modality'] not in MULTIFRAME_SOP_CLASSES:
+                raise ValueError(f"Modalidade sem suporte multiframe: {case['modality']}")
+            if case['modality'] == 'MG' and case['frames'] == 1:
+                continue  # Tomossíntese só existe como multiframe
+            if case not in cases:
+                cases.append(case)
+    return cases
+
+@functools.lru_cache(maxsize=1)
+def _generator_version():
+    """Hash deste módulo: mudanças no gerador invalidam o cache"""
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+# Nomes gerados por test_case_filename (modalidade_padrão_LxC_Nf_sintaxe_hash.dcm)
+MATRIX_FILENAME = re.compile(r'^[a-z]+_[a-z]+_\d+x\d+_\d+f_[\w-]+_[0-9a-f]{16}\.dcm$')
+# Temporários de _generate_test_case: {nome}.{thread}.tmp e, no multiframe, .tmp.raw
+MATRIX_TEMP_FILENAME = re.compile(MATRIX_FILENAME.pattern[:-1] + r'\.\d+\.tmp(\.raw)?$')
+
+def test_case_filename(case):
+    """Nome endereçado pelo conteúdo: eixos legíveis + hash do caso e do gerador"""
+    key = hashlib.sha256(json.dumps({'case': case, 'generator': _generator_version()},
+                                    sort_keys=True).encode()).hexdigest()
+    rows, cols = case['size']
+    return (f"{case['modality'].lower()}_{case['pattern']}_{rows}x{cols}_{case['frames']}f_"
+            f"{case['transfer_syntax']}_{key[:16]}.dcm")
+
+def _generate_test_case(case, filename):
+    """Gerar um caso da matriz em um arquivo temporário e publicá-lo atomicamente"""
+    modality, pattern, frames = case['modality'], case['pattern'], case['frames']
+    rows, cols = case['size']
+    transfer_syntax = TRANSFER_SYNTAXES[case['transfer_syntax']]
+    patient_name = f"TESTE^RADIWEB^{modality}"
+    patient_id = f"TEST_{modality}_001"
+    temp_path = f"{filename}.{threading.get_ident()}.tmp"
+    
+    try:
+        if frames > 1:
+            pixels = create_multiframe_pixels(frames, rows, cols, pattern, path=temp_path + '.raw')
+            try:
+                ds = create_multiframe_dataset(patient_name, patient_id, pixels, modality, pattern)
+                if transfer_syntax == ExplicitVRLittleEndian:
+                    save_multiframe_file(ds, pixels, temp_path)
+                else:
+                    ds.PixelData = pixels.tobytes()
+                    save_dicom_file(ds, temp_path, transfer_syntax)
+            finally:
+                raw_path = pixels.filename
+                del pixels
+                os.remove(raw_path)
+        else:
+            ds = create_dicom_dataset(patient_name, patient_id, modality, pattern,
+                                      image=create_test_image(rows, cols, pattern),
+                                      rows=rows, cols=cols)
+            save_dicom_file(ds, temp_path, transfer_syntax)
+        os.replace(temp_path, filename)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return os.path.getsize(filename)
+
+def prune_test_matrix(cache_dir, keep, temp_max_age=3600):
+    """Remover de `cache_dir` os arquivos da matriz (e temporários) fora de `keep`
+    
+    Só nomes no formato de test_case_filename são considerados; outros .dcm
+    do diretório não são tocados. Temporários (.tmp e .tmp.raw) só saem
+    depois de `temp_max_age` segundos sem modificação, para não apagar os
+    de outra execução em andamento no mesmo diretório. Retorna o número de
+    arquivos removidos.
+    """
+    keep = {os.path.basename(path) for path in keep}
+    now = time.time()
+    removed = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            if MATRIX_TEMP_FILENAME.match(name):
+                if now - os.path.getmtime(path) < temp_max_age:
+                    continue
+            elif name in keep or not MATRIX_FILENAME.match(name):
+                continue
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            print(f"   ⚠️ Não foi possível remover {name}: {e}")
+    return removed
+
+def create_test_matrix(spec='basic', cache_dir='./test_data', workers=None, prune=False):
+    """Gerar os casos da matriz em paralelo (threads, um só processo), com cache em disco
+    
+    Cada caso vira um arquivo cujo nome inclui o hash do caso e do gerador;
+    se ele já existe em `cache_dir`, é reaproveitado sem ser gerado de novo.
+    Casos com transfer syntax sem codificador instalado são pulados. Com
+    `prune`, arquivos da matriz que não pertencem a esta (de outro gerador
+    ou de casos removidos) são apagados. Retorna os caminhos na ordem dos casos.
+    """
+    cache_dir = os.path.abspath(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    cases = expand_test_matrix(spec)
+    
+    available = [case for case in cases if transfer_syntax_available(case['transfer_syntax'])]
+    for name in sorted({case['transfer_syntax'] for case in cases} -
+                       {case['transfer_syntax'] for case in available}):
+        print(f"   ⚠️ Codificador para {name} não instalado - casos pulados")
+    
+    paths = [os.path.join(cache_dir, test_case_filename(case)) for case in available]
+    missing = [(case, path) for case, path in zip(available, paths) if not os.path.exists(path)]
+    
+    print(f"🧪 Matriz de teste: {len(available)} casos, {len(available) - len(missing)} em cache, "
+          f"{len(missing)} a gerar")
+    if prune:
+        removed = prune_test_matrix(cache_dir, paths)
+        if removed:
+            print(f"   🧹 {removed} arquivo(s) obsoleto(s) removido(s) de {cache_dir}")
+    
+    start_time = time.perf_counter()
+    total_bytes = 0
+    if missing:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            futures = {executor.submit(_generate_test_case, case, path): path
+                       for case, path in missing}
+            for future in concurrent.futures.as_completed(futures):
+                total_bytes += future.result()
+                print(f"   ✅ {os.path.basename(futures[future])}")
+    elapsed = time.perf_counter() - start_time
+    
+    if missing:
+        print(f"✅ {len(missing)} arquivos gerados em {elapsed:.2f}s "
+              f"({total_bytes / 1024 / 1024:.1f} MB) em {cache_dir}")
+    return paths
+
+def positive_int(value):
+    """Tipo argparse: inteiro ≥ 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"deve ser ≥ 1: {value}")
+    return number
+
 def main():
     parser = argparse.ArgumentParser(description='Criar imagens DICOM de teste')
     parser.add_argument('--patient-name', default='TESTE^RADIWEB', 
                        help='Nome do paciente (formato: SOBRENOME^NOME)')
     parser.add_argument('--patient-id', default='TEST001', 
                        help='ID do paciente')
-    parser.add_argument('--modality', choices=['CT', 'MR', 'US'], default='CT',
-                       help='Modalidade DICOM')
+    parser.add_argument('--modality', choices=['CT', 'MR', 'US', 'MG'], default='CT',
+                       help='Modalidade DICOM (MG apenas com --frames > 1)')
     parser.add_argument('--pattern', choices=['gradient', 'checkerboard', 'circles', 'noise'], 
                        default='gradient', help='Padrão da imagem')
     parser.add_argument('--num-images', type=int, default=1,
                        help='Número de imagens na série')
     parser.add_argument('--output-dir', default='.',
                        help='Diretório de saída')
+    parser.add_argument('--rows', type=int, default=512,
+                       help='Linhas da matriz da imagem')
+    parser.add_argument('--cols', type=int, default=512,
+                       help='Colunas da matriz da imagem')
+    parser.add_argument('--frames', type=int, default=1,
+                       help='Quadros por instância (>1 gera Enhanced CT/MR, US cine ou tomossíntese MG)')
+    parser.add_argument('--transfer-syntax', choices=list(TRANSFER_SYNTAXES), default='explicit',
+                       help='Transfer syntax de saída (jpeg-ls/j2k exigem codificadores pydicom instalados)')
+    parser.add_argument('--benchmark', action='store_true',
+                       help='Medir a geração de pixels (NumPy vs laços) e sair')
+    parser.add_argument('--compare-syntaxes', action='store_true',
+                       help='Comparar taxa de compressão e tempo de codificação por transfer syntax e sair')
+    
+    corpus = parser.add_argument_group('modo corpus (geração em massa multiprocesso)')
+    corpus.add_argument('--corpus', action='store_true',
+                       help='Gerar corpus com muitos pacientes/estudos/séries')
+    corpus.add_argument('--patients', type=int, default=10,
+                       help='Número de pacientes do corpus')
+    corpus.add_argument('--studies-per-patient', type=positive_int, default=1,
+                       help='Estudos por paciente')
+    corpus.add_argument('--series-per-study', type=positive_int, default=1,
+                       help='Séries por estudo')
+    corpus.add_argument('--slices-per-series', type=positive_int, default=10,
+                       help='Fatias (instâncias) por série')
+    corpus.add_argument('--seed', type=int, default=0,
+                       help='Semente dos UIDs e dados (mesma semente = mesmo corpus)')
+    corpus.add_argument('--workers', type=int, default=None,
+                       help='Número de processos (padrão: número de CPUs)')
+    corpus.add_argument('--chunk-size', type=positive_int, default=50,
+                       help='Fatias por tarefa enviada ao pool')
+    corpus.add_argument('--stream', type=int, metavar='N',
+                       help='Gerar N instâncias Part-10 em memória (sem disco) e medir a vazão')
+    parser.add_argument('--matrix',
+                       help='Gerar a matriz de teste (basic, full ou arquivo JSON) em --output-dir, com cache')
+    parser.add_argument('--prune', action='store_true',
+                       help='Com --matrix, apagar de --output-dir os arquivos de matriz obsoletos')
     
     args = parser.parse_args()
     
+    if args.benchmark:
+        results = benchmark_test_image()
+        sys.exit(0 if all(r['identical'] for r in results) else 1)
+    
+    if args.compare_syntaxes:
+        benchmark_transfer_syntaxes(args.modality if args.modality != 'MG' else 'CT',
+                                    args.pattern, args.rows, args.cols)
+        return
+    
+    if args.matrix:
+        create_test_matrix(args.matrix, args.output_dir, args.workers, args.prune)
+        return
+    
+    if not transfer_syntax_available(args.transfer_syntax):
+        print(f"❌ Codificador para {args.transfer_syntax} não instalado "
+              f"(ex.: pip install pylibjpeg pylibjpeg-openjpeg pyjpegls)")
+        sys.exit(1)
+    transfer_syntax = TRANSFER_SYNTAXES[args.transfer_syntax]
+    
+    if args.stream:
+        print(f"🌊 Gerando {args.stream} instâncias em memória...")
+        total_bytes = 0
+        start_time = time.perf_counter()
+        for buffer in iter_test_instances(args.stream, args.modality, args.pattern,
+                                          args.slices_per_series, args.series_per_study,
+                                          args.studies_per_patient, args.seed, 'memoryview',
+                                          transfer_syntax):
+            total_bytes += buffer.nbytes
+        elapsed = time.perf_counter() - start_time
+        print(f"✅ {args.stream} instâncias em {elapsed:.2f}s - "
+              f"{args.stream / elapsed:.0f} inst/s, {total_bytes / 1024 / 1024 / elapsed:.1f} MB/s")
+        return
+    
+    if args.corpus:
+        create_test_corpus(args.output_dir, args.patients, args.studies_per_patient,
+                           args.series_per_study, args.slices_per_series,
+                           args.modality, args.pattern, args.seed,
+                           args.workers, args.chunk_size, transfer_syntax)
+        return
+    
+    if args.modality == 'MG' and args.frames == 1:
+        print("❌ Modalidade MG (tomossíntese) requer --frames > 1")
+        sys.exit(1)
+    
+    if args.frames > 1 and transfer_syntax != ExplicitVRLittleEndian:
+        print("❌ Instâncias multiframe em memmap são gravadas apenas em Explicit VR Little Endian")
+        sys.exit(1)
+    
     # Criar diretório de saída
     os.makedirs(args.output_dir, exist_ok=True)
-    os.chdir(args.output_dir)
     
     print(f"🏥 Criando imagens DICOM de teste...")
     print(f"   Paciente: {args.patient_name} ({args.patient_id})")
     print(f"   Modalidade: {args.modality}")
     print(f"   Padrão: {args.pattern}")
+    print(f"   Transfer syntax: {args.transfer_syntax}")
+    print(f"   Matriz: {args.rows}x{args.cols}")
     print(f"   Número de imagens: {args.num_images}")
+    if args.frames > 1:
+        print(f"   Quadros por instância: {args.frames}")
     print(f"   Diretório: {args.output_dir}")
     print()
     
-    if args.num_images == 1:
+    if args.frames > 1:
+        # Criar instância multiframe com pixels em memmap
+        output_dir = os.path.abspath(args.output_dir)
+        raw_path = os.path.join(output_dir, f".pixels_{args.patient_id}.raw")
+        filename = os.path.join(output_dir,
+                                f"test_{args.modality.lower()}_{args.patient_id}_mf.dcm")
+        
+        start_time = time.perf_counter()
+        try:
+            pixels = create_multiframe_pixels(args.frames, args.rows, args.cols,
+                                              args.pattern, path=raw_path)
+            ds = create_multiframe_dataset(args.patient_name, args.patient_id, pixels,
+                                           args.modality, args.pattern)
+            save_multiframe_file(ds, pixels, filename)
+            del pixels
+        finally:
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+        elapsed = time.perf_counter() - start_time
+        
+        size_mb = os.path.getsize(filename) / 1024 / 1024
+        print(f"✅ Criado: {filename}")
+        print(f"   {args.frames} quadros, {size_mb:.1f} MB em {elapsed:.2f}s")
+        print(f"   SOP Instance UID: {ds.SOPInstanceUID}")
+        
+    elif args.num_images == 1:
         # Criar imagem única
         ds = create_dicom_dataset(args.patient_name, args.patient_id, 
-                                args.modality, args.pattern)
-        filename = f"test_{args.modality.lower()}_{args.patient_id}.dcm"
-        save_dicom_file(ds, filename)
-        print(f"✅ Criado: {filename}")
+                                args.modality, args.pattern,
+                                rows=args.rows, cols=args.cols)
+        filename = os.path.join(os.path.abspath(args.output_dir),
+                                f"test_{args.modality.lower()}_{args.patient_id}.dcm")
+        if transfer_syntax == ExplicitVRLittleEndian:
+            save_dicom_file(ds, filename)
+            print(f"✅ Criado: {filename}")
+        else:
+            stats = save_dicom_file_with_stats(ds, filename, transfer_syntax)
+            print(f"✅ Criado: {filename} ({_format_stats(stats)})")
         
         # Mostrar informações
         print(f"\n📋 Informações do arquivo:")
@@ -235,14 +991,15 @@ def main():
     else:
         # Criar série de imagens
         filenames = create_test_series(args.patient_name, args.patient_id,
-                                     args.modality, args.num_images, args.pattern)
+                                     args.modality, args.num_images, args.pattern,
+                                     args.output_dir, args.rows, args.cols, transfer_syntax)
         
         print(f"\n✅ Série criada com {len(filenames)} imagens")
     
     print(f"\n🚀 Para enviar ao Orthanc:")
     print(f"   curl -X POST -u admin:admin \\")
     print(f"     -H 'Content-Type: application/dicom' \\")
-    print(f"     --data-binary @{filename if args.num_images == 1 else filenames[0]} \\")
+    print(f"     --data-binary @{filenames[0] if args.frames == 1 and args.num_images > 1 else filename} \\")
     print(f"     https://pacs.radiweb.com.br/instances")
 
 if __name__ == "__main__":
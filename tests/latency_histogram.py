@@ -0,0 +1,89 @@
+"""
+Histograma de latência no estilo HDR para os testes do Orthanc PACS Radiweb
+Autor: Manus AI
+Data: 2024-01-01
+"""
+
+import math
+import threading
+
+class LatencyHistogram:
+    """Histograma log-linear de latências (estilo HdrHistogram)
+
+    Os valores são registrados em microssegundos com precisão relativa
+    definida por `significant_digits` (3 dígitos = erro < 0,1%), usando
+    buckets esparsos: memória constante por faixa de valores, não por
+    amostra. Seguro para uso concorrente entre threads.
+    """
+
+    def __init__(self, significant_digits=3):
+        sub_bucket_count = 2 ** int(math.ceil(math.log2(2 * 10 ** significant_digits)))
+        self._sub_bucket_bits = sub_bucket_count.bit_length() - 1
+        self._counts = {}
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value):
+        """Menor valor equivalente (chave do bucket) de um valor em µs"""
+        shift = max(value.bit_length() - self._sub_bucket_bits, 0)
+        return (value >> shift) << shift, (1 << shift) - 1
+
+    def record(self, seconds):
+        """Registrar uma latência em segundos"""
+        value = max(int(round(seconds * 1_000_000)), 0)
+        key, _ = self._bucket(value)
+
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self.count += 1
+            self.total += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Somar as amostras de outro histograma a este"""
+        with self._lock:
+            for key, count in other._counts.items():
+                self._counts[key] = self._counts.get(key, 0) + count
+            self.count += other.count
+            self.total += other.total
+            if other.count:
+                self.min = other.min if self.min is None else min(self.min, other.min)
+                self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, p):
+        """Latência (segundos) no percentil p, como o maior valor equivalente do bucket"""
+        if not self.count:
+            return 0.0
+
+        target = max(int(math.ceil(p / 100.0 * self.count)), 1)
+        seen = 0
+        for key in sorted(self._counts):
+            seen += self._counts[key]
+            if seen >= target:
+                _, width = self._bucket(key)
+                return min(key + width, self.max) / 1_000_000
+        return self.max / 1_000_000
+
+    @property
+    def mean(self):
+        return self.total / self.count / 1_000_000 if self.count else 0.0
+
+    def to_dict(self, percentiles=(50, 90, 99, 99.9)):
+        """Resumo serializável em JSON (valores em milissegundos)"""
+        return {
+            'count': self.count,
+            'min_ms': (self.min or 0) / 1000,
+            'mean_ms': self.mean * 1000,
+            'max_ms': (self.max or 0) / 1000,
+            'percentiles_ms': {f"p{p:g}": self.percentile(p) * 1000 for p in percentiles},
+            'buckets_us': {str(key): count for key, count in sorted(self._counts.items())}
+        }
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        """Linha de texto com os percentis em milissegundos"""
+        parts = [f"p{p:g} {self.percentile(p) * 1000:.1f} ms" for p in percentiles]
+        return ", ".join(parts) + f", máx {(self.max or 0) / 1000:.1f} ms"
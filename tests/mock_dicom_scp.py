@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+SCP DICOM local que imita o Orthanc PACS Radiweb para benchmarks offline
+Autor: Manus AI
+Data: 2024-01-01
+"""
+
+import io
+import os
+import sys
+import time
+import fnmatch
+import argparse
+import threading
+from datetime import datetime
+
+try:
+    from pynetdicom import AE, evt, debug_logger
+    from pynetdicom import StoragePresentationContexts, ALL_TRANSFER_SYNTAXES
+    from pynetdicom import DEFAULT_TRANSFER_SYNTAXES
+    from pynetdicom.sop_class import (
+        Verification,
+        PatientRootQueryRetrieveInformationModelFind,
+        PatientRootQueryRetrieveInformationModelMove,
+        PatientRootQueryRetrieveInformationModelGet,
+        StudyRootQueryRetrieveInformationModelFind,
+        StudyRootQueryRetrieveInformationModelMove,
+        StudyRootQueryRetrieveInformationModelGet
+    )
+    from pydicom import dcmread
+    from pydicom.dataset import Dataset
+    from pydicom.uid import RLELossless, JPEGLSLossless, JPEG2000Lossless, JPEGBaseline8Bit
+except ImportError:
+    print("❌ pynetdicom não está instalado. Instale com: pip install pynetdicom")
+    sys.exit(1)
+
+# Atributos indexados por nível (equivalentes às "main DICOM tags" do Orthanc)
+INDEX_TAGS = {
+    'PATIENT': ['PatientID', 'PatientName', 'PatientBirthDate', 'PatientSex'],
+    'STUDY': ['StudyInstanceUID', 'StudyDate', 'StudyTime', 'StudyDescription',
+              'AccessionNumber', 'StudyID', 'ReferringPhysicianName'],
+    'SERIES': ['SeriesInstanceUID', 'Modality', 'SeriesNumber', 'SeriesDescription'],
+    'IMAGE': ['SOPInstanceUID', 'SOPClassUID', 'InstanceNumber']
+}
+
+LEVELS = ['PATIENT', 'STUDY', 'SERIES', 'IMAGE']
+
+# Chave única de cada nível
+LEVEL_KEYS = {
+    'PATIENT': 'PatientID',
+    'STUDY': 'StudyInstanceUID',
+    'SERIES': 'SeriesInstanceUID',
+    'IMAGE': 'SOPInstanceUID'
+}
+
+# Transfer syntaxes propostas nas sub-associações de C-MOVE
+MOVE_TRANSFER_SYNTAXES = DEFAULT_TRANSFER_SYNTAXES + [
+    RLELossless, JPEGLSLossless, JPEG2000Lossless, JPEGBaseline8Bit
+]
+
+def as_query_string(value):
+    """Normalizar valor de chave de busca (multivalorado vira lista separada por '\\')"""
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)) or type(value).__name__ == 'MultiValue':
+        return '\\'.join(str(item) for item in value)
+    return str(value)
+
+def match_value(value, pattern, vr=None):
+    """Casar valor do índice com chave de busca DICOM (lista, intervalo ou curinga)"""
+    if pattern in (None, ''):
+        return True
+    value = '' if value is None else str(value)
+    pattern = str(pattern)
+
+    if '\\' in pattern:
+        # Lista de valores (ex.: vários UIDs)
+        return any(match_value(value, item, vr) for item in pattern.split('\\'))
+    if vr in ('DA', 'TM', 'DT') and '-' in pattern:
+        # Intervalo de datas/horas: 'inicio-fim', '-fim' ou 'inicio-'
+        start, end = pattern.split('-', 1)
+        return (not start or value >= start) and (not end or value[:len(end)] <= end)
+    if '*' in pattern or '?' in pattern:
+        return fnmatch.fnmatchcase(value, pattern)
+    return value == pattern
+
+class InstanceIndex:
+    """Índice em memória (ou em disco) das instâncias recebidas"""
+
+    def __init__(self, storage_dir=None):
+        self.storage_dir = storage_dir
+        self.records = {}
+        self.lock = threading.Lock()
+        if storage_dir:
+            os.makedirs(storage_dir, exist_ok=True)
+
+    def add(self, encoded):
+        """Indexar uma instância Part-10 (bytes) e armazená-la"""
+        header = dcmread(io.BytesIO(encoded), stop_before_pixels=True)
+
+        record = {}
+        for level in LEVELS:
+            for keyword in INDEX_TAGS[level]:
+                record[keyword] = str(header.get(keyword, ''))
+
+        if self.storage_dir:
+            path = os.path.join(self.storage_dir, f"{record['SOPInstanceUID']}.dcm")
+            with open(path, 'wb') as f:
+                f.write(encoded)
+            record['_path'] = path
+        else:
+            record['_data'] = encoded
+        record['_size'] = len(encoded)
+
+        with self.lock:
+            self.records[record['SOPInstanceUID']] = record
+        return record
+
+    def load(self, record):
+        """Ler o dataset completo de uma instância indexada"""
+        if '_path' in record:
+            return dcmread(record['_path'])
+        return dcmread(io.BytesIO(record['_data']))
+
+    def find(self, identifier):
+        """Resolver consulta C-FIND: um registro agregado por entidade do nível pedido"""
+        level = identifier.QueryRetrieveLevel
+        level_index = LEVELS.index(level)
+        visible = set(keyword for lvl in LEVELS[:level_index + 1] for keyword in INDEX_TAGS[lvl])
+
+        filters = {}
+        modalities_filter = None
+        for elem in identifier:
+            keyword = elem.keyword
+            pattern = as_query_string(elem.value)
+            if keyword in ('QueryRetrieveLevel', 'SpecificCharacterSet'):
+                continue
+            if keyword == 'ModalitiesInStudy':
+                modalities_filter = pattern
+                continue
+            if keyword in visible and pattern:
+                filters[keyword] = (pattern, elem.VR)
+
+        with self.lock:
+            records = list(self.records.values())
+
+        groups = {}
+        for record in records:
+            if all(match_value(record[k], pattern, vr) for k, (pattern, vr) in filters.items()):
+                groups.setdefault(record[LEVEL_KEYS[level]], []).append(record)
+
+        for key, members in groups.items():
+            if level == 'STUDY':
+                modalities = sorted(set(r['Modality'] for r in members if r['Modality']))
+                if modalities_filter and not any(match_value(m, modalities_filter)
+                                                 for m in modalities):
+                    continue
+            yield key, members
+
+    def select(self, identifier):
+        """Instâncias abrangidas por uma requisição C-MOVE/C-GET"""
+        selected = []
+        for _, members in self.find(identifier):
+            selected.extend(members)
+        return selected
+
+class MockOrthancSCP:
+    """SCP DICOM local com C-ECHO, C-STORE, C-FIND, C-MOVE e C-GET
+
+    `latency` (segundos) é somado a cada requisição e resposta de busca;
+    `bandwidth` (bytes/s) limita a velocidade de recepção e envio de
+    instâncias. `destinations` mapeia AE Title -> (host, porta) para C-MOVE.
+    """
+
+    def __init__(self, ae_title='RADIWEB_PACS', port=4242, storage_dir=None,
+                 latency=0.0, bandwidth=None, destinations=None, host=''):
+        self.ae_title = ae_title
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.destinations = destinations or {}
+        self.index = InstanceIndex(storage_dir)
+        self.server = None
+        self.counters = {'echo': 0, 'store': 0, 'find': 0, 'move': 0, 'get': 0}
+
+        self.ae = AE(ae_title=ae_title)
+        self.ae.maximum_associations = 64
+        self.ae.maximum_pdu_size = 0
+        self.ae.add_supported_context(Verification)
+        for model in (PatientRootQueryRetrieveInformationModelFind,
+                      PatientRootQueryRetrieveInformationModelMove,
+                      PatientRootQueryRetrieveInformationModelGet,
+                      StudyRootQueryRetrieveInformationModelFind,
+                      StudyRootQueryRetrieveInformationModelMove,
+                      StudyRootQueryRetrieveInformationModelGet):
+            self.ae.add_supported_context(model)
+        for context in StoragePresentationContexts:
+            # Recebe em qualquer transfer syntax; envia via C-GET como SCP
+            self.ae.add_supported_context(context.abstract_syntax, ALL_TRANSFER_SYNTAXES,
+                                          scu_role=True, scp_role=True)
+            self.ae.add_requested_context(context.abstract_syntax, MOVE_TRANSFER_SYNTAXES)
+
+    def _delay(self, size=0):
+        """Aplicar latência e limite de banda simulados"""
+        delay = self.latency
+        if self.bandwidth and size:
+            delay += size / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    def handle_echo(self, event):
+        self.counters['echo'] += 1
+        self._delay()
+        return 0x0000
+
+    def handle_store(self, event):
+        encoded = event.encoded_dataset()
+        self._delay(len(encoded))
+        try:
+            self.index.add(encoded)
+        except Exception as e:
+            print(f"   ❌ Erro ao indexar instância: {e}")
+            return 0xC000
+        self.counters['store'] += 1
+        return 0x0000
+
+    def handle_find(self, event):
+        self.counters['find'] += 1
+        identifier = event.identifier
+        level = identifier.QueryRetrieveLevel
+
+        for key, members in self.index.find(identifier):
+            if event.is_cancelled:
+                yield (0xFE00, None)
+                return
+
+            self._delay()
+            first = members[0]
+            response = Dataset()
+            for elem in identifier:
+                keyword = elem.keyword
+                if keyword in first:
+                    setattr(response, keyword, first[keyword])
+                elif keyword == 'ModalitiesInStudy':
+                    response.ModalitiesInStudy = sorted(
+                        set(r['Modality'] for r in members if r['Modality']))
+                elif keyword == 'NumberOfStudyRelatedInstances':
+                    response.NumberOfStudyRelatedInstances = len(members)
+                elif keyword == 'NumberOfSeriesRelatedInstances':
+                    response.NumberOfSeriesRelatedInstances = len(members)
+                elif keyword:
+                    response.add_new(elem.tag, elem.VR, elem.value)
+            response.QueryRetrieveLevel = level
+            response.RetrieveAETitle = self.ae_title
+            yield (0xFF00, response)
+
+    def _retrieve(self, event):
+        records = self.index.select(event.identifier)
+        yield len(records)
+
+        for record in records:
+            if event.is_cancelled:
+                yield (0xFE00, None)
+                return
+            self._delay(record['_size'])
+            yield (0xFF00, self.index.load(record))
+
+    def handle_move(self, event):
+        self.counters['move'] += 1
+        destination = self.destinations.get(event.move_destination.strip())
+        if destination is None:
+            # Destino desconhecido: 0xA801
+            yield (None, None)
+            return
+        yield destination
+        yield from self._retrieve(event)
+
+    def handle_get(self, event):
+        self.counters['get'] += 1
+        yield from self._retrieve(event)
+
+    def preload(self, count, modality='CT', slices_per_series=10):
+        """Popular o índice com instâncias sintéticas (create_test_dicom)"""
+        from create_test_dicom import iter_test_instances
+
+        for buffer in iter_test_instances(count, modality, slices_per_series=slices_per_series,
+                                          output='bytesio'):
+            self.index.add(buffer.getvalue())
+        return count
+
+    def start(self, block=False):
+        """Iniciar o servidor (block=False retorna imediatamente)"""
+        handlers = [
+            (evt.EVT_C_ECHO, self.handle_echo),
+            (evt.EVT_C_STORE, self.handle_store),
+            (evt.EVT_C_FIND, self.handle_find),
+            (evt.EVT_C_MOVE, self.handle_move),
+            (evt.EVT_C_GET, self.handle_get)
+        ]
+        self.server = self.ae.start_server((self.host, self.port), block=block,
+                                           evt_handlers=handlers)
+        return self.server
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
+
+def parse_destination(value):
+    """Converter 'AE=host:porta' em (ae, (host, porta))"""
+    try:
+        ae_title, address = value.split('=', 1)
+        host, port = address.rsplit(':', 1)
+        return ae_title, (host, int(port))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Destino inválido: {value} (use AE=host:porta)")
+
+def main():
+    parser = argparse.ArgumentParser(description='SCP DICOM local que imita o Orthanc')
+    parser.add_argument('--host', default='',
+                       help='Endereço de escuta (padrão: todas as interfaces)')
+    parser.add_argument('--port', type=int, default=4242,
+                       help='Porta DICOM')
+    parser.add_argument('--ae-title', default='RADIWEB_PACS',
+                       help='AE Title do SCP')
+    parser.add_argument('--storage-dir',
+                       help='Gravar instâncias em disco (padrão: somente memória)')
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                       help='Latência artificial por operação (ms)')
+    parser.add_argument('--bandwidth-mbps', type=float,
+                       help='Limite de banda para recepção/envio de instâncias (Mbit/s)')
+    parser.add_argument('--destination', action='append', type=parse_destination, default=[],
+                       help='Destino de C-MOVE no formato AE=host:porta (pode repetir)')
+    parser.add_argument('--preload', type=int, default=0,
+                       help='Instâncias sintéticas carregadas no índice ao iniciar')
+    parser.add_argument('--verbose', action='store_true',
+                       help='Ativar logs detalhados')
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        debug_logger()
+
+    bandwidth = args.bandwidth_mbps * 1_000_000 / 8 if args.bandwidth_mbps else None
+    scp = MockOrthancSCP(args.ae_title, args.port, args.storage_dir,
+                         args.latency_ms / 1000, bandwidth, dict(args.destination), args.host)
+
+    if args.preload:
+        print(f"📦 Carregando {args.preload} instâncias sintéticas...")
+        scp.preload(args.preload)
+
+    print(f"🏥 SCP DICOM simulado ({args.ae_title}) ouvindo na porta {args.port}")
+    print(f"   Armazenamento: {args.storage_dir or 'memória'}")
+    print(f"   Latência: {args.latency_ms} ms")
+    print(f"   Banda: {f'{args.bandwidth_mbps} Mbit/s' if args.bandwidth_mbps else 'ilimitada'}")
+    for ae_title, (host, port) in scp.destinations.items():
+        print(f"   Destino C-MOVE: {ae_title} -> {host}:{port}")
+    print(f"   Iniciado em: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    try:
+        scp.start(block=True)
+    except KeyboardInterrupt:
+        print(f"\n📊 Operações: {scp.counters}, {len(scp.index.records)} instâncias no índice")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1006 @@
+#!/usr/bin/env python3
+"""
+Servidor HTTP local que imita a API REST e o DICOMweb do Orthanc PACS Radiweb
+Autor: Manus AI
+Data: 2024-01-01
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import struct
+import uuid
+import base64
+import random
+import hashlib
+import argparse
+import email.utils
+import threading
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+    from pydicom import dcmread
+    from pydicom.dataset import Dataset
+    from pydicom.datadict import keyword_for_tag, dictionary_VR
+    from pydicom.encaps import generate_frames
+    from pydicom.uid import (
+        UID, ExplicitVRLittleEndian, RLELossless, JPEGLSLossless, JPEG2000Lossless,
+        JPEGBaseline8Bit
+    )
+    import numpy as np
+except ImportError:
+    print("❌ pydicom/numpy não estão instalados. Instale com: pip install pydicom numpy")
+    sys.exit(1)
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None  # Sem Pillow, /rendered responde em PNG
+
+from mock_dicom_scp import match_value
+
+# Tags principais por nível (equivalentes às "MainDicomTags" do Orthanc)
+MAIN_DICOM_TAGS = {
+    'Patient': ['PatientID', 'PatientName', 'PatientBirthDate', 'PatientSex'],
+    'Study': ['StudyInstanceUID', 'StudyDate', 'StudyTime', 'StudyDescription',
+              'AccessionNumber', 'StudyID', 'ReferringPhysicianName'],
+    'Series': ['SeriesInstanceUID', 'Modality', 'SeriesNumber', 'SeriesDescription'],
+    'Instance': ['SOPInstanceUID', 'SOPClassUID', 'InstanceNumber', 'NumberOfFrames',
+                 'Rows', 'Columns']
+}
+
+LEVELS = ['Patient', 'Study', 'Series', 'Instance']
+
+# Nome da coleção REST e da lista de filhos de cada nível
+COLLECTIONS = {'patients': 'Patient', 'studies': 'Study', 'series': 'Series',
+               'instances': 'Instance'}
+CHILDREN = {'Patient': 'Studies', 'Study': 'Series', 'Series': 'Instances'}
+PARENT = {'Study': 'ParentPatient', 'Series': 'ParentStudy', 'Instance': 'ParentSeries'}
+
+# Content-Type dos frames WADO-RS por transfer syntax encapsulada
+FRAME_MEDIA_TYPES = {
+    RLELossless: 'image/x-dicom-rle',
+    JPEGLSLossless: 'image/jls',
+    JPEG2000Lossless: 'image/jp2',
+    JPEGBaseline8Bit: 'image/jpeg'
+}
+MEDIA_TRANSFER_SYNTAXES = {media: uid for uid, media in FRAME_MEDIA_TYPES.items()}
+
+class NotAcceptable(Exception):
+    """Representação pedida no Accept não disponível (HTTP 406)"""
+
+def parse_frame_accept(header):
+    """Interpretar o Accept de /frames: (multipart, tipo, transfer syntax ou '*')"""
+    header = header or '*/*'
+    multipart = header.startswith('multipart/related')
+    if multipart:
+        match = re.search(r'type="?([^";,]+)"?', header)
+        media_type = match.group(1) if match else 'application/octet-stream'
+    else:
+        media_type = header.split(';')[0].split(',')[0].strip()
+
+    match = re.search(r'transfer-syntax=([0-9.*]+)', header)
+    if match:
+        transfer_syntax = match.group(1)
+    elif media_type in MEDIA_TRANSFER_SYNTAXES:
+        transfer_syntax = MEDIA_TRANSFER_SYNTAXES[media_type]
+    elif media_type == 'application/octet-stream':
+        transfer_syntax = ExplicitVRLittleEndian
+    else:
+        transfer_syntax = '*'
+    return multipart or media_type == '*/*', media_type, transfer_syntax
+
+def encode_png(pixels):
+    """Codificar imagem 8 bits em tons de cinza como PNG (sem Pillow)"""
+    height, width = pixels.shape
+    raw = np.concatenate([np.zeros((height, 1), np.uint8), pixels], axis=1).tobytes()
+
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data +
+                struct.pack('>I', zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+def orthanc_id(*uids):
+    """Identificador no formato do Orthanc (SHA-1 dos UIDs agrupado em blocos de 8)"""
+    digest = hashlib.sha1('|'.join(uids).encode()).hexdigest()
+    return '-'.join(digest[i:i + 8] for i in range(0, 40, 8))
+
+def orthanc_date(timestamp=None):
+    return datetime.fromtimestamp(timestamp or time.time()).strftime('%Y%m%dT%H%M%S')
+
+def as_first(value):
+    """Primeiro valor de um elemento possivelmente multivalorado"""
+    return value[0] if type(value).__name__ == 'MultiValue' else value
+
+def tag_keyword(key):
+    """Aceitar palavra-chave ('PatientID') ou tag hexadecimal ('00100020')"""
+    if re.fullmatch(r'[0-9A-Fa-f]{8}', key):
+        return keyword_for_tag(int(key, 16)) or key
+    return key
+
+def dicom_json(tags):
+    """Converter dicionário palavra-chave -> valor em DICOM JSON (PS3.18 F.2)"""
+    ds = Dataset()
+    for keyword, value in tags.items():
+        if value in (None, ''):
+            continue
+        try:
+            setattr(ds, keyword, value)
+        except (ValueError, TypeError):
+            continue
+    return ds.to_json_dict()
+
+class ResourceIndex:
+    """Índice em memória da hierarquia Paciente > Estudo > Série > Instância
+
+    Mantém também o log de mudanças (/changes) e marca estudos, séries e
+    pacientes como estáveis após `stable_age` segundos sem novas instâncias.
+    """
+
+    def __init__(self, storage_dir=None, stable_age=60):
+        self.storage_dir = storage_dir
+        self.stable_age = stable_age
+        self.resources = {level: {} for level in LEVELS}
+        self.changes = []
+        self.lock = threading.Lock()
+        self._frame_cache = {}
+        self.total_size = 0
+        if storage_dir:
+            os.makedirs(storage_dir, exist_ok=True)
+
+    def _record_change(self, change_type, level, resource_id):
+        self.changes.append({
+            'ChangeType': change_type,
+            'Date': orthanc_date(),
+            'ID': resource_id,
+            'Path': f"/{next(k for k, v in COLLECTIONS.items() if v == level)}/{resource_id}",
+            'ResourceType': level,
+            'Seq': len(self.changes) + 1
+        })
+
+    def add(self, encoded):
+        """Indexar uma instância Part-10 (bytes); retorna a resposta de POST /instances"""
+        header = dcmread(io.BytesIO(encoded), stop_before_pixels=True)
+        uids = [str(header.get(k, '')) for k in
+                ('PatientID', 'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID')]
+        if not uids[3]:
+            raise ValueError('Instância sem SOPInstanceUID')
+
+        ids = [orthanc_id(*uids[:n + 1]) for n in range(4)]
+        now = time.time()
+
+        with self.lock:
+            if ids[3] in self.resources['Instance']:
+                status = 'AlreadyStored'
+            else:
+                status = 'Success'
+                for depth, level in enumerate(LEVELS):
+                    resources = self.resources[level]
+                    resource = resources.get(ids[depth])
+                    if resource is None:
+                        resource = {
+                            'ID': ids[depth],
+                            'Type': level,
+                            'Tags': {k: str(header.get(k, '')) for k in MAIN_DICOM_TAGS[level]},
+                            'Children': [],
+                            'Parent': ids[depth - 1] if depth else None,
+                            'Created': now
+                        }
+                        resources[ids[depth]] = resource
+                        if depth:
+                            self.resources[LEVELS[depth - 1]][ids[depth - 1]]['Children'].append(ids[depth])
+                        self._record_change(f"New{level}", level, ids[depth])
+                    resource['LastUpdate'] = now
+                    resource['IsStable'] = False
+
+                instance = self.resources['Instance'][ids[3]]
+                instance['TransferSyntaxUID'] = str(header.file_meta.get('TransferSyntaxUID', ''))
+                instance['FileSize'] = len(encoded)
+                instance['FileUuid'] = str(uuid.uuid4())
+                if self.storage_dir:
+                    path = os.path.join(self.storage_dir, f"{ids[3]}.dcm")
+                    with open(path, 'wb') as f:
+                        f.write(encoded)
+                    instance['Path'] = path
+                else:
+                    instance['Data'] = encoded
+                self.total_size += len(encoded)
+
+        return {
+            'ID': ids[3],
+            'ParentPatient': ids[0],
+            'ParentStudy': ids[1],
+            'ParentSeries': ids[2],
+            'Path': f"/instances/{ids[3]}",
+            'Status': status
+        }
+
+    def check_stable(self):
+        """Emitir Stable{Series,Study,Patient} para recursos sem atividade recente"""
+        now = time.time()
+        with self.lock:
+            for level in ('Series', 'Study', 'Patient'):
+                for resource_id, resource in self.resources[level].items():
+                    if not resource['IsStable'] and now - resource['LastUpdate'] >= self.stable_age:
+                        resource['IsStable'] = True
+                        self._record_change(f"Stable{level}", level, resource_id)
+
+    def read_file(self, instance_id):
+        """Bytes Part-10 de uma instância"""
+        instance = self.resources['Instance'][instance_id]
+        if 'Path' in instance:
+            with open(instance['Path'], 'rb') as f:
+                return f.read()
+        return instance['Data']
+
+    def ids(self, level, since=0, limit=None):
+        with self.lock:
+            ids = list(self.resources[level])
+        return ids[since:since + limit if limit else None]
+
+    def flatten(self, level, resource_id):
+        """Tags do recurso e de todos os seus ancestrais"""
+        tags = {}
+        resource = self.resources[level][resource_id]
+        depth = LEVELS.index(level)
+        while resource is not None:
+            tags.update(resource['Tags'])
+            depth -= 1
+            resource = self.resources[LEVELS[depth]].get(resource['Parent']) if depth >= 0 else None
+        return tags
+
+    def descendants(self, level, resource_id, target='Instance'):
+        """IDs de todos os descendentes de um recurso no nível `target`"""
+        ids = [resource_id]
+        for depth in range(LEVELS.index(level), LEVELS.index(target)):
+            ids = [child for parent in ids
+                   for child in self.resources[LEVELS[depth]][parent]['Children']]
+        return ids
+
+    def expand(self, level, resource_id):
+        """Representação JSON de um recurso, como em GET /{nível}/{id}"""
+        resource = self.resources[level][resource_id]
+        result = {
+            'ID': resource_id,
+            'Type': level,
+            'MainDicomTags': {k: v for k, v in resource['Tags'].items() if v}
+        }
+        if level in PARENT:
+            result[PARENT[level]] = resource['Parent']
+        if level in CHILDREN:
+            result[CHILDREN[level]] = list(resource['Children'])
+            result['IsStable'] = resource['IsStable']
+            result['LastUpdate'] = orthanc_date(resource['LastUpdate'])
+        if level == 'Study':
+            patient = self.resources['Patient'][resource['Parent']]
+            result['PatientMainDicomTags'] = {k: v for k, v in patient['Tags'].items() if v}
+        if level == 'Series':
+            result['Status'] = 'Unknown'
+            result['ExpectedNumberOfInstances'] = None
+        if level == 'Instance':
+            result['FileSize'] = resource['FileSize']
+            result['FileUuid'] = resource['FileUuid']
+            result['IndexInSeries'] = int(resource['Tags'].get('InstanceNumber') or 0) or None
+        return result
+
+    def find(self, level, query, since=0, limit=None):
+        """Resolver /tools/find ou QIDO-RS: IDs do nível cujos atributos casam com `query`"""
+        filters = []
+        modalities = None
+        for key, pattern in query.items():
+            keyword = tag_keyword(key)
+            if keyword == 'ModalitiesInStudy':
+                modalities = pattern
+            elif pattern not in (None, ''):
+                try:
+                    vr = dictionary_VR(keyword)
+                except KeyError:
+                    vr = None
+                filters.append((keyword, pattern, vr))
+
+        matched = []
+        skipped = 0
+        for resource_id in self.ids(level):
+            tags = self.flatten(level, resource_id)
+            if not all(keyword in tags and match_value(tags[keyword], pattern, vr)
+                       for keyword, pattern, vr in filters):
+                continue
+            if modalities and level == 'Study':
+                study_modalities = self.modalities(resource_id)
+                if not any(match_value(m, modalities) for m in study_modalities):
+                    continue
+            if skipped < since:
+                skipped += 1
+                continue
+            matched.append(resource_id)
+            if limit and len(matched) >= limit:
+                break
+        return matched
+
+    def modalities(self, study_id):
+        series = self.resources['Series']
+        return sorted(set(series[s]['Tags']['Modality']
+                          for s in self.resources['Study'][study_id]['Children']
+                          if series[s]['Tags']['Modality']))
+
+    def qido_tags(self, level, resource_id):
+        """Atributos retornados pelo QIDO-RS para um recurso"""
+        tags = self.flatten(level, resource_id)
+        if level == 'Study':
+            tags['ModalitiesInStudy'] = self.modalities(resource_id)
+            tags['NumberOfStudyRelatedSeries'] = len(self.resources['Study'][resource_id]['Children'])
+            tags['NumberOfStudyRelatedInstances'] = len(self.descendants('Study', resource_id))
+        elif level == 'Series':
+            tags['NumberOfSeriesRelatedInstances'] = len(self.resources['Series'][resource_id]['Children'])
+        return tags
+
+    def resolve_uids(self, study_uid, series_uid=None, instance_uid=None):
+        """Converter UIDs DICOMweb em (nível, ID Orthanc)"""
+        with self.lock:
+            studies = [s for s in self.resources['Study'].values()
+                       if s['Tags']['StudyInstanceUID'] == study_uid]
+        if not studies:
+            return None, None
+        study = studies[0]
+        if series_uid is None:
+            return 'Study', study['ID']
+        series_id = next((s for s in study['Children']
+                          if self.resources['Series'][s]['Tags']['SeriesInstanceUID'] == series_uid), None)
+        if series_id is None:
+            return None, None
+        if instance_uid is None:
+            return 'Series', series_id
+        instance_id = next((i for i in self.resources['Series'][series_id]['Children']
+                            if self.resources['Instance'][i]['Tags']['SOPInstanceUID'] == instance_uid), None)
+        return ('Instance', instance_id) if instance_id else (None, None)
+
+    def _all_frames(self, instance_id, transfer_syntax='*'):
+        """Todos os frames de uma instância, transcodificados se necessário (em cache)"""
+        key = (instance_id, str(transfer_syntax))
+        with self.lock:
+            cached = self._frame_cache.get(key)
+        if cached:
+            return cached
+
+        ds = dcmread(io.BytesIO(self.read_file(instance_id)))
+        stored = ds.file_meta.TransferSyntaxUID
+        target = stored if transfer_syntax == '*' else UID(transfer_syntax)
+        if target != stored and (target.is_encapsulated or stored.is_encapsulated):
+            try:
+                if stored.is_encapsulated:
+                    ds.decompress()
+                if target.is_encapsulated:
+                    ds.compress(target)
+            except Exception as e:
+                raise NotAcceptable(f"Transcodificação {stored} -> {target} indisponível: {e}")
+
+        count = int(ds.get('NumberOfFrames', 1) or 1)
+        if target.is_encapsulated:
+            frames = list(generate_frames(ds.PixelData, number_of_frames=count))
+            media_type = FRAME_MEDIA_TYPES.get(target, 'application/octet-stream')
+        else:
+            frame_size = len(ds.PixelData) // count
+            frames = [ds.PixelData[i * frame_size:(i + 1) * frame_size] for i in range(count)]
+            media_type = 'application/octet-stream'
+            target = ExplicitVRLittleEndian if target != stored else target
+
+        result = frames, media_type, target
+        with self.lock:
+            if len(self._frame_cache) >= 256:
+                self._frame_cache.pop(next(iter(self._frame_cache)))
+            self._frame_cache[key] = result
+        return result
+
+    def frames(self, instance_id, numbers, transfer_syntax='*'):
+        """Frames (1-based) de uma instância e o Content-Type correspondente"""
+        all_frames, media_type, target = self._all_frames(instance_id, transfer_syntax)
+        if any(n < 1 or n > len(all_frames) for n in numbers):
+            raise IndexError(f"Frame fora do intervalo 1-{len(all_frames)}")
+        return [all_frames[n - 1] for n in numbers], f'{media_type}; transfer-syntax={target}'
+
+    def rendered(self, instance_id, frame=1, viewport=None):
+        """Frame em 8 bits (janela do dataset ou mín/máx), reduzido ao `viewport` (largura, altura)"""
+        ds = dcmread(io.BytesIO(self.read_file(instance_id)))
+        pixels = ds.pixel_array
+        if int(ds.get('NumberOfFrames', 1) or 1) > 1:
+            pixels = pixels[frame - 1]
+        if int(ds.get('SamplesPerPixel', 1)) > 1:
+            pixels = pixels.mean(axis=-1)
+        pixels = pixels.astype(np.float64)
+
+        if 'WindowCenter' in ds and 'WindowWidth' in ds:
+            center = float(as_first(ds.WindowCenter))
+            width = max(float(as_first(ds.WindowWidth)), 1.0)
+            low, high = center - width / 2, center + width / 2
+        else:
+            low, high = float(pixels.min()), float(pixels.max())
+        scaled = np.clip((pixels - low) / max(high - low, 1e-6) * 255, 0, 255).astype(np.uint8)
+
+        if viewport:
+            width, height = viewport
+            step = max(-(-scaled.shape[1] // width), -(-scaled.shape[0] // height), 1)
+            scaled = scaled[::step, ::step]
+        return np.ascontiguousarray(scaled)
+
+    def statistics(self):
+        with self.lock:
+            counts = {level: len(self.resources[level]) for level in LEVELS}
+            total = self.total_size
+        return {
+            'CountPatients': counts['Patient'],
+            'CountStudies': counts['Study'],
+            'CountSeries': counts['Series'],
+            'CountInstances': counts['Instance'],
+            'TotalDiskSize': str(total),
+            'TotalDiskSizeMB': total // (1024 * 1024),
+            'TotalUncompressedSize': str(total),
+            'TotalUncompressedSizeMB': total // (1024 * 1024)
+        }
+
+def split_multipart(body, content_type):
+    """Separar as partes de um corpo multipart/related (STOW-RS)"""
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not match:
+        raise ValueError('Content-Type multipart sem boundary')
+    delimiter = b'--' + match.group(1).encode()
+
+    parts = []
+    for chunk in body.split(delimiter)[1:]:
+        if chunk.startswith(b'--'):
+            break
+        headers, _, payload = chunk.partition(b'\r\n\r\n')
+        if payload.endswith(b'\r\n'):
+            payload = payload[:-2]
+        parts.append(payload)
+    return parts
+
+def build_multipart(parts, media_type):
+    """Montar corpo multipart/related para respostas WADO-RS"""
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for payload in parts:
+        chunks.append(f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+                      f"Content-Length: {len(payload)}\r\n\r\n".encode())
+        chunks.append(payload)
+        chunks.append(b'\r\n')
+    chunks.append(f"--{boundary}--\r\n".encode())
+    primary_type = media_type.split(';')[0]
+    return b''.join(chunks), f'multipart/related; type="{primary_type}"; boundary={boundary}'
+
+class MockOrthancHandler(BaseHTTPRequestHandler):
+    """Roteamento das requisições REST e DICOMweb"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server_version = 'Orthanc'
+
+    ROUTES = [
+        ('GET', r'/system', 'get_system'),
+        ('GET', r'/statistics', 'get_statistics'),
+        ('GET', r'/plugins', 'get_plugins'),
+        ('GET', r'/changes', 'get_changes'),
+        ('GET', r'/stone-webviewer/?.*', 'get_stone'),
+        ('POST', r'/instances', 'post_instances'),
+        ('POST', r'/tools/find', 'post_find'),
+        ('GET', r'/(patients|studies|series|instances)', 'get_collection'),
+        ('GET', r'/(patients|studies|series|instances)/([0-9a-f-]+)', 'get_resource'),
+        ('GET', r'/(patients|studies|series)/([0-9a-f-]+)/(studies|series|instances)', 'get_children'),
+        ('GET', r'/instances/([0-9a-f-]+)/file', 'get_file'),
+        ('GET', r'/dicom-web/(studies|series|instances)', 'qido'),
+        ('GET', r'/dicom-web/studies/([^/]+)/(series|instances)', 'qido_in_study'),
+        ('GET', r'/dicom-web/studies/([^/]+)/series/([^/]+)/instances', 'qido_in_series'),
+        ('GET', r'/dicom-web/studies/([^/]+)(?:/series/([^/]+))?(?:/instances/([^/]+))?/metadata',
+         'wado_metadata'),
+        ('GET', r'/dicom-web/studies/([^/]+)/series/([^/]+)/instances/([^/]+)/frames/([0-9,]+)',
+         'wado_frames'),
+        ('GET', r'/dicom-web/studies/([^/]+)/series/([^/]+)/instances/([^/]+)(?:/frames/(\d+))?/rendered',
+         'wado_rendered'),
+        ('GET', r'/dicom-web/studies/([^/]+)(?:/series/([^/]+))?(?:/instances/([^/]+))?',
+         'wado_retrieve'),
+        ('POST', r'/dicom-web/studies(?:/[^/]+)?', 'stow')
+    ]
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    # ----- infraestrutura -----
+
+    def _dispatch(self, method):
+        mock = self.server.mock
+        url = urlsplit(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        mock.delay()
+
+        if mock.error_rate and random.random() < mock.error_rate:
+            # Falha transitória simulada (testa novas tentativas dos clientes)
+            self._drain_body()
+            self._send_json({'Message': 'Falha simulada'}, 503)
+            return
+
+        if mock.credentials and not self._authorized(mock.credentials):
+            self._drain_body()
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', 'Basic realm="Orthanc Secure Area"')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        for route_method, pattern, handler in self.ROUTES:
+            if route_method != method:
+                continue
+            match = re.fullmatch(pattern, url.path.rstrip('/') or '/')
+            if match:
+                mock.count(handler)
+                try:
+                    getattr(self, handler)(*match.groups())
+                except (KeyError, IndexError) as e:
+                    self._send_json({'Message': f"Recurso inexistente: {e}"}, 404)
+                except NotAcceptable as e:
+                    self._send_json({'Message': str(e)}, 406)
+                except ValueError as e:
+                    self._send_json({'Message': str(e)}, 400)
+                return
+
+        self._drain_body()
+        self._send_json({'Message': 'Unknown resource', 'Uri': url.path}, 404)
+
+    def _authorized(self, credentials):
+        header = self.headers.get('Authorization', '')
+        if not header.startswith('Basic '):
+            return False
+        try:
+            return base64.b64decode(header[6:]).decode() == credentials
+        except ValueError:
+            return False
+
+    def _read_body(self):
+        """Ler o corpo da requisição (Content-Length ou chunked)"""
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.mock.throttle(len(body))
+        return body
+
+    def _drain_body(self):
+        if self.command in ('POST', 'PUT'):
+            self._read_body()
+
+    def _send(self, body, content_type, status=200, headers=None):
+        headers = dict(headers or {})
+        requested_range = self.headers.get('Range')
+        if requested_range and status == 200:
+            # Um único intervalo 'bytes=início-fim', 'bytes=início-' ou 'bytes=-sufixo'
+            match = re.fullmatch(r'bytes=(\d*)-(\d*)', requested_range.strip())
+            total = len(body)
+            if match and match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), total - 1) if match.group(2) else total - 1
+            elif match and match.group(2):
+                start, end = max(total - int(match.group(2)), 0), total - 1
+            else:
+                start, end = total, -1
+            if start >= total or start > end:
+                body, status = b'', 416
+                headers['Content-Range'] = f"bytes */{total}"
+            else:
+                body, status = body[start:end + 1], 206
+                headers['Content-Range'] = f"bytes {start}-{end}/{total}"
+
+        self.server.mock.throttle(len(body))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_json(self, data, status=200, content_type='application/json', last_modified=None):
+        body = json.dumps(data, indent=None).encode()
+        if status != 200 or self.command not in ('GET', 'HEAD'):
+            self._send(body, content_type, status)
+            return
+
+        # Validadores para GET condicional (If-None-Match / If-Modified-Since)
+        headers = {'ETag': f'"{hashlib.sha1(body).hexdigest()[:20]}"'}
+        not_modified = self.headers.get('If-None-Match') == headers['ETag']
+        if last_modified is not None:
+            headers['Last-Modified'] = email.utils.formatdate(last_modified, usegmt=True)
+            since = self.headers.get('If-Modified-Since')
+            if since and 'If-None-Match' not in self.headers:
+                try:
+                    not_modified = int(last_modified) <= email.utils.parsedate_to_datetime(since).timestamp()
+                except (TypeError, ValueError):
+                    pass
+
+        if not_modified:
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send(body, content_type, status, headers)
+
+    def _since_limit(self):
+        return int(self.query.get('since', 0)), int(self.query.get('limit', 0)) or None
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_HEAD(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header('Access-Control-Allow-Origin', self.headers.get('Origin', '*'))
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Authorization, Content-Type, Accept')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    # ----- API REST -----
+
+    def get_system(self):
+        mock = self.server.mock
+        self._send_json({
+            'Name': mock.name,
+            'Version': '1.12.1',
+            'ApiVersion': 22,
+            'DicomAet': mock.name,
+            'DicomPort': 4242,
+            'HttpPort': self.server.server_address[1],
+            'DatabaseBackendPlugin': None,
+            'PluginsEnabled': True,
+            'StorageAreaPlugin': None
+        })
+
+    def get_statistics(self):
+        self._send_json(self.server.mock.index.statistics())
+
+    def get_plugins(self):
+        self._send_json(['dicom-web', 'stone-webviewer'])
+
+    def get_stone(self):
+        self._send(b'<html><head><title>Stone Web Viewer</title></head>'
+                   b'<body>Orthanc Stone Web Viewer (mock)</body></html>', 'text/html')
+
+    def get_changes(self):
+        index = self.server.mock.index
+        since, limit = self._since_limit()
+        limit = min(limit or 100, 4000)
+        with index.lock:
+            last = index.changes[-1]['Seq'] if index.changes else 0
+            if 'last' in self.query:
+                # /changes?last: somente a mudança mais recente
+                since = max(last - 1, 0)
+            changes = index.changes[since:since + limit]
+        self._send_json({
+            'Changes': changes,
+            'Done': since + len(changes) >= last,
+            'Last': changes[-1]['Seq'] if changes else last
+        })
+
+    def get_collection(self, collection):
+        index = self.server.mock.index
+        level = COLLECTIONS[collection]
+        since, limit = self._since_limit()
+        ids = index.ids(level, since, limit)
+        if 'expand' in self.query:
+            self._send_json([index.expand(level, resource_id) for resource_id in ids])
+        else:
+            self._send_json(ids)
+
+    def get_resource(self, collection, resource_id):
+        index = self.server.mock.index
+        level = COLLECTIONS[collection]
+        resource = index.resources[level][resource_id]
+        self._send_json(index.expand(level, resource_id),
+                        last_modified=resource.get('LastUpdate', resource['Created']))
+
+    def get_children(self, collection, resource_id, children):
+        """Descendentes expandidos, como em /studies/{id}/series ou /patients/{id}/instances"""
+        index = self.server.mock.index
+        level, target = COLLECTIONS[collection], COLLECTIONS[children]
+        if LEVELS.index(target) <= LEVELS.index(level):
+            raise KeyError(children)
+        ids = index.descendants(level, resource_id, target)
+        self._send_json([index.expand(target, child) for child in ids])
+
+    def get_file(self, instance_id):
+        self._send(self.server.mock.index.read_file(instance_id), 'application/dicom')
+
+    def post_instances(self):
+        body = self._read_body()
+        try:
+            result = self.server.mock.index.add(body)
+        except Exception as e:
+            self._send_json({'Message': f"Arquivo DICOM inválido: {e}"}, 400)
+            return
+        self._send_json(result)
+
+    def post_find(self):
+        request = json.loads(self._read_body() or b'{}')
+        index = self.server.mock.index
+        level = request.get('Level', 'Study').capitalize()
+        if level not in LEVELS:
+            raise ValueError(f"Nível inválido: {level}")
+        ids = index.find(level, request.get('Query', {}),
+                         int(request.get('Since', 0)), int(request.get('Limit', 0)) or None)
+        if request.get('Expand'):
+            self._send_json([index.expand(level, resource_id) for resource_id in ids])
+        else:
+            self._send_json(ids)
+
+    # ----- DICOMweb -----
+
+    def _qido(self, level, scope=None):
+        index = self.server.mock.index
+        query = {k: v for k, v in self.query.items()
+                 if k not in ('limit', 'offset', 'includefield', 'fuzzymatching')}
+        if scope:
+            query.update(scope)
+        ids = index.find(level, query, int(self.query.get('offset', 0)),
+                         int(self.query.get('limit', 0)) or None)
+        self._send_json([dicom_json(index.qido_tags(level, i)) for i in ids],
+                        content_type='application/dicom+json')
+
+    def qido(self, collection):
+        self._qido(COLLECTIONS[collection])
+
+    def qido_in_study(self, study_uid, collection):
+        self._qido(COLLECTIONS[collection], {'StudyInstanceUID': study_uid})
+
+    def qido_in_series(self, study_uid, series_uid):
+        self._qido('Instance', {'StudyInstanceUID': study_uid, 'SeriesInstanceUID': series_uid})
+
+    def _instances_for(self, study_uid, series_uid=None, instance_uid=None):
+        index = self.server.mock.index
+        level, resource_id = index.resolve_uids(study_uid, series_uid, instance_uid)
+        if level is None:
+            raise KeyError(instance_uid or series_uid or study_uid)
+        return index.descendants(level, resource_id)
+
+    def wado_metadata(self, study_uid, series_uid=None, instance_uid=None):
+        mock = self.server.mock
+        metadata = [mock.metadata(i) for i in self._instances_for(study_uid, series_uid, instance_uid)]
+        self._send_json(metadata, content_type='application/dicom+json')
+
+    def wado_frames(self, study_uid, series_uid, instance_uid, frame_list):
+        instance_id = self._instances_for(study_uid, series_uid, instance_uid)[0]
+        numbers = [int(n) for n in frame_list.split(',') if n]
+        multipart, _, transfer_syntax = parse_frame_accept(self.headers.get('Accept'))
+        frames, media_type = self.server.mock.index.frames(instance_id, numbers, transfer_syntax)
+        if multipart:
+            self._send(*build_multipart(frames, media_type))
+        elif len(frames) == 1:
+            # Parte única (Accept sem multipart): permite requisições com Range
+            self._send(frames[0], media_type)
+        else:
+            raise NotAcceptable('Vários frames exigem multipart/related')
+
+    def wado_rendered(self, study_uid, series_uid, instance_uid, frame=None):
+        instance_id = self._instances_for(study_uid, series_uid, instance_uid)[0]
+        viewport = None
+        if 'viewport' in self.query:
+            viewport = tuple(int(v) for v in self.query['viewport'].split(',')[:2])
+        pixels = self.server.mock.index.rendered(instance_id, int(frame or 1), viewport)
+
+        accept = self.headers.get('Accept', 'image/jpeg')
+        if Image is not None and ('image/jpeg' in accept or '*/*' in accept):
+            buffer = io.BytesIO()
+            Image.fromarray(pixels).save(buffer, format='JPEG',
+                                         quality=int(self.query.get('quality', 90)))
+            self._send(buffer.getvalue(), 'image/jpeg')
+        else:
+            self._send(encode_png(pixels), 'image/png')
+
+    def wado_retrieve(self, study_uid, series_uid=None, instance_uid=None):
+        index = self.server.mock.index
+        instances = self._instances_for(study_uid, series_uid, instance_uid)
+        self._send(*build_multipart([index.read_file(i) for i in instances], 'application/dicom'))
+
+    def stow(self):
+        body = self._read_body()
+        content_type = self.headers.get('Content-Type', '')
+        index = self.server.mock.index
+
+        referenced, failed = [], []
+        for part in split_multipart(body, content_type):
+            try:
+                result = index.add(part)
+                instance = index.resources['Instance'][result['ID']]['Tags']
+                referenced.append({'ReferencedSOPClassUID': instance['SOPClassUID'],
+                                   'ReferencedSOPInstanceUID': instance['SOPInstanceUID']})
+            except Exception as e:
+                failed.append({'FailureReason': 0xC000})
+                if self.server.verbose:
+                    print(f"   ❌ STOW-RS: instância rejeitada: {e}")
+
+        response = Dataset()
+        response.ReferencedSOPSequence = [Dataset() for _ in referenced]
+        for item, values in zip(response.ReferencedSOPSequence, referenced):
+            item.update(values)
+        if failed:
+            response.FailedSOPSequence = [Dataset() for _ in failed]
+            for item, values in zip(response.FailedSOPSequence, failed):
+                item.update(values)
+        status = 200 if not failed else (202 if referenced else 409)
+        self._send_json(response.to_json_dict(), status, 'application/dicom+json')
+
+class MockOrthancServer:
+    """Servidor REST/DICOMweb local com índice em memória
+
+    `latency` e `jitter` (segundos) são somados a cada requisição;
+    `bandwidth` (bytes/s) limita a velocidade de envio e recepção de corpos;
+    `error_rate` é a fração de requisições respondidas com 503.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8042, username='admin', password='admin',
+                 storage_dir=None, latency=0.0, jitter=0.0, bandwidth=None, stable_age=60,
+                 error_rate=0.0, name='RADIWEB_PACS', verbose=False):
+        self.name = name
+        self.error_rate = error_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.credentials = f"{username}:{password}" if username else None
+        self.index = ResourceIndex(storage_dir, stable_age)
+        self.counters = {}
+        self._metadata = {}
+        self._stop = threading.Event()
+
+        self.httpd = ThreadingHTTPServer((host, port), MockOrthancHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.httpd.verbose = verbose
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, handler):
+        self.counters[handler] = self.counters.get(handler, 0) + 1
+
+    def delay(self):
+        """Aplicar latência simulada"""
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def throttle(self, size):
+        """Aplicar limite de banda simulado"""
+        if self.bandwidth and size:
+            time.sleep(size / self.bandwidth)
+
+    def metadata(self, instance_id):
+        """Metadados WADO-RS (DICOM JSON sem Pixel Data), em cache por instância"""
+        if instance_id not in self._metadata:
+            ds = dcmread(io.BytesIO(self.index.read_file(instance_id)), stop_before_pixels=True)
+            self._metadata[instance_id] = ds.to_json_dict(bulk_data_threshold=1 << 20)
+        return self._metadata[instance_id]
+
+    def preload(self, count, modality='CT', slices_per_series=10, pixels=True):
+        """Popular o índice com instâncias sintéticas (create_test_dicom)
+
+        Com pixels=False as instâncias levam só o cabeçalho (~1 KB), o que
+        permite acervos de dezenas de milhares de estudos em memória.
+        """
+        from create_test_dicom import iter_test_instances, encode_dicom
+
+        for ds in iter_test_instances(count, modality, slices_per_series=slices_per_series):
+            if not pixels:
+                del ds.PixelData
+            self.index.add(encode_dicom(ds).getvalue())
+        return count
+
+    def _stability_loop(self):
+        while not self._stop.wait(1.0):
+            self.index.check_stable()
+
+    def start(self, block=False):
+        """Iniciar o servidor (block=False retorna imediatamente)"""
+        threading.Thread(target=self._stability_loop, daemon=True).start()
+        if block:
+            self.httpd.serve_forever()
+        else:
+            self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+            self.thread.start()
+        return self
+
+    def shutdown(self):
+        self._stop.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor REST/DICOMweb local que imita o Orthanc')
+    parser.add_argument('--host', default='127.0.0.1',
+                       help='Endereço de escuta')
+    parser.add_argument('--port', type=int, default=8042,
+                       help='Porta HTTP')
+    parser.add_argument('--username', default='admin',
+                       help='Usuário da autenticação básica')
+    parser.add_argument('--password', default='admin',
+                       help='Senha da autenticação básica')
+    parser.add_argument('--no-auth', action='store_true',
+                       help='Desativar autenticação')
+    parser.add_argument('--storage-dir',
+                       help='Gravar instâncias em disco (padrão: somente memória)')
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                       help='Latência artificial por requisição (ms)')
+    parser.add_argument('--jitter-ms', type=float, default=0.0,
+                       help='Variação aleatória adicional de latência (ms)')
+    parser.add_argument('--bandwidth-mbps', type=float,
+                       help='Limite de banda para corpos de requisição/resposta (Mbit/s)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                       help='Fração de requisições respondidas com 503 (ex.: 0.05)')
+    parser.add_argument('--stable-age', type=float, default=60,
+                       help='Segundos sem novas instâncias até Stable{Series,Study,Patient}')
+    parser.add_argument('--preload', type=int, default=0,
+                       help='Instâncias sintéticas carregadas no índice ao iniciar')
+    parser.add_argument('--preload-slices', type=int, default=10,
+                       help='Instâncias por série no pré-carregamento (1 = um estudo por instância)')
+    parser.add_argument('--preload-no-pixels', action='store_true',
+                       help='Pré-carregar só cabeçalhos, para acervos grandes de metadados')
+    parser.add_argument('--verbose', action='store_true',
+                       help='Registrar cada requisição')
+
+    args = parser.parse_args()
+
+    bandwidth = args.bandwidth_mbps * 1_000_000 / 8 if args.bandwidth_mbps else None
+    server = MockOrthancServer(args.host, args.port,
+                               None if args.no_auth else args.username, args.password,
+                               args.storage_dir, args.latency_ms / 1000, args.jitter_ms / 1000,
+                               bandwidth, args.stable_age, args.error_rate, verbose=args.verbose)
+
+    if args.preload:
+        print(f"📦 Carregando {args.preload} instâncias sintéticas...")
+        server.preload(args.preload, slices_per_series=args.preload_slices,
+                       pixels=not args.preload_no_pixels)
+
+    print(f"🌐 Orthanc REST/DICOMweb simulado em {server.url}")
+    print(f"   Autenticação: {'desativada' if args.no_auth else args.username}")
+    print(f"   Armazenamento: {args.storage_dir or 'memória'}")
+    print(f"   Latência: {args.latency_ms} ms (+ até {args.jitter_ms} ms)")
+    print(f"   Banda: {f'{args.bandwidth_mbps} Mbit/s' if args.bandwidth_mbps else 'ilimitada'}")
+    if args.error_rate:
+        print(f"   Erros simulados: {args.error_rate:.1%} (503)")
+    print(f"   Iniciado em: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    try:
+        server.start(block=True)
+    except KeyboardInterrupt:
+        stats = server.index.statistics()
+        print(f"\n📊 Requisições: {server.counters}, {stats['CountInstances']} instâncias no índice")
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
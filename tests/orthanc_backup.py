@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Backup incremental e paralelo do Orthanc PACS Radiweb guiado pelo log de mudanças
+Autor: Manus AI
+Data: 2024-01-01
+"""
+
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import concurrent.futures
+from datetime import datetime
+
+try:
+    import requests
+    from requests.auth import HTTPBasicAuth
+except ImportError:
+    print("❌ requests não está instalado. Instale com: pip install requests")
+    sys.exit(1)
+
+try:
+    from pydicom import dcmread
+except ImportError:
+    print("❌ pydicom não está instalado. Instale com: pip install pydicom")
+    sys.exit(1)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # Opcional: sem ele, os blocos são comprimidos com gzip
+
+from changes_feed import ChangesFeed
+
+# Extensão dos blocos por compressão
+CHUNK_EXTENSIONS = {'zstd': '.zst', 'gzip': '.gz', 'none': ''}
+
+# Mudanças de instância que exigem (re)copiar o arquivo
+INSTANCE_CHANGES = ('NewInstance', 'UpdatedAttachment')
+
+# Tags gravadas no manifesto para filtrar a restauração sem ler os blocos
+MANIFEST_TAGS = ('PatientID', 'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID',
+                 'StudyDate', 'Modality')
+
+class ChunkStore:
+    """Blocos endereçados pelo SHA-256 do conteúdo em <repositório>/chunks/ab/<hash>
+
+    Um bloco já presente (com qualquer compressão) não é gravado de novo:
+    conteúdo repetido entre instâncias e entre execuções é armazenado uma
+    vez. A gravação é atômica (arquivo temporário + rename), então vários
+    threads podem gravar o mesmo bloco ao mesmo tempo.
+    """
+
+    def __init__(self, repository, compression='zstd', level=None):
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstandard não está instalado (pip install zstandard)")
+        self.root = os.path.join(repository, 'chunks')
+        self.compression = compression
+        self.level = level
+        self.local = threading.local()
+
+    def _path(self, digest, compression):
+        return os.path.join(self.root, digest[:2], digest + CHUNK_EXTENSIONS[compression])
+
+    def find(self, digest):
+        """Caminho e compressão de um bloco existente, ou (None, None)"""
+        for compression in CHUNK_EXTENSIONS:
+            path = self._path(digest, compression)
+            if os.path.exists(path):
+                return path, compression
+        return None, None
+
+    def _compress(self, data):
+        if self.compression == 'zstd':
+            # ZstdCompressor não é seguro entre threads: um por thread
+            compressor = getattr(self.local, 'compressor', None)
+            if compressor is None:
+                compressor = self.local.compressor = zstandard.ZstdCompressor(level=self.level or 3)
+            return compressor.compress(data)
+        if self.compression == 'gzip':
+            return gzip.compress(data, compresslevel=self.level or 6, mtime=0)
+        return data
+
+    def put(self, data):
+        """Gravar um bloco; retorna (hash, bytes gravados), 0 se já existia"""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.find(digest)[0]:
+            return digest, 0
+
+        compressed = self._compress(data)
+        path = self._path(digest, self.compression)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(compressed)
+        os.replace(temp_path, path)
+        return digest, len(compressed)
+
+    def get(self, digest):
+        """Ler e descomprimir um bloco, conferindo o hash"""
+        path, compression = self.find(digest)
+        if path is None:
+            raise KeyError(f"Bloco ausente: {digest}")
+        with open(path, 'rb') as f:
+            data = f.read()
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstandard não está instalado (pip install zstandard)")
+        try:
+            if compression == 'zstd':
+                data = zstandard.ZstdDecompressor().decompress(data)
+            elif compression == 'gzip':
+                data = gzip.decompress(data)
+        except Exception as e:
+            raise ValueError(f"Bloco corrompido: {digest} ({e})")
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Bloco corrompido: {digest}")
+        return data
+
+def list_manifests(repository):
+    """Manifestos do repositório em ordem cronológica"""
+    directory = os.path.join(repository, 'manifests')
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.endswith('.json')]
+
+class OrthancBackup:
+    """Cópia incremental de /instances/{id}/file a partir do cursor do /changes
+
+    A primeira execução (ou `full=True`) lista todas as instâncias; as
+    seguintes percorrem apenas as mudanças desde o cursor salvo, de modo que
+    o tempo acompanha o delta e não o tamanho do acervo. Os arquivos são
+    baixados em paralelo, divididos em blocos de `chunk_size` bytes e
+    comprimidos nos próprios threads de download. Cada execução grava um
+    manifesto e o cursor avança logo depois dele; as instâncias que falharam
+    vão para <repositório>/retry.json e são copiadas de novo na execução
+    seguinte, sem segurar o cursor (nem fazer o delta crescer).
+    """
+
+    def __init__(self, base_url, username, password, repository, workers=8,
+                 compression='zstd', chunk_size=4 * 1024 * 1024, retries=3, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.repository = os.path.abspath(repository)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(username, password)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        os.makedirs(os.path.join(self.repository, 'manifests'), exist_ok=True)
+        self.store = ChunkStore(self.repository, compression)
+        self.feed = ChangesFeed(self.base_url, cursor_file=os.path.join(self.repository, 'cursor.json'),
+                                limit=1000, timeout=timeout, session=self.session)
+        self.retry_file = os.path.join(self.repository, 'retry.json')
+        self.lock = threading.Lock()
+        self.counters = {'instances': 0, 'failed': 0, 'bytes': 0, 'stored_bytes': 0,
+                         'chunks': 0, 'new_chunks': 0, 'retries': 0}
+
+    def _iter_all_instances(self, page_size=1000):
+        since = 0
+        while True:
+            page = self.feed.get('/instances', since=since, limit=page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            since += len(page)
+
+    def _load_retries(self):
+        """Instâncias que falharam em execuções anteriores (ID -> último erro)"""
+        if not os.path.exists(self.retry_file):
+            return {}
+        with open(self.retry_file) as f:
+            return json.load(f)
+
+    def _save_retries(self, failures):
+        with open(self.retry_file + '.tmp', 'w') as f:
+            json.dump(failures, f)
+        os.replace(self.retry_file + '.tmp', self.retry_file)
+
+    def _delta(self):
+        """IDs alterados e removidos desde o cursor, e o último Seq lido"""
+        changed, deleted = {}, set()
+        last_seq = self.feed.cursor
+        for changes in self.feed.pages():
+            for change in changes:
+                if change.get('ResourceType') != 'Instance':
+                    continue
+                if change['ChangeType'] in INSTANCE_CHANGES:
+                    changed[change['ID']] = True
+                    deleted.discard(change['ID'])
+                elif change['ChangeType'] == 'Deleted':
+                    changed.pop(change['ID'], None)
+                    deleted.add(change['ID'])
+            last_seq = changes[-1]['Seq']
+        return list(changed), sorted(deleted), last_seq
+
+    def _read_chunks(self, response):
+        """Blocos de tamanho fixo (fronteiras estáveis para a deduplicação)"""
+        buffer = bytearray()
+        for piece in response.iter_content(chunk_size=min(self.chunk_size, 1024 * 1024)):
+            buffer += piece
+            while len(buffer) >= self.chunk_size:
+                yield bytes(buffer[:self.chunk_size])
+                del buffer[:self.chunk_size]
+        if buffer:
+            yield bytes(buffer)
+
+    def _header_tags(self, data):
+        try:
+            ds = dcmread(io.BytesIO(data), stop_before_pixels=True, specific_tags=list(MANIFEST_TAGS))
+        except Exception:
+            return {}  # Cabeçalho maior que o primeiro bloco: restaurar sem filtro
+        return {keyword: str(ds.get(keyword, '')) for keyword in MANIFEST_TAGS}
+
+    def backup_instance(self, instance_id):
+        """Baixar uma instância em fluxo e gravá-la no repositório de blocos"""
+        for attempt in range(self.retries + 1):
+            try:
+                with self.session.get(f"{self.base_url}/instances/{instance_id}/file",
+                                      stream=True, timeout=self.timeout) as response:
+                    if response.status_code == 404:
+                        return None  # Removida depois da leitura do /changes
+                    response.raise_for_status()
+
+                    file_hash = hashlib.sha256()
+                    chunks, size, stored, new_chunks, tags = [], 0, 0, 0, {}
+                    for data in self._read_chunks(response):
+                        if not chunks:
+                            tags = self._header_tags(data)
+                        file_hash.update(data)
+                        digest, written = self.store.put(data)
+                        chunks.append(digest)
+                        size += len(data)
+                        stored += written
+                        new_chunks += written > 0
+                break
+            except requests.exceptions.RequestException as e:
+                status = e.response.status_code if e.response is not None else None
+                if attempt == self.retries or (status is not None and status < 500):
+                    raise
+                with self.lock:
+                    self.counters['retries'] += 1
+                time.sleep(0.5 * 2 ** attempt * random.uniform(0.5, 1.5))
+
+        with self.lock:
+            self.counters['instances'] += 1
+            self.counters['bytes'] += size
+            self.counters['stored_bytes'] += stored
+            self.counters['chunks'] += len(chunks)
+            self.counters['new_chunks'] += new_chunks
+        return {'sha256': file_hash.hexdigest(), 'size': size, 'chunks': chunks, **tags}
+
+    def run(self, full=False):
+        """Executar um backup (completo ou incremental); retorna o manifesto"""
+        started = datetime.now()
+        start_time = time.time()
+        since = self.feed.cursor
+        full = full or not os.path.exists(self.feed.cursor_file)
+
+        if full:
+            # Cursor lido antes da listagem: mudanças durante a cópia entram no próximo delta
+            until = self.feed.head()
+            instance_ids, deleted = self._iter_all_instances(), []
+            print(f"💾 Backup completo (cursor {until})...")
+        else:
+            instance_ids, deleted, until = self._delta()
+            # Falhas anteriores são repetidas junto com o delta (a listagem completa já as cobre)
+            retries = [i for i in self._load_retries() if i not in deleted and i not in instance_ids]
+            instance_ids += retries
+            print(f"💾 Backup incremental: mudanças {since} → {until}, "
+                  f"{len(instance_ids) - len(retries)} instâncias novas/alteradas, "
+                  f"{len(retries)} repetidas, {len(deleted)} removidas")
+
+        instances, failures = {}, {}
+
+        def copy(instance_id):
+            try:
+                entry = self.backup_instance(instance_id)
+            except (requests.exceptions.RequestException, OSError) as e:
+                with self.lock:
+                    self.counters['failed'] += 1
+                    failures[instance_id] = str(e)
+                    if len(failures) <= 10:
+                        print(f"   ❌ {instance_id}: {e}")
+                return
+            if entry is not None:
+                with self.lock:
+                    instances[instance_id] = entry
+
+        # Submissão limitada: a listagem completa não é materializada em memória
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = set()
+            for instance_id in instance_ids:
+                if len(pending) >= self.workers * 4:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        future.result()  # Erro inesperado interrompe o backup antes do cursor
+                pending.add(executor.submit(copy, instance_id))
+            for future in concurrent.futures.as_completed(pending):
+                future.result()
+
+        elapsed = time.time() - start_time
+        manifest = {
+            'created': started.isoformat(),
+            'base_url': self.base_url,
+            'mode': 'full' if full else 'incremental',
+            'since': 0 if full else since,
+            'until': until,
+            'compression': self.store.compression,
+            'chunk_size': self.chunk_size,
+            'instances': instances,
+            'deleted': deleted,
+            'failed': failures,
+            'stats': {**self.counters, 'seconds': elapsed}
+        }
+        name = f"backup_{started.strftime('%Y%m%d_%H%M%S_%f')}_{manifest['mode']}.json"
+        path = os.path.join(self.repository, 'manifests', name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+        self._save_retries(failures)
+        self.feed.save_cursor(until)
+
+        self._report(manifest, path)
+        return manifest
+
+    def _report(self, manifest, path):
+        stats = manifest['stats']
+        megabytes = stats['bytes'] / 1024 / 1024
+        seconds = max(stats['seconds'], 1e-9)
+        reused = stats['chunks'] - stats['new_chunks']
+        status = "✅" if not stats['failed'] else "❌"
+        print(f"{status} Backup {manifest['mode']}: {stats['instances']} instâncias, "
+              f"{megabytes:.1f} MB em {stats['seconds']:.1f}s ({megabytes / seconds:.1f} MB/s)")
+        print(f"   Blocos: {stats['new_chunks']} novos, {reused} reaproveitados (deduplicação); "
+              f"{stats['stored_bytes'] / 1024 / 1024:.1f} MB gravados ({manifest['compression']})")
+        if stats['bytes']:
+            print(f"   Redução: {stats['bytes'] / max(stats['stored_bytes'], 1):.2f}x")
+        if stats['failed']:
+            print(f"   Falhas: {stats['failed']} (repetidas na próxima execução, {self.retry_file})")
+        print(f"   Manifesto: {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Backup incremental do Orthanc via /changes')
+    parser.add_argument('--url', default='https://pacs.radiweb.com.br',
+                       help='URL base do Orthanc')
+    parser.add_argument('--username', default='admin',
+                       help='Nome de usuário')
+    parser.add_argument('--password', default='admin',
+                       help='Senha')
+    parser.add_argument('--repository', default='/backups/orthanc-incremental',
+                       help='Diretório do repositório (blocos, manifestos e cursor)')
+    parser.add_argument('--workers', type=int, default=8,
+                       help='Downloads e compressões simultâneos')
+    parser.add_argument('--compression', choices=list(CHUNK_EXTENSIONS),
+                       default='zstd' if zstandard else 'gzip',
+                       help='Compressão dos blocos (padrão: zstd se instalado, senão gzip)')
+    parser.add_argument('--chunk-size-mb', type=float, default=4,
+                       help='Tamanho dos blocos de deduplicação (MB)')
+    parser.add_argument('--retries', type=int, default=3,
+                       help='Novas tentativas por instância em erros de rede/5xx')
+    parser.add_argument('--full', action='store_true',
+                       help='Copiar todas as instâncias em vez do delta do /changes')
+    parser.add_argument('--list', action='store_true',
+                       help='Listar os manifestos do repositório e sair')
+
+    args = parser.parse_args()
+
+    if args.list:
+        for path in list_manifests(args.repository):
+            with open(path) as f:
+                manifest = json.load(f)
+            print(f"   {os.path.basename(path)}: {len(manifest['instances'])} instâncias, "
+                  f"{len(manifest['deleted'])} removidas, mudanças {manifest['since']} → {manifest['until']}")
+        sys.exit(0)
+
+    try:
+        backup = OrthancBackup(args.url, args.username, args.password, args.repository,
+                               args.workers, args.compression,
+                               int(args.chunk_size_mb * 1024 * 1024), args.retries)
+        manifest = backup.run(args.full)
+    except (ValueError, requests.exceptions.RequestException) as e:
+        print(f"❌ Erro no backup: {e}")
+        sys.exit(1)
+
+    sys.exit(0 if not manifest['failed'] else 1)
+
+if __name__ == "__main__":
+    main()
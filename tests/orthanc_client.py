@@ -0,0 +1,305 @@
+"""
+Cliente Python do Orthanc PACS Radiweb com cache de metadados (LRU/TTL + ETag)
+Autor: Manus AI
+Data: 2024-01-01
+"""
+
+import sys
+import time
+import hashlib
+import threading
+import concurrent.futures
+from collections import OrderedDict
+
+try:
+    import requests
+except ImportError:
+    print("❌ requests não está instalado. Instale com: pip install requests")
+    sys.exit(1)
+
+from changes_feed import ChangesFeed
+
+# Coleção REST de cada ResourceType do /changes
+RESOURCE_COLLECTIONS = {'Patient': 'patients', 'Study': 'studies', 'Series': 'series',
+                        'Instance': 'instances'}
+
+# Campo do recurso que aponta para o pai
+PARENT_FIELDS = {'ParentPatient': 'patients', 'ParentStudy': 'studies',
+                 'ParentSeries': 'series'}
+
+def orthanc_id(*uids):
+    """ID Orthanc calculado localmente: SHA-1 de 'PatientID|StudyUID|...' em blocos de 8"""
+    digest = hashlib.sha1('|'.join(uids).encode()).hexdigest()
+    return '-'.join(digest[i:i + 8] for i in range(0, 40, 8))
+
+class CacheEntry:
+    __slots__ = ('data', 'size', 'etag', 'last_modified', 'stored_at')
+
+    def __init__(self, data, size, etag=None, last_modified=None):
+        self.data = data
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = time.monotonic()
+
+class OrthancClient:
+    """Acesso a /patients, /studies, /series e /instances com cache LRU/TTL
+
+    Entradas dentro do `ttl` são servidas sem requisição. Depois disso, são
+    revalidadas com If-None-Match/If-Modified-Since: um 304 reaproveita o
+    JSON em cache sem retransmiti-lo. `sync_changes()` (ou a thread de
+    `start_invalidation`) aplica o /changes e remove as entradas afetadas
+    antes do fim do TTL. Os JSON devolvidos são compartilhados com o cache
+    e não devem ser modificados.
+    """
+
+    def __init__(self, session, base_url, max_entries=1024, ttl=60.0, timeout=30):
+        self.session = session
+        self.base_url = base_url.rstrip('/')
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.timeout = timeout
+        self.cache = OrderedDict()
+        self.parents = {}
+        self.lock = threading.Lock()
+        self.counters = {'lookups': 0, 'hits': 0, 'revalidated': 0, 'misses': 0,
+                         'evictions': 0, 'invalidations': 0,
+                         'bytes_fetched': 0, 'bytes_saved': 0, 'bulk_requests': 0}
+        self.feed = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_tester(cls, tester, **kwargs):
+        """Reaproveitar a sessão autenticada de um OrthancAPITester"""
+        return cls(tester.session, tester.base_url, timeout=tester.timeout, **kwargs)
+
+    # ----- cache -----
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def _store(self, key, entry):
+        data = entry.data
+        parent = None
+        if isinstance(data, dict) and 'ID' in data:
+            # Guardar o pai para invalidá-lo quando o filho mudar
+            for field, collection in PARENT_FIELDS.items():
+                if data.get(field):
+                    parent = (collection, data[field])
+
+        with self.lock:
+            self.cache[key] = entry
+            self.cache.move_to_end(key)
+            if parent:
+                self.parents[data['ID']] = parent
+            while len(self.cache) > self.max_entries:
+                _, evicted = self.cache.popitem(last=False)
+                self.counters['evictions'] += 1
+                # O pai sai junto com a entrada, para o mapa não crescer sem limite
+                if isinstance(evicted.data, dict):
+                    self.parents.pop(evicted.data.get('ID'), None)
+
+    def get_json(self, path, **params):
+        """GET com cache; `params` fazem parte da chave"""
+        key = path + ('?' + '&'.join(f"{k}={v}" for k, v in sorted(params.items())) if params else '')
+        self._count('lookups')
+
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+
+        if entry is not None and time.monotonic() - entry.stored_at < self.ttl:
+            self._count('hits')
+            self._count('bytes_saved', entry.size)
+            return entry.data
+
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        response = self.session.get(f"{self.base_url}{path}", params=params or None,
+                                    headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and entry is not None:
+            entry.stored_at = time.monotonic()
+            self._count('revalidated')
+            self._count('bytes_saved', entry.size)
+            return entry.data
+
+        response.raise_for_status()
+        data = response.json()
+        self._count('misses')
+        self._count('bytes_fetched', len(response.content))
+        self._store(key, CacheEntry(data, len(response.content), response.headers.get('ETag'),
+                                    response.headers.get('Last-Modified')))
+        return data
+
+    def invalidate(self, collection, resource_id=None):
+        """Remover entradas de um recurso (e subcaminhos) ou da listagem da coleção"""
+        prefix = f"/{collection}/{resource_id}" if resource_id else None
+        with self.lock:
+            if prefix:
+                keys = [k for k in self.cache if k == prefix or k.startswith(prefix + '/')
+                        or k.startswith(prefix + '?')]
+            else:
+                keys = [k for k in self.cache if k.split('?')[0] == f"/{collection}"]
+            for key in keys:
+                del self.cache[key]
+            self.counters['invalidations'] += len(keys)
+        return len(keys)
+
+    def apply_change(self, change):
+        """Invalidar o cache a partir de uma mudança do /changes"""
+        collection = RESOURCE_COLLECTIONS.get(change.get('ResourceType'))
+        if collection is None:
+            return
+        change_type = change['ChangeType']
+        self.invalidate(collection, change['ID'])
+
+        if change_type.startswith(('New', 'Deleted')):
+            # Listagens da coleção e o pai conhecido (lista de filhos) ficam desatualizados.
+            # Pai fora do mapa não é consultado: o Stable*/Updated* dele invalida a entrada
+            # pelo ID e, até lá, vale o TTL com revalidação por ETag
+            self.invalidate(collection)
+            with self.lock:
+                parent = self.parents.get(change['ID'])
+            if parent:
+                self.invalidate(*parent)
+
+    def sync_changes(self):
+        """Aplicar as mudanças ocorridas desde a última sincronização"""
+        if self.feed is None:
+            # Primeira chamada: começar do fim do log, sem reaplicar o histórico
+            self.feed = ChangesFeed(self.base_url, timeout=self.timeout, session=self.session)
+            self.feed.cursor = self.feed.head()
+            return 0
+        applied = 0
+        for changes in self.feed.pages():
+            for change in changes:
+                self.apply_change(change)
+            self.feed.cursor = changes[-1]['Seq']
+            applied += len(changes)
+        return applied
+
+    def start_invalidation(self, interval=2.0):
+        """Sincronizar com /changes a cada `interval` segundos em segundo plano"""
+        self.sync_changes()
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.sync_changes()
+                except requests.exceptions.RequestException:
+                    pass
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        """Taxa de acerto, requisições evitadas e bytes economizados"""
+        with self.lock:
+            counters = dict(self.counters)
+            entries = len(self.cache)
+        lookups = counters['lookups'] or 1
+        return {
+            **counters,
+            'entries': entries,
+            'hit_rate': (counters['hits'] + counters['revalidated']) / lookups,
+            'requests_avoided': counters['hits'] / lookups
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return (f"acertos {stats['hit_rate']:.1%} ({stats['hits']} no TTL, "
+                f"{stats['revalidated']} revalidados com 304, {stats['misses']} buscas), "
+                f"requisições evitadas {stats['requests_avoided']:.1%}, "
+                f"{stats['bytes_saved'] / 1024:.0f} KB economizados de "
+                f"{(stats['bytes_saved'] + stats['bytes_fetched']) / 1024:.0f} KB")
+
+    # ----- recursos -----
+
+    def get_patient(self, patient_id):
+        return self.get_json(f"/patients/{patient_id}")
+
+    def get_study(self, study_id):
+        return self.get_json(f"/studies/{study_id}")
+
+    def get_series(self, series_id):
+        return self.get_json(f"/series/{series_id}")
+
+    def get_instance(self, instance_id):
+        return self.get_json(f"/instances/{instance_id}")
+
+    def get_patient_studies(self, patient_id):
+        """Estudos de um PatientID DICOM (ID Orthanc calculado, sem /tools/find)"""
+        try:
+            return self.get_json(f"/patients/{orthanc_id(patient_id)}/studies")
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return []
+            raise
+
+    def list_studies(self):
+        return self.get_json('/studies')
+
+    # ----- consultas em lote (sem N+1) -----
+
+    def _bulk(self, method, path, **kwargs):
+        """Requisição sem cache (POST ou listagens paginadas)"""
+        response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout,
+                                        **kwargs)
+        response.raise_for_status()
+        self._count('bulk_requests')
+        return response.json()
+
+    def iter_find(self, level, query=None, expand=True, page_size=1000, limit=None, **options):
+        """/tools/find paginado por Since/Limit, gerando os recursos página a página
+
+        Com `expand` cada resultado já traz as MainDicomTags (e, nos estudos,
+        as PatientMainDicomTags): uma requisição por página em vez de uma por
+        recurso. `options` são repassadas no corpo (ex.: CaseSensitive).
+        """
+        since = 0
+        while limit is None or since < limit:
+            size = page_size if limit is None else min(page_size, limit - since)
+            page = self._bulk('POST', '/tools/find', json={
+                'Level': level, 'Query': query or {}, 'Expand': expand,
+                'Since': since, 'Limit': size, **options})
+            yield from page
+            since += len(page)
+            if len(page) < size:
+                return
+
+    def find(self, level, query=None, **kwargs):
+        return list(self.iter_find(level, query, **kwargs))
+
+    def iter_expanded(self, collection, page_size=1000, limit=None):
+        """/{coleção}?expand paginado por since/limit (recursos completos, sem filtro)"""
+        since = 0
+        while limit is None or since < limit:
+            size = page_size if limit is None else min(page_size, limit - since)
+            page = self._bulk('GET', f"/{collection}",
+                              params={'expand': '', 'since': since, 'limit': size})
+            yield from page
+            since += len(page)
+            if len(page) < size:
+                return
+
+    def list_expanded(self, collection, **kwargs):
+        return list(self.iter_expanded(collection, **kwargs))
+
+    def get_many(self, collection, ids, workers=8):
+        """GET /{coleção}/{id} de vários recursos, no máximo `workers` em paralelo
+
+        Para o que não cabe em /tools/find ou ?expand. Passa pelo cache; a
+        sessão precisa de um pool com pelo menos `workers` conexões.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda resource_id: self.get_json(f"/{collection}/{resource_id}"),
+                                     ids))
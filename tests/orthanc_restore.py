@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Restauração paralela e verificável a partir dos manifestos do backup incremental
+Autor: Manus AI
+Data: 2024-01-01
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+
+import requests
+
+from orthanc_backup import ChunkStore, list_manifests
+from test_api import OrthancAPITester, iter_batches
+
+TERABYTE = 1024 ** 4
+
+def load_restore_set(repository, until=None):
+    """Estado do acervo segundo os manifestos (até `until`, inclusive)
+
+    Um backup completo substitui o estado anterior, exceto pelas instâncias
+    que falharam nele (mantidas até uma execução seguinte copiá-las de novo);
+    os incrementais acrescentam/atualizam instâncias e aplicam as remoções.
+    """
+    instances = {}
+    for path in list_manifests(repository):
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest['mode'] == 'full':
+            instances = {instance_id: instances[instance_id] for instance_id in manifest['failed']
+                         if instance_id in instances}
+        instances.update(manifest['instances'])
+        for instance_id in manifest['deleted']:
+            instances.pop(instance_id, None)
+        if until and os.path.basename(path).startswith(until):
+            break
+    return instances
+
+def select_instances(instances, patient_ids=None, study_uids=None, date_from=None, date_to=None):
+    """Filtrar por PatientID, StudyInstanceUID e intervalo de StudyDate (AAAAMMDD)"""
+    filtered = bool(patient_ids or study_uids or date_from or date_to)
+    selected = []
+    for instance_id, entry in instances.items():
+        if filtered and 'StudyInstanceUID' not in entry:
+            continue  # Sem tags no manifesto: só entra em restaurações completas
+        if patient_ids and entry['PatientID'] not in patient_ids:
+            continue
+        if study_uids and entry['StudyInstanceUID'] not in study_uids:
+            continue
+        if date_from and entry['StudyDate'] < date_from:
+            continue
+        if date_to and entry['StudyDate'] > date_to:
+            continue
+        selected.append((instance_id, entry))
+    # Estudo por estudo, série por série: o Orthanc estabiliza cada estudo mais cedo
+    selected.sort(key=lambda item: (item[1].get('StudyInstanceUID', ''),
+                                    item[1].get('SeriesInstanceUID', ''), item[0]))
+    return selected
+
+class OrthancRestore:
+    """Reenvio das instâncias do repositório de blocos para o Orthanc
+
+    Cada arquivo é remontado a partir dos blocos (cada um conferido pelo
+    seu SHA-256) e o SHA-256 do arquivo inteiro é comparado ao manifesto
+    antes do envio. O envio usa `workers` conexões keep-alive, por
+    instância (POST /instances) ou em lotes STOW-RS.
+    """
+
+    def __init__(self, base_url, username, password, repository, workers=8, method='rest',
+                 batch_size=50, retries=3, verify_remote=False, timeout=60):
+        self.repository = os.path.abspath(repository)
+        self.store = ChunkStore(self.repository, compression='none')
+        self.tester = OrthancAPITester(base_url, username, password, timeout)
+        self.workers = workers
+        self.method = method
+        self.batch_size = batch_size
+        self.retries = retries
+        self.verify_remote = verify_remote
+        self.lock = threading.Lock()
+        self.counters = {'restored': 0, 'already_stored': 0, 'failed': 0, 'corrupted': 0,
+                         'missing_remote': 0, 'bytes': 0}
+
+    def read_instance(self, instance_id, entry):
+        """Remontar o arquivo e conferir o hash; None se corrompido ou incompleto"""
+        try:
+            data = b''.join(self.store.get(digest) for digest in entry['chunks'])
+        except (KeyError, ValueError, OSError) as e:
+            self._fail('corrupted', instance_id, e)
+            return None
+        if len(data) != entry['size'] or hashlib.sha256(data).hexdigest() != entry['sha256']:
+            self._fail('corrupted', instance_id, "SHA-256 diferente do manifesto")
+            return None
+        return data
+
+    def _fail(self, counter, instance_id, error):
+        with self.lock:
+            self.counters[counter] += 1
+            if self.counters['failed'] + self.counters['corrupted'] <= 10:
+                print(f"   ❌ {instance_id}: {error}")
+
+    def _done(self, session, instance_id, size, status):
+        if status not in ('Success', 'AlreadyStored'):
+            self._fail('failed', instance_id, status)
+            return
+        if self.verify_remote:
+            try:
+                response = session.get(f"{self.tester.base_url}/instances/{instance_id}",
+                                       timeout=self.tester.timeout)
+            except requests.exceptions.RequestException as e:
+                self._fail('missing_remote', instance_id, f"não verificada após o envio: {e}")
+                return
+            if response.status_code != 200:
+                self._fail('missing_remote', instance_id, f"ausente após o envio ({response.status_code})")
+                return
+        with self.lock:
+            self.counters['restored' if status == 'Success' else 'already_stored'] += 1
+            self.counters['bytes'] += size
+
+    def restore_instance(self, session, instance_id, entry):
+        data = self.read_instance(instance_id, entry)
+        if data is None:
+            return
+        status, _, _ = self.tester._upload_source(session, len(data), lambda: io.BytesIO(data),
+                                                  self.retries)
+        self._done(session, instance_id, len(data), status)
+
+    def restore_batch(self, session, batch):
+        parts = []
+        for instance_id, entry in batch:
+            data = self.read_instance(instance_id, entry)
+            if data is not None:
+                parts.append((instance_id, len(data), lambda data=data: io.BytesIO(data)))
+        if not parts:
+            return
+        stored, failed, _, error = self.tester._stow_batch(session, parts, self.retries)
+        if failed or error:
+            # A resposta STOW não identifica quais falharam: o lote todo é reportado
+            for instance_id, _, _ in parts:
+                self._fail('failed', instance_id, f"lote de {len(parts)}: {error or f'{failed} falhas'}")
+            return
+        for instance_id, size, _ in parts:
+            self._done(session, instance_id, size, 'Success')
+
+    def run(self, selected, dry_run=False):
+        total_bytes = sum(entry['size'] for _, entry in selected)
+        print(f"♻️ Restauração: {len(selected)} instâncias, {total_bytes / 1024 / 1024:.1f} MB, "
+              f"{self.workers} conexões ({'STOW-RS' if self.method == 'stow' else 'REST'})")
+
+        session = self.tester._pooled_session(self.workers)
+        start_time = time.time()
+        try:
+            if dry_run:
+                # Apenas conferência dos blocos e hashes, sem enviar ao Orthanc
+                def verify(instance_id, entry):
+                    if self.read_instance(instance_id, entry) is not None:
+                        with self.lock:
+                            self.counters['bytes'] += entry['size']
+                jobs = iter(selected)
+                func = verify
+            elif self.method == 'stow':
+                jobs = ((session, batch) for batch in iter_batches(iter(selected), self.batch_size))
+                func = self.restore_batch
+            else:
+                jobs = ((session, instance_id, entry) for instance_id, entry in selected)
+                func = self.restore_instance
+            self.tester._run_bounded(jobs, self.workers, func)
+        finally:
+            session.close()
+        return time.time() - start_time
+
+    def report(self, wall_time, rto_hours=None, dry_run=False):
+        counters = self.counters
+        megabytes = counters['bytes'] / 1024 / 1024
+        wall_time = max(wall_time, 1e-9)
+        rate = counters['bytes'] / wall_time
+        errors = counters['failed'] + counters['corrupted'] + counters['missing_remote']
+        status = "✅" if not errors else "❌"
+
+        if dry_run:
+            print(f"{status} Verificação: {megabytes:.1f} MB íntegros em {wall_time:.1f}s "
+                  f"({megabytes / wall_time:.1f} MB/s), {counters['corrupted']} corrompidas")
+        else:
+            instances = counters['restored'] + counters['already_stored']
+            print(f"{status} Restauração: {instances} instâncias ({counters['restored']} novas, "
+                  f"{counters['already_stored']} já existentes), {megabytes:.1f} MB em {wall_time:.1f}s")
+            print(f"   Vazão: {megabytes / wall_time:.1f} MB/s, {instances / wall_time:.1f} instâncias/s")
+            print(f"   Falhas: {counters['failed']} envio, {counters['corrupted']} corrompidas, "
+                  f"{counters['missing_remote']} ausentes após o envio")
+
+        if rate > 0:
+            projected = TERABYTE / rate / 3600
+            line = f"   Projeção para 1 TB nesta vazão: {projected:.1f} h"
+            if rto_hours:
+                line += (f" - {'dentro' if projected <= rto_hours else 'ACIMA'} do RTO de {rto_hours:g} h")
+                if projected > rto_hours:
+                    print(line)
+                    print(f"   ⚠️ Necessário ≥ {TERABYTE / (rto_hours * 3600) / 1024 / 1024:.0f} MB/s: "
+                          f"aumente --workers ou use --method stow")
+                    return False
+            print(line)
+        return not errors
+
+def main():
+    parser = argparse.ArgumentParser(description='Restaurar instâncias do backup incremental')
+    parser.add_argument('--url', default='https://pacs.radiweb.com.br',
+                       help='URL base do Orthanc de destino')
+    parser.add_argument('--username', default='admin',
+                       help='Nome de usuário')
+    parser.add_argument('--password', default='admin',
+                       help='Senha')
+    parser.add_argument('--repository', default='/backups/orthanc-incremental',
+                       help='Diretório do repositório de backup')
+    parser.add_argument('--until',
+                       help='Restaurar o estado até este manifesto (nome ou prefixo, ex.: backup_20240101)')
+    parser.add_argument('--patient-id', action='append',
+                       help='Restaurar apenas este PatientID (pode repetir)')
+    parser.add_argument('--study-uid', action='append',
+                       help='Restaurar apenas este StudyInstanceUID (pode repetir)')
+    parser.add_argument('--date-from',
+                       help='StudyDate inicial (AAAAMMDD)')
+    parser.add_argument('--date-to',
+                       help='StudyDate final (AAAAMMDD)')
+    parser.add_argument('--method', choices=['rest', 'stow'], default='rest',
+                       help='POST /instances por instância ou lotes STOW-RS')
+    parser.add_argument('--batch-size', type=int, default=50,
+                       help='Instâncias por requisição STOW-RS')
+    parser.add_argument('--workers', type=int, default=8,
+                       help='Conexões simultâneas')
+    parser.add_argument('--retries', type=int, default=3,
+                       help='Novas tentativas em erros 5xx/conexão')
+    parser.add_argument('--verify-remote', action='store_true',
+                       help='Confirmar cada instância no Orthanc após o envio')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Apenas verificar blocos e hashes, sem enviar')
+    parser.add_argument('--rto-hours', type=float,
+                       help='RTO alvo: falhar se a projeção para 1 TB exceder estas horas')
+
+    args = parser.parse_args()
+
+    if not list_manifests(args.repository):
+        print(f"❌ Nenhum manifesto em {args.repository}")
+        sys.exit(1)
+
+    instances = load_restore_set(args.repository, args.until)
+    selected = select_instances(instances, set(args.patient_id or ()), set(args.study_uid or ()),
+                                args.date_from, args.date_to)
+    if not selected:
+        print("⚠️ Nenhuma instância corresponde aos filtros")
+        sys.exit(1)
+
+    restore = OrthancRestore(args.url, args.username, args.password, args.repository,
+                             args.workers, args.method, args.batch_size, args.retries,
+                             args.verify_remote)
+    try:
+        wall_time = restore.run(selected, args.dry_run)
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Erro na restauração: {e}")
+        sys.exit(1)
+
+    sys.exit(0 if restore.report(wall_time, args.rto_hours, args.dry_run) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Armazenamento de resultados de benchmark e detecção de regressões do Orthanc PACS Radiweb
+Autor: Manus AI
+Data: 2024-01-01
+"""
+
+import os
+import sys
+import json
+import math
+import uuid
+import socket
+import platform
+import argparse
+import functools
+import threading
+import subprocess
+from datetime import datetime
+from importlib import metadata
+
+DEFAULT_STORE = 'benchmark_results.jsonl'
+
+# Pacotes cujas versões entram nos metadados de cada execução
+TRACKED_PACKAGES = ('pydicom', 'pynetdicom', 'requests', 'aiohttp', 'numpy')
+
+@functools.lru_cache(maxsize=1)
+def environment():
+    """Metadados do ambiente que produziu os números (máquina, Python, pacotes, commit)"""
+    packages = {}
+    for name in TRACKED_PACKAGES:
+        try:
+            packages[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            pass
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+
+    return {
+        'hostname': socket.gethostname(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'packages': packages,
+        'git_commit': commit
+    }
+
+def histogram_metrics(name, histogram, percentiles=(50, 90, 99)):
+    """Métricas escalares `<name>_pXX_ms`/`<name>_mean_ms` de um LatencyHistogram"""
+    metrics = {f"{name}_p{p:g}_ms": histogram.percentile(p) * 1000 for p in percentiles}
+    metrics[f"{name}_mean_ms"] = histogram.mean * 1000
+    return metrics
+
+def metric_direction(name):
+    """+1 se maior é melhor, -1 se menor é melhor, 0 para contagens (não comparadas)"""
+    if name.endswith(('_per_s', 'speedup', 'hit_rate')):
+        return 1
+    if name.endswith(('_ms', '_s', 'error_rate')):
+        return -1
+    return 0
+
+def mann_whitney(buckets_a, buckets_b):
+    """Teste U de Mann-Whitney (bilateral) sobre histogramas {valor: contagem}
+
+    Usa a aproximação normal com correção de empates, adequada aos valores
+    agrupados em buckets. Retorna (z, p); z > 0 indica valores maiores em `b`.
+    """
+    n1, n2 = sum(buckets_a.values()), sum(buckets_b.values())
+    if not n1 or not n2:
+        return 0.0, 1.0
+
+    rank = 0
+    rank_sum_b = 0.0
+    ties = 0
+    for value in sorted(set(buckets_a) | set(buckets_b)):
+        count_a, count_b = buckets_a.get(value, 0), buckets_b.get(value, 0)
+        tied = count_a + count_b
+        rank_sum_b += count_b * (rank + (tied + 1) / 2)
+        ties += tied ** 3 - tied
+        rank += tied
+
+    n = n1 + n2
+    u = rank_sum_b - n2 * (n2 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))) if n > 1 else 0
+    if variance <= 0:
+        return 0.0, 1.0
+    z = (u - n1 * n2 / 2) / math.sqrt(variance)
+    return z, math.erfc(abs(z) / math.sqrt(2))
+
+def _buckets(run, histogram):
+    data = run.get('histograms', {}).get(histogram)
+    if not data:
+        return None
+    return {int(value): count for value, count in data.get('buckets_us', {}).items()}
+
+def _metric_histogram(run, metric):
+    """Histograma que sustenta o teste estatístico de uma métrica, se houver"""
+    for name in run.get('histograms', {}):
+        if metric.startswith(name + '_'):
+            return name
+    if metric.endswith('_per_s'):
+        # Vazão em malha fechada é governada pela distribuição de latência principal
+        return run.get('primary')
+    return None
+
+def compare_runs(baseline, current, threshold=0.10, alpha=0.05, untested_factor=4):
+    """Comparar as métricas de duas execuções do mesmo benchmark
+
+    Uma métrica regride quando piora mais que `threshold` (relativo) e o teste
+    de Mann-Whitney sobre o histograma correspondente é significativo (p <
+    `alpha`) na mesma direção. Métricas sem histograma nas duas execuções
+    (medidas únicas) são marcadas `tested=False` e só regridem com uma piora
+    `untested_factor` vezes maior que o limiar. Com linha de base zero a
+    variação é absoluta (`absolute=True`) e qualquer piora conta.
+    """
+    rows = []
+    for metric, value in current.get('metrics', {}).items():
+        direction = metric_direction(metric)
+        base = baseline.get('metrics', {}).get(metric)
+        if not direction or base is None or value is None:
+            continue
+
+        if base:
+            change = (value - base) / base
+            worse = change * direction < -threshold
+            better = change * direction > threshold
+        else:
+            # Sem variação relativa a partir de zero: qualquer piora conta, em valor absoluto
+            change = value - base
+            worse = change * direction < 0
+            better = change * direction > 0
+
+        histogram = _metric_histogram(current, metric)
+        buckets_base = _buckets(baseline, histogram) if histogram else None
+        buckets_current = _buckets(current, histogram) if histogram else None
+        tested = bool(buckets_base and buckets_current)
+        z, p = mann_whitney(buckets_base, buckets_current) if tested else (0.0, None)
+
+        if tested:
+            # Latências maiores (z > 0) pioram tanto métricas de latência quanto de vazão
+            slower = z > 0
+            significant = p < alpha
+            regression = worse and significant and slower
+            improvement = better and significant and not slower
+        else:
+            margin = threshold * untested_factor if base else 0.0
+            regression, improvement = change * direction < -margin, change * direction > margin
+
+        rows.append({'metric': metric, 'baseline': base, 'current': value, 'change': change,
+                     'absolute': not base, 'p_value': p, 'tested': tested,
+                     'regression': regression, 'improvement': improvement})
+    return rows
+
+def print_comparison(rows, baseline, current):
+    print(f"📊 Comparação {baseline['benchmark']}: {baseline['run_id']} "
+          f"({baseline['timestamp'][:19]}) → {current['run_id']} ({current['timestamp'][:19]})")
+    print(f"   {'Métrica':<28}{'Base':>11}{'Atual':>11}{'Variação':>10}{'p':>9}  Resultado")
+    for row in rows:
+        p_value = f"{row['p_value']:.3f}" if row['tested'] else 'n/d'
+        if row['regression']:
+            verdict = "⚠️ REGRESSÃO" + ("" if row['tested'] else " (sem amostras)")
+        elif row['improvement']:
+            verdict = "✅ melhora"
+        else:
+            verdict = "="
+        change = f"{row['change']:+.3f}" if row.get('absolute') else f"{row['change']:+.1%}"
+        print(f"   {row['metric']:<28}{row['baseline']:>11.3f}{row['current']:>11.3f}"
+              f"{change:>10}{p_value:>9}  {verdict}")
+
+class ResultsStore:
+    """Execuções de benchmark anexadas a um arquivo JSONL (uma por linha)"""
+
+    def __init__(self, path=DEFAULT_STORE, pinned=None):
+        self.path = path
+        self.lock = threading.Lock()
+        # IDs completos, validados já na abertura (KeyError se ausente ou ambíguo)
+        self.pinned = [self.get(run_id)['run_id'] for run_id in pinned or ()]
+
+    def append(self, run):
+        line = json.dumps(run, separators=(',', ':'))
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+    def runs(self, benchmark=None):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+        return [run for run in runs if benchmark is None or run['benchmark'] == benchmark]
+
+    def get(self, run_id):
+        """Execução pelo ID (ou prefixo único do ID)"""
+        matches = [run for run in self.runs() if run['run_id'].startswith(run_id)]
+        if len(matches) != 1:
+            raise KeyError(run_id)
+        return matches[0]
+
+    def baseline(self, run):
+        """Linha de base de uma execução
+
+        Uma execução fixada (`pinned`) do mesmo benchmark tem prioridade; sem
+        ela, a execução anterior aprovada mais recente do mesmo benchmark, alvo
+        e parâmetros. Execuções reprovadas nunca viram linha de base implícita.
+        """
+        pinned = [self.get(run_id) for run_id in self.pinned]
+        pinned = [previous for previous in pinned
+                  if previous['benchmark'] == run['benchmark'] and previous['run_id'] != run['run_id']]
+        if pinned:
+            return pinned[-1]
+        candidates = [previous for previous in self.runs(run['benchmark'])
+                      if previous['run_id'] != run['run_id']
+                      and previous['passed']
+                      and previous['target'] == run['target']
+                      and previous['params'] == run['params']
+                      and previous['timestamp'] <= run['timestamp']]
+        return candidates[-1] if candidates else None
+
+class BenchmarkResults:
+    """Saída estruturada dos métodos de medição de DicomTester e OrthancAPITester
+
+    Cada benchmark produz um registro JSON (parâmetros, métricas escalares e
+    histogramas) guardado em `self.results` e, se `self.results_store`
+    estiver definido, anexado ao armazenamento. Com uma execução anterior
+    comparável, o sucesso passa a depender da ausência de regressões em vez
+    dos limites absolutos.
+    """
+
+    results_store = None
+
+    def record_result(self, benchmark, params, metrics, histograms=None, primary=None,
+                      passed=True, limits=None):
+        run = {
+            'run_id': uuid.uuid4().hex[:12],
+            'timestamp': datetime.now().isoformat(),
+            'benchmark': benchmark,
+            'target': self.target,
+            'params': params,
+            'environment': environment(),
+            'metrics': metrics,
+            'histograms': {name: hist.to_dict() for name, hist in (histograms or {}).items()},
+            'primary': primary,
+            'passed': passed
+        }
+
+        baseline = self.results_store.baseline(run) if self.results_store else None
+        if baseline:
+            rows = compare_runs(baseline, run)
+            regressions = [row['metric'] for row in rows if row['regression']]
+            if regressions:
+                listed = ', '.join(regressions[:5])
+                if len(regressions) > 5:
+                    listed += f" e mais {len(regressions) - 5}"
+                print(f"   📈 Linha de base {baseline['run_id']}: ⚠️ regressão em {listed}")
+            else:
+                print(f"   📈 Linha de base {baseline['run_id']}: sem regressões")
+            run['baseline'] = baseline['run_id']
+            run['regressions'] = regressions
+            run['passed'] = passed and not regressions
+        elif limits:
+            run['passed'] = passed and all(metrics.get(name, 0) <= limit
+                                           for name, limit in limits.items())
+
+        self.results.append(run)
+        if self.results_store:
+            self.results_store.append(run)
+        return run['passed']
+
+    def export_results(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.results, f, indent=2)
+        print(f"📄 {len(self.results)} resultado(s) exportado(s) para {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Consultar e comparar resultados de benchmark')
+    parser.add_argument('--store', default=DEFAULT_STORE,
+                       help='Arquivo JSONL de resultados')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list', help='Listar execuções')
+    list_parser.add_argument('--benchmark', help='Filtrar por benchmark')
+
+    show_parser = subparsers.add_parser('show', help='Mostrar uma execução em JSON')
+    show_parser.add_argument('run_id')
+
+    compare_parser = subparsers.add_parser('compare', help='Comparar execução com a linha de base')
+    compare_parser.add_argument('--current',
+                               help='Execução avaliada (padrão: a mais recente)')
+    compare_parser.add_argument('--baseline',
+                               help='Linha de base (padrão: anterior aprovada com mesmo alvo e parâmetros)')
+    compare_parser.add_argument('--benchmark', help='Benchmark da execução mais recente')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                               help='Variação relativa mínima considerada (padrão: 10%%)')
+    compare_parser.add_argument('--alpha', type=float, default=0.05,
+                               help='Nível de significância do teste de Mann-Whitney')
+
+    args = parser.parse_args()
+    store = ResultsStore(args.store)
+
+    try:
+        if args.command == 'list':
+            runs = store.runs(args.benchmark)
+            print(f"   {'ID':<14}{'Data':<21}{'Benchmark':<20}{'Resultado':<10}Alvo")
+            for run in runs:
+                status = "✅" if run['passed'] else "❌"
+                target = run['target'].get('url') or (f"{run['target'].get('ae_title')}@"
+                                                      f"{run['target'].get('host')}:"
+                                                      f"{run['target'].get('port')}")
+                print(f"   {run['run_id']:<14}{run['timestamp'][:19]:<21}"
+                      f"{run['benchmark']:<20}{status:<10}{target}")
+            print(f"   {len(runs)} execução(ões)")
+            return 0
+
+        if args.command == 'show':
+            print(json.dumps(store.get(args.run_id), indent=2))
+            return 0
+
+        if args.current:
+            current = store.get(args.current)
+        else:
+            runs = store.runs(args.benchmark)
+            if not runs:
+                print("❌ Nenhuma execução armazenada")
+                return 1
+            current = runs[-1]
+        baseline = store.get(args.baseline) if args.baseline else store.baseline(current)
+        if baseline is None:
+            print(f"❌ Sem linha de base para {current['run_id']} ({current['benchmark']})")
+            return 1
+        if baseline['benchmark'] != current['benchmark']:
+            print(f"❌ Benchmarks diferentes: {baseline['benchmark']} x {current['benchmark']}")
+            return 1
+    except KeyError as e:
+        print(f"❌ Execução não encontrada ou ambígua: {e}")
+        return 1
+
+    rows = compare_runs(baseline, current, args.threshold, args.alpha)
+    print_comparison(rows, baseline, current)
+    regressions = [row for row in rows if row['regression']]
+    if regressions:
+        print(f"⚠️ {len(regressions)} regressão(ões) detectada(s)")
+        return 1
+    print("✅ Nenhuma regressão detectada")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,17 +5,146 @@ Autor: Manus AI
 Data: 2024-01-01
 """
 
+import io
 import os
 import sys
+import time
+import threading
+import contextvars
 import subprocess
 import argparse
+import json
+import concurrent.futures
 from datetime import datetime
 
-def run_command(command, description):
+from test_dicom_connectivity import DicomTester
+from test_api import OrthancAPITester
+from results_store import ResultsStore
+from create_test_dicom import create_test_matrix
+
+class StageOutput(io.TextIOBase):
+    """stdout que separa a saída de cada etapa executada em paralelo
+
+    O buffer da etapa fica numa ContextVar: as threads que a etapa cria
+    propagam o contexto com contextvars.copy_context() e escrevem no mesmo
+    buffer, impresso de uma vez quando a etapa termina. Fora das etapas a
+    saída vai direto ao terminal.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = contextvars.ContextVar('stage_output_buffer', default=None)
+        self.lock = threading.Lock()
+
+    def capture(self):
+        self.buffer.set(io.StringIO())
+
+    def release(self):
+        buffer = self.buffer.get()
+        self.buffer.set(None)
+        return buffer.getvalue()
+
+    def write(self, text):
+        buffer = self.buffer.get()
+        if buffer is None:
+            return self.stream.write(text)
+        with self.lock:
+            return buffer.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+class Stage:
+    def __init__(self, name, description, func, depends=()):
+        self.name = name
+        self.description = description
+        self.func = func
+        self.depends = tuple(depends)
+        self.success = None
+        self.skipped = False
+        self.start = None
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end - self.start) if self.end is not None else 0.0
+
+def run_stages(stages, workers=4):
+    """Executar as etapas respeitando dependências, as independentes em paralelo
+
+    Uma etapa começa quando todas as suas dependências terminam com sucesso;
+    se alguma falhar, ela é pulada. Retorna o tempo total (parede).
+    """
+    by_name = {stage.name: stage for stage in stages}
+    output = StageOutput(sys.stdout)
+    lock = threading.Lock()
+    origin = time.time()
+
+    def execute(stage):
+        output.capture()
+        stage.start = time.time()
+        try:
+            stage.success = bool(stage.func())
+        except Exception as e:
+            print(f"❌ Erro em {stage.description}: {e}")
+            stage.success = False
+        stage.end = time.time()
+        text = output.release()
+
+        with lock:
+            print(f"\n{'='*60}")
+            print(f"🔍 {stage.description} "
+                  f"[{stage.start - origin:.1f}s → {stage.end - origin:.1f}s]")
+            print(f"{'='*60}")
+            print(text.rstrip())
+            status = "✅ SUCESSO" if stage.success else "❌ FALHOU"
+            print(f"{status} - {stage.description} ({stage.duration:.1f}s)")
+        return stage
+
+    sys.stdout = output
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = list(stages)
+            running = set()
+            while pending or running:
+                for stage in list(pending):
+                    deps = [by_name[name] for name in stage.depends]
+                    if any(dep.success is False or dep.skipped for dep in deps):
+                        stage.skipped = True
+                        pending.remove(stage)
+                        print(f"\n⏭️ {stage.description} - PULADO (dependência falhou)")
+                    elif all(dep.success for dep in deps):
+                        pending.remove(stage)
+                        running.add(executor.submit(contextvars.copy_context().run, execute, stage))
+
+                if running:
+                    done, running = concurrent.futures.wait(
+                        running, return_when=concurrent.futures.FIRST_COMPLETED)
+    finally:
+        sys.stdout = output.stream
+
+    return time.time() - origin
+
+def print_timing(stages, wall_time):
+    """Tempo de cada etapa e economia em relação à execução em série"""
+    print(f"\n⏱️ Tempo por etapa:")
+    for stage in stages:
+        if stage.skipped:
+            print(f"   {stage.name:<14} {'pulada':>8}")
+        else:
+            print(f"   {stage.name:<14} {stage.duration:>7.1f}s")
+    serial_time = sum(stage.duration for stage in stages)
+    print(f"   {'total (parede)':<14} {wall_time:>7.1f}s")
+    if wall_time > 0:
+        print(f"   Soma das etapas (execução em série): {serial_time:.1f}s - "
+              f"economia de {serial_time - wall_time:.1f}s ({serial_time / wall_time:.2f}x)")
+
+def run_command(command, description, banner=True):
     """Executar comando e capturar resultado"""
-    print(f"\n{'='*60}")
-    print(f"🔍 {description}")
-    print(f"{'='*60}")
+    if banner:
+        print(f"\n{'='*60}")
+        print(f"🔍 {description}")
+        print(f"{'='*60}")
     
     try:
         result = subprocess.run(command, shell=True, capture_output=True, text=True)
@@ -81,57 +210,15 @@ def check_dependencies():
         print("✅ Todas as dependências estão disponíveis")
         return True
 
-def create_test_data(output_dir):
-    """Criar dados de teste DICOM"""
+def create_test_data(output_dir, matrix='basic'):
+    """Criar dados de teste DICOM a partir da matriz declarativa (com cache em disco)"""
     print("🏥 Criando dados de teste DICOM...")
     
-    script_path = os.path.join(os.path.dirname(__file__), 'create_test_dicom.py')
-    
-    if not os.path.exists(script_path):
-        print(f"❌ Script não encontrado: {script_path}")
-        return False
-    
-    # Criar diferentes tipos de imagens de teste
-    test_cases = [
-        {
-            'patient_name': 'TESTE^RADIWEB^CT',
-            'patient_id': 'TEST_CT_001',
-            'modality': 'CT',
-            'pattern': 'gradient',
-            'filename': 'test_ct_gradient.dcm'
-        },
-        {
-            'patient_name': 'TESTE^RADIWEB^MR',
-            'patient_id': 'TEST_MR_001',
-            'modality': 'MR',
-            'pattern': 'circles',
-            'filename': 'test_mr_circles.dcm'
-        },
-        {
-            'patient_name': 'TESTE^RADIWEB^US',
-            'patient_id': 'TEST_US_001',
-            'modality': 'US',
-            'pattern': 'noise',
-            'filename': 'test_us_noise.dcm'
-        }
-    ]
-    
-    created_files = []
-    
-    for test_case in test_cases:
-        cmd = f"python3 {script_path} " \
-              f"--patient-name '{test_case['patient_name']}' " \
-              f"--patient-id {test_case['patient_id']} " \
-              f"--modality {test_case['modality']} " \
-              f"--pattern {test_case['pattern']} " \
-              f"--output-dir {output_dir}"
-        
-        if run_command(cmd, f"Criando {test_case['filename']}"):
-            expected_file = os.path.join(output_dir, f"test_{test_case['modality'].lower()}_{test_case['patient_id']}.dcm")
-            if os.path.exists(expected_file):
-                created_files.append(expected_file)
-    
-    return created_files
+    try:
+        return create_test_matrix(matrix, output_dir, prune=True)
+    except (OSError, ValueError) as e:
+        print(f"❌ Matriz de teste inválida: {e}")
+        return []
 
 def main():
     parser = argparse.ArgumentParser(description='Executar todos os testes do Orthanc PACS')
@@ -152,7 +239,21 @@ def main():
     parser.add_argument('--skip-create', action='store_true',
                        help='Pular criação de dados de teste')
     parser.add_argument('--test-dir', default='./test_data',
-                       help='Diretório para dados de teste')
+                       help='Diretório (cache) dos dados de teste')
+    parser.add_argument('--matrix', default='basic',
+                       help='Matriz de dados de teste: basic, full ou arquivo JSON')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Remover os dados de teste ao final em vez de reaproveitá-los')
+    parser.add_argument('--workers', type=int, default=4,
+                       help='Etapas simultâneas (e uploads simultâneos)')
+    parser.add_argument('--serial', action='store_true',
+                       help='Executar as etapas uma a uma (para comparar o tempo)')
+    parser.add_argument('--json-output',
+                       help='Exportar resultados estruturados (etapas e benchmarks) em JSON')
+    parser.add_argument('--results-store',
+                       help='Anexar os benchmarks a este arquivo JSONL e comparar com a execução anterior')
+    parser.add_argument('--baseline', action='append',
+                       help='Execução fixada como linha de base do seu benchmark (pode repetir)')
     
     args = parser.parse_args()
     
@@ -175,73 +276,54 @@ def main():
     # Criar diretório de teste
     os.makedirs(args.test_dir, exist_ok=True)
     
-    # Criar dados de teste
+    # Etapas: dados de teste -> uploads -> consultas; conectividade e DICOM
+    # não dependem das etapas HTTP e rodam em paralelo a elas
     test_files = []
-    if not args.skip_create:
-        test_files = create_test_data(args.test_dir)
+    dicom_tester = DicomTester(args.host, args.dicom_port, args.ae_title)
+    api_tester = OrthancAPITester(args.http_url, args.username, args.password)
+    if args.results_store:
+        try:
+            results_store = ResultsStore(args.results_store, args.baseline)
+            dicom_tester.results_store = api_tester.results_store = results_store
+        except KeyError as e:
+            print(f"❌ Linha de base não encontrada ou ambígua: {e}")
+            sys.exit(1)
+
+    def create_data():
+        if args.skip_create:
+            print("⏭️ Criação de dados de teste pulada (--skip-create)")
+            return True
+        test_files.extend(create_test_data(args.test_dir, args.matrix))
         if not test_files:
             print("⚠️ Nenhum arquivo de teste criado. Continuando sem dados de teste.")
-    
-    # Lista de testes a executar
-    tests = []
-    
-    # 1. Teste de conectividade básica
-    tests.append({
-        'command': f"./test-connectivity.sh -d {args.host}",
-        'description': 'Teste de Conectividade Básica'
-    })
-    
-    # 2. Teste DICOM
-    dicom_cmd = f"python3 tests/test_dicom_connectivity.py " \
-                f"--host {args.host} " \
-                f"--port {args.dicom_port} " \
-                f"--ae-title {args.ae_title}"
-    
-    if test_files:
-        dicom_cmd += f" --dicom-file {test_files[0]}"
-    
-    tests.append({
-        'command': dicom_cmd,
-        'description': 'Teste de Conectividade DICOM'
-    })
-    
-    # 3. Teste API REST
-    api_cmd = f"python3 tests/test_api.py " \
-              f"--url {args.http_url} " \
-              f"--username {args.username} " \
-              f"--password {args.password}"
-    
-    if test_files:
-        api_cmd += f" --dicom-file {test_files[0]}"
-    
-    tests.append({
-        'command': api_cmd,
-        'description': 'Teste da API REST'
-    })
-    
-    # 4. Teste de upload de múltiplos arquivos
-    if len(test_files) > 1:
-        for i, test_file in enumerate(test_files[1:], 2):
-            upload_cmd = f"curl -X POST -u {args.username}:{args.password} " \
-                        f"-H 'Content-Type: application/dicom' " \
-                        f"--data-binary @{test_file} " \
-                        f"{args.http_url}/instances"
-            
-            tests.append({
-                'command': upload_cmd,
-                'description': f'Upload DICOM {i} via REST'
-            })
-    
-    # Executar todos os testes
-    results = []
-    
-    for test in tests:
-        success = run_command(test['command'], test['description'])
-        results.append({
-            'name': test['description'],
-            'success': success
-        })
-    
+        return True
+
+    def upload_files():
+        # Upload dos demais arquivos em paralelo (streaming, keep-alive);
+        # o primeiro é enviado pelos testes DICOM e da API
+        if len(test_files) < 2:
+            print("⏭️ Sem arquivos adicionais para upload")
+            return True
+        return api_tester.test_bulk_upload(test_files[1:], workers=args.workers)
+
+    stages = [
+        Stage('connectivity', 'Teste de Conectividade Básica',
+              lambda: run_command(f"./test-connectivity.sh -d {args.host}",
+                                  'Teste de Conectividade Básica', banner=False)),
+        Stage('data', 'Criação de Dados de Teste', create_data),
+        Stage('dicom', 'Teste de Conectividade DICOM',
+              lambda: dicom_tester.run_all_tests(test_files[0] if test_files else None),
+              depends=['data']),
+        Stage('upload', 'Upload DICOM via REST', upload_files, depends=['data']),
+        Stage('api', 'Teste da API REST',
+              lambda: api_tester.run_all_tests(test_files[0] if test_files else None),
+              depends=['upload']),
+    ]
+
+    wall_time = run_stages(stages, 1 if args.serial else args.workers)
+    results = [{'name': stage.description, 'success': bool(stage.success)}
+               for stage in stages]
+
     # Resumo final
     print(f"\n{'='*60}")
     print("📊 RESUMO FINAL DOS TESTES")
@@ -254,6 +336,20 @@ def main():
         status = "✅ PASSOU" if result['success'] else "❌ FALHOU"
         print(f"   {result['name']}: {status}")
     
+    print_timing(stages, wall_time)
+    
+    if args.json_output:
+        report = {
+            'timestamp': datetime.now().isoformat(),
+            'wall_time_s': wall_time,
+            'stages': [{'name': stage.name, 'success': stage.success, 'skipped': stage.skipped,
+                        'duration_s': stage.duration} for stage in stages],
+            'benchmarks': dicom_tester.results + api_tester.results
+        }
+        with open(args.json_output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📄 Resultados exportados para {args.json_output}")
+    
     print(f"\n🎯 Resultado Geral: {passed_tests}/{total_tests} testes passaram")
     
     if passed_tests == total_tests:
@@ -280,7 +376,7 @@ def main():
         exit_code = 2
     
     # Limpeza
-    if test_files and not args.skip_create:
+    if test_files and args.no_cache:
         print(f"\n🧹 Limpando arquivos de teste...")
         for test_file in test_files:
             try:
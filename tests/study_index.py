@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Índice local (SQLite) de pacientes, estudos e séries do Orthanc PACS Radiweb,
+atualizado incrementalmente pelo log de mudanças (/changes)
+Autor: Manus AI
+Data: 2024-01-01
+"""
+
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import concurrent.futures
+
+try:
+    import requests
+    from requests.auth import HTTPBasicAuth
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    print("❌ requests não está instalado. Instale com: pip install requests")
+    sys.exit(1)
+
+from changes_feed import ChangesFeed
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    id TEXT PRIMARY KEY,
+    patient_id TEXT,
+    patient_name TEXT,
+    birth_date TEXT,
+    sex TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS studies (
+    id TEXT PRIMARY KEY,
+    patient TEXT,
+    patient_id TEXT,
+    patient_name TEXT,
+    study_uid TEXT,
+    accession_number TEXT,
+    study_date TEXT,
+    study_time TEXT,
+    description TEXT,
+    modalities TEXT,
+    series_count INTEGER DEFAULT 0,
+    instances_count INTEGER DEFAULT 0,
+    last_update TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS series (
+    id TEXT PRIMARY KEY,
+    study TEXT,
+    series_uid TEXT,
+    modality TEXT,
+    series_number TEXT,
+    description TEXT,
+    instances_count INTEGER
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- Índices de cobertura: a lista de trabalho é respondida só pelo índice
+CREATE INDEX IF NOT EXISTS idx_studies_patient ON studies (
+    patient_id, study_date, study_time, id, study_uid, accession_number, description,
+    modalities, series_count, instances_count, patient_name);
+CREATE INDEX IF NOT EXISTS idx_studies_accession ON studies (accession_number, patient_id, id);
+CREATE INDEX IF NOT EXISTS idx_studies_date ON studies (study_date, patient_id, id);
+CREATE INDEX IF NOT EXISTS idx_studies_patient_ref ON studies (patient);
+CREATE INDEX IF NOT EXISTS idx_series_modality ON series (modality, study);
+CREATE INDEX IF NOT EXISTS idx_series_study ON series (study);
+"""
+
+# Colunas devolvidas pelas consultas (chaves iguais às do lote em changes_feed)
+STUDY_COLUMNS = [('id', 'study_id'), ('study_uid', 'study_instance_uid'),
+                 ('patient_id', 'patient_id'), ('patient_name', 'patient_name'),
+                 ('study_date', 'study_date'), ('study_time', 'study_time'),
+                 ('description', 'study_description'), ('accession_number', 'accession_number'),
+                 ('modalities', 'modalities'), ('series_count', 'series_count'),
+                 ('instances_count', 'instances_count')]
+
+# Modalidades, séries e instâncias de cada estudo, recalculadas a partir das séries
+AGGREGATES = """
+UPDATE studies SET
+    modalities = (SELECT group_concat(modality, '/') FROM
+                  (SELECT DISTINCT modality FROM series
+                   WHERE study = studies.id AND modality != '' ORDER BY modality)),
+    series_count = (SELECT count(*) FROM series WHERE study = studies.id),
+    instances_count = (SELECT coalesce(sum(instances_count), 0) FROM series WHERE study = studies.id)
+"""
+
+def study_row(study):
+    tags = study.get('MainDicomTags', {})
+    patient = study.get('PatientMainDicomTags', {})
+    return (study['ID'], study.get('ParentPatient'), patient.get('PatientID', ''),
+            patient.get('PatientName', ''), tags.get('StudyInstanceUID', ''),
+            tags.get('AccessionNumber', ''), tags.get('StudyDate', ''), tags.get('StudyTime', ''),
+            tags.get('StudyDescription', ''), study.get('LastUpdate'))
+
+def patient_row(study):
+    patient = study.get('PatientMainDicomTags', {})
+    return (study.get('ParentPatient'), patient.get('PatientID', ''), patient.get('PatientName', ''),
+            patient.get('PatientBirthDate', ''), patient.get('PatientSex', ''))
+
+def series_row(series):
+    tags = series.get('MainDicomTags', {})
+    return (series['ID'], series.get('ParentStudy'), tags.get('SeriesInstanceUID', ''),
+            tags.get('Modality', ''), tags.get('SeriesNumber', ''),
+            tags.get('SeriesDescription', ''), len(series.get('Instances', [])))
+
+class StudyIndex:
+    """Espelho local das MainDicomTags de pacientes, estudos e séries
+
+    A primeira sincronização copia o acervo em páginas de /studies?expand
+    e /series?expand (sem uma requisição por estudo); as seguintes aplicam
+    só o /changes desde o cursor, gravado na mesma transação que os dados.
+    Cada estudo alterado é relido com 2 requisições (estudo e séries);
+    eventos de série e instância são cobertos pelo StableStudy que o
+    Orthanc emite depois deles. Contagens de instâncias removidas
+    isoladamente só se atualizam no próximo evento do estudo.
+    """
+
+    def __init__(self, database, base_url, username=None, password=None, workers=8,
+                 limit=1000, timeout=30, session=None):
+        self.database = database
+        self.base_url = base_url.rstrip('/')
+        self.workers = workers
+        self.limit = limit
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            session.auth = HTTPBasicAuth(username, password)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.db = sqlite3.connect(database, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        self.lock = threading.RLock()  # bootstrap() faz requisições com o lock (e a transação) abertos
+        self.counters = {'changes': 0, 'studies_fetched': 0, 'requests': 0, 'deleted': 0}
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_tester(cls, tester, database, **kwargs):
+        """Reaproveitar a sessão autenticada de um OrthancAPITester"""
+        return cls(database, tester.base_url, timeout=tester.timeout, session=tester.session,
+                   **kwargs)
+
+    def close(self):
+        self._stop.set()
+        with self.lock:
+            self.db.close()
+
+    # ----- sincronização -----
+
+    def get(self, path, **params):
+        response = self.session.get(f"{self.base_url}{path}", params=params or None,
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        with self.lock:
+            self.counters['requests'] += 1
+        return response.json()
+
+    @property
+    def cursor(self):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'cursor'").fetchone()
+        return int(row[0]) if row else None
+
+    def _pages(self, collection):
+        since = 0
+        while True:
+            page = self.get(f"/{collection}", expand='', since=since, limit=self.limit)
+            if not page:
+                return
+            yield page
+            since += len(page)
+            if len(page) < self.limit:
+                return
+
+    def bootstrap(self):
+        """Copiar o acervo inteiro; o cursor é lido antes, para não perder mudanças"""
+        head = ChangesFeed(self.base_url, timeout=self.timeout, session=self.session).head()
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM patients')
+            self.db.execute('DELETE FROM studies')
+            self.db.execute('DELETE FROM series')
+            for studies in self._pages('studies'):
+                self.db.executemany('INSERT OR REPLACE INTO patients VALUES (?, ?, ?, ?, ?)',
+                                    [patient_row(study) for study in studies])
+                self.db.executemany('INSERT OR REPLACE INTO studies (id, patient, patient_id, '
+                                    'patient_name, study_uid, accession_number, study_date, '
+                                    'study_time, description, last_update) '
+                                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                    [study_row(study) for study in studies])
+                self.counters['studies_fetched'] += len(studies)
+            for series in self._pages('series'):
+                self.db.executemany('INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    [series_row(s) for s in series])
+            self.db.execute(AGGREGATES)
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('cursor', ?)", (str(head),))
+        return head
+
+    def _fetch_study(self, study_id):
+        """(estudo, séries) ou None se o estudo já foi removido"""
+        try:
+            return self.get(f"/studies/{study_id}"), self.get(f"/studies/{study_id}/series")
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+
+    def _apply(self, changes, executor):
+        studies, deleted = {}, []
+        for change in changes:
+            if change['ChangeType'] == 'Deleted':
+                deleted.append((change['ResourceType'], change['ID']))
+                studies.pop(change['ID'], None)
+            elif change['ResourceType'] == 'Study':
+                studies[change['ID']] = None
+
+        fetched = dict(zip(studies, executor.map(self._fetch_study, studies)))
+        with self.lock, self.db:
+            for study_id, result in fetched.items():
+                self.db.execute('DELETE FROM series WHERE study = ?', (study_id,))
+                if result is None:
+                    self.db.execute('DELETE FROM studies WHERE id = ?', (study_id,))
+                    continue
+                study, series = result
+                self.db.execute('INSERT OR REPLACE INTO patients VALUES (?, ?, ?, ?, ?)',
+                                patient_row(study))
+                self.db.execute('INSERT OR REPLACE INTO studies (id, patient, patient_id, '
+                                'patient_name, study_uid, accession_number, study_date, '
+                                'study_time, description, last_update) '
+                                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', study_row(study))
+                self.db.executemany('INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    [series_row(s) for s in series])
+            touched = list(fetched)
+            for resource_type, resource_id in deleted:
+                touched.extend(self._delete(resource_type, resource_id))
+            for start in range(0, len(touched), 500):
+                block = touched[start:start + 500]
+                self.db.execute(AGGREGATES + ' WHERE id IN (%s)' % ','.join('?' * len(block)), block)
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('cursor', ?)",
+                            (str(changes[-1]['Seq']),))
+            self.counters['changes'] += len(changes)
+            self.counters['studies_fetched'] += sum(1 for r in fetched.values() if r)
+            self.counters['deleted'] += len(deleted)
+
+    def _delete(self, resource_type, resource_id):
+        """Remover um recurso; retorna os estudos cujos agregados mudaram"""
+        if resource_type == 'Patient':
+            self.db.execute('DELETE FROM series WHERE study IN '
+                            '(SELECT id FROM studies WHERE patient = ?)', (resource_id,))
+            self.db.execute('DELETE FROM studies WHERE patient = ?', (resource_id,))
+            self.db.execute('DELETE FROM patients WHERE id = ?', (resource_id,))
+        elif resource_type == 'Study':
+            self.db.execute('DELETE FROM series WHERE study = ?', (resource_id,))
+            self.db.execute('DELETE FROM studies WHERE id = ?', (resource_id,))
+        elif resource_type == 'Series':
+            row = self.db.execute('SELECT study FROM series WHERE id = ?', (resource_id,)).fetchone()
+            self.db.execute('DELETE FROM series WHERE id = ?', (resource_id,))
+            return [row[0]] if row else []
+        return []
+
+    def sync(self):
+        """Copiar o acervo (primeira vez) ou aplicar o /changes desde o cursor"""
+        start = time.time()
+        if self.cursor is None:
+            self.bootstrap()
+            return time.time() - start
+        feed = ChangesFeed(self.base_url, timeout=self.timeout, session=self.session,
+                           limit=self.limit)
+        feed.cursor = self.cursor
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for changes in feed.pages():
+                self._apply(changes, executor)
+        return time.time() - start
+
+    def start_follow(self, interval=2.0):
+        """Sincronizar a cada `interval` segundos em segundo plano"""
+        self.sync()
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.sync()
+                except requests.exceptions.RequestException as e:
+                    print(f"   ⚠️ Falha ao sincronizar o índice: {e}")
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    # ----- consultas -----
+
+    def _study_query(self, patient_id=None, accession_number=None, date_from=None,
+                     date_to=None, modality=None, limit=None):
+        where, params = [], []
+        if patient_id is not None:
+            where.append('patient_id = ?')
+            params.append(patient_id)
+        if accession_number is not None:
+            where.append('accession_number = ?')
+            params.append(accession_number)
+        if date_from:
+            where.append('study_date >= ?')
+            params.append(date_from)
+        if date_to:
+            where.append('study_date <= ?')
+            params.append(date_to)
+        if modality:
+            where.append('id IN (SELECT study FROM series WHERE modality = ?)')
+            params.append(modality)
+        sql = (f"SELECT {', '.join(column for column, _ in STUDY_COLUMNS)} FROM studies"
+               + (f" WHERE {' AND '.join(where)}" if where else '')
+               + ' ORDER BY study_date DESC, study_time DESC'
+               + (' LIMIT ?' if limit else ''))
+        if limit:
+            params.append(limit)
+        return sql, params
+
+    def find_studies(self, **filters):
+        """Estudos que casam com todos os filtros, mais recentes primeiro (uma consulta)
+
+        Filtros: patient_id, accession_number, date_from/date_to (StudyDate
+        AAAAMMDD), modality e limit.
+        """
+        sql, params = self._study_query(**filters)
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        studies = []
+        for row in rows:
+            study = {key: value for (_, key), value in zip(STUDY_COLUMNS, row)}
+            study['modalities'] = study['modalities'].split('/') if study['modalities'] else []
+            studies.append(study)
+        return studies
+
+    def worklist(self, patient_id, date_from=None, date_to=None, modality=None):
+        """Lista de trabalho de um PatientID DICOM, respondida só pelo idx_studies_patient"""
+        return self.find_studies(patient_id=patient_id, date_from=date_from, date_to=date_to,
+                                 modality=modality)
+
+    def find_by_accession(self, accession_number):
+        studies = self.find_studies(accession_number=accession_number)
+        return studies[0] if studies else None
+
+    def get_series(self, study_id):
+        with self.lock:
+            rows = self.db.execute('SELECT id, series_uid, modality, series_number, description, '
+                                   'instances_count FROM series WHERE study = ? '
+                                   'ORDER BY series_number', (study_id,)).fetchall()
+        return [dict(zip(('series_id', 'series_instance_uid', 'modality', 'series_number',
+                          'series_description', 'instances_count'), row)) for row in rows]
+
+    def patient_ids(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute('SELECT DISTINCT patient_id FROM studies')]
+
+    def query_plan(self, **filters):
+        """EXPLAIN QUERY PLAN de find_studies (para conferir o uso dos índices)"""
+        sql, params = self._study_query(**filters)
+        with self.lock:
+            return [row[-1] for row in self.db.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+    def stats(self):
+        with self.lock:
+            counts = {table: self.db.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+                      for table in ('patients', 'studies', 'series')}
+            return {**counts, **self.counters}
+
+def main():
+    parser = argparse.ArgumentParser(description='Índice local (SQLite) de estudos do Orthanc')
+    parser.add_argument('--url', default='https://pacs.radiweb.com.br',
+                       help='URL base do Orthanc')
+    parser.add_argument('--username', default='admin',
+                       help='Nome de usuário')
+    parser.add_argument('--password', default='admin',
+                       help='Senha')
+    parser.add_argument('--database', default='orthanc_index.db',
+                       help='Arquivo SQLite do índice')
+    parser.add_argument('--workers', type=int, default=8,
+                       help='Requisições simultâneas ao reler estudos alterados')
+    parser.add_argument('--limit', type=int, default=1000,
+                       help='Itens por página de /changes, /studies e /series')
+    parser.add_argument('--rebuild', action='store_true',
+                       help='Descartar o índice e copiar o acervo de novo')
+    parser.add_argument('--no-sync', action='store_true',
+                       help='Consultar o índice sem sincronizar')
+    parser.add_argument('--follow', action='store_true',
+                       help='Continuar sincronizando a cada --poll-interval segundos')
+    parser.add_argument('--poll-interval', type=float, default=2.0,
+                       help='Intervalo entre sincronizações com --follow (segundos)')
+    parser.add_argument('--patient-id',
+                       help='Lista de trabalho deste PatientID')
+    parser.add_argument('--accession',
+                       help='Estudo com este AccessionNumber')
+    parser.add_argument('--date-from',
+                       help='StudyDate inicial (AAAAMMDD)')
+    parser.add_argument('--date-to',
+                       help='StudyDate final (AAAAMMDD)')
+    parser.add_argument('--modality',
+                       help='Somente estudos com esta modalidade')
+    parser.add_argument('--explain', action='store_true',
+                       help='Mostrar o plano da consulta (uso dos índices)')
+
+    args = parser.parse_args()
+
+    index = StudyIndex(args.database, args.url, args.username, args.password, args.workers,
+                       args.limit)
+    if args.rebuild:
+        with index.lock, index.db:
+            index.db.execute("DELETE FROM meta WHERE key = 'cursor'")
+
+    try:
+        if not args.no_sync:
+            mode = 'cópia inicial' if index.cursor is None else f"/changes desde {index.cursor}"
+            elapsed = index.sync()
+            stats = index.stats()
+            print(f"✅ Índice sincronizado ({mode}) em {elapsed:.2f}s: {stats['patients']} pacientes, "
+                  f"{stats['studies']} estudos, {stats['series']} séries, "
+                  f"{stats['requests']} requisições, cursor {index.cursor}")
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Erro ao sincronizar o índice: {e}")
+        sys.exit(1)
+
+    filters = {'patient_id': args.patient_id, 'accession_number': args.accession,
+               'date_from': args.date_from, 'date_to': args.date_to, 'modality': args.modality}
+    if any(filters.values()):
+        start = time.perf_counter()
+        studies = index.find_studies(**filters)
+        elapsed = time.perf_counter() - start
+        print(json.dumps(studies, indent=2, ensure_ascii=False))
+        print(f"🔎 {len(studies)} estudos em {elapsed * 1000:.3f} ms")
+        if args.explain:
+            for step in index.query_plan(**filters):
+                print(f"   {step}")
+
+    if args.follow:
+        print(f"🔄 Acompanhando {args.url}/changes a cada {args.poll_interval:g}s (Ctrl+C para sair)")
+        try:
+            index.start_follow(args.poll_interval)
+            while True:
+                time.sleep(args.poll_interval)
+        except KeyboardInterrupt:
+            pass
+    index.close()
+
+if __name__ == "__main__":
+    main()
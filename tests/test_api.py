@@ -5,12 +5,23 @@ Autor: Manus AI
 Data: 2024-01-01
 """
 
+import os
 import sys
 import json
+import uuid
+import base64
 import time
+import random
+import asyncio
+import zipfile
+import tempfile
+import itertools
 import argparse
-from datetime import datetime
+import threading
+import contextvars
+import contextlib
 import concurrent.futures
+from datetime import datetime
 
 try:
     import requests
@@ -19,13 +30,172 @@ except ImportError:
     print("❌ requests não está instalado. Instale com: pip install requests")
     sys.exit(1)
 
-class OrthancAPITester:
+try:
+    from pydicom import dcmread
+    from pydicom.errors import InvalidDicomError
+    from pydicom.uid import (
+        ExplicitVRLittleEndian, RLELossless, JPEGLSLossless, JPEG2000Lossless, JPEGBaseline8Bit
+    )
+except ImportError:
+    print("❌ pydicom não está instalado. Instale com: pip install pydicom")
+    sys.exit(1)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None  # Necessário apenas para os testes de carga assíncronos
+
+from latency_histogram import LatencyHistogram
+from orthanc_client import OrthancClient, orthanc_id
+from results_store import BenchmarkResults, ResultsStore, histogram_metrics
+from study_index import StudyIndex
+
+# Endpoints disponíveis no gerador de carga: nome -> (método, caminho, corpo JSON)
+LOAD_ENDPOINTS = {
+    'system': ('GET', '/system', None),
+    'studies': ('GET', '/studies', None),
+    'find': ('POST', '/tools/find', {'Level': 'Study', 'Query': {}, 'Limit': 100}),
+    'qido': ('GET', '/dicom-web/studies?limit=100', None),
+    'instance': ('GET', '/instances/{id}/file', None)
+}
+
+# Representações de frame negociáveis via Accept no WADO-RS: nome -> (tipo, transfer syntax)
+FRAME_TRANSFER_SYNTAXES = {
+    'stored': ('application/octet-stream', '*'),
+    'native': ('application/octet-stream', ExplicitVRLittleEndian),
+    'rle': ('image/x-dicom-rle', RLELossless),
+    'jpeg-ls': ('image/jls', JPEGLSLossless),
+    'j2k': ('image/jp2', JPEG2000Lossless),
+    'jpeg': ('image/jpeg', JPEGBaseline8Bit)
+}
+
+# Mistura padrão (pesos relativos) aproximando o uso por viewers
+DEFAULT_LOAD_MIX = {'studies': 30, 'find': 20, 'qido': 20, 'instance': 20, 'system': 10}
+
+def parse_load_mix(text):
+    """Converter 'studies=30,find=20' em {'studies': 30, 'find': 20}"""
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in LOAD_ENDPOINTS:
+            raise argparse.ArgumentTypeError(
+                f"Endpoint desconhecido: {name} (opções: {', '.join(LOAD_ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+class SizedStream:
+    """Arquivo aberto com tamanho conhecido
+    
+    O requests envia Content-Length a partir de len() e lê o corpo em
+    blocos com read(), sem carregar o arquivo inteiro na memória. Serve
+    também para membros de ZIP, cujo tamanho não é obtido por fstat.
+    """
+    
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.size = size
+    
+    def read(self, amount=-1):
+        return self.fileobj.read(amount)
+    
+    def __len__(self):
+        return self.size
+
+def iter_upload_sources(paths, archives):
+    """Gerar (nome, tamanho, abrir) para arquivos, diretórios e ZIPs
+    
+    Os ZIPs ficam abertos em `archives` (contextlib.ExitStack) e seus
+    membros são lidos diretamente do arquivo compactado, sem extração.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                yield from iter_upload_sources(
+                    [os.path.join(root, name) for name in sorted(files)], archives)
+        elif path.lower().endswith('.zip') and zipfile.is_zipfile(path):
+            archive = archives.enter_context(zipfile.ZipFile(path))
+            for member in archive.infolist():
+                if not member.is_dir():
+                    yield (f"{path}:{member.filename}", member.file_size,
+                           lambda archive=archive, member=member: archive.open(member))
+        else:
+            yield path, os.path.getsize(path), lambda path=path: open(path, 'rb')
+
+def iter_batches(items, size):
+    """Agrupar um iterável em listas de até `size` itens"""
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+class MultipartStream:
+    """Corpo multipart/related (STOW-RS) gerado sob demanda
+    
+    `parts` é uma lista de (tamanho, abrir). O tamanho total é calculado
+    antes do envio (Content-Length) e cada arquivo só é aberto quando o
+    requests chega à sua parte, em blocos de até `chunk_size` bytes.
+    """
+    
+    def __init__(self, parts, media_type='application/dicom', chunk_size=1024 * 1024):
+        boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/related; type="{media_type}"; boundary={boundary}'
+        self.chunk_size = chunk_size
+        self.segments = []
+        for size, opener in parts:
+            self.segments.append(f"--{boundary}\r\nContent-Type: {media_type}\r\n\r\n".encode())
+            self.segments.append((size, opener))
+            self.segments.append(b'\r\n')
+        self.segments.append(f"--{boundary}--\r\n".encode())
+        self.size = sum(len(s) if isinstance(s, bytes) else s[0] for s in self.segments)
+        self._chunks = self._generate()
+        self._current = b''
+        self._offset = 0
+    
+    def _generate(self):
+        for segment in self.segments:
+            if isinstance(segment, bytes):
+                yield segment
+                continue
+            with segment[1]() as f:
+                while True:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+    
+    def read(self, amount=-1):
+        if amount is None or amount < 0:
+            data = self._current[self._offset:] + b''.join(self._chunks)
+            self._current, self._offset = b'', 0
+            return data
+        
+        while self._offset >= len(self._current):
+            self._current = next(self._chunks, None)
+            self._offset = 0
+            if self._current is None:
+                self._current = b''
+                return b''
+        
+        data = self._current[self._offset:self._offset + amount]
+        self._offset += len(data)
+        return data
+    
+    def __len__(self):
+        return self.size
+
+class OrthancAPITester(BenchmarkResults):
     def __init__(self, base_url, username, password, timeout=30):
         self.base_url = base_url.rstrip('/')
         self.auth = HTTPBasicAuth(username, password)
         self.timeout = timeout
         self.session = requests.Session()
         self.session.auth = self.auth
+        self.target = {'protocol': 'http', 'url': self.base_url}
+        self.results = []
         
     def test_connection(self):
         """Testar conectividade básica"""
@@ -182,18 +352,192 @@ class OrthancAPITester:
             print(f"❌ Erro ao acessar Stone Web Viewer: {e}")
             return False
     
+    def _first_study_uid(self):
+        """StudyInstanceUID do primeiro estudo listado via QIDO-RS"""
+        response = self.session.get(f"{self.base_url}/dicom-web/studies", params={'limit': 1},
+                                    headers={'Accept': 'application/dicom+json'},
+                                    timeout=self.timeout)
+        if response.status_code != 200 or not response.content or not response.json():
+            return None
+        return response.json()[0]['0020000D']['Value'][0]
+    
+    def test_viewer_benchmark(self, study_uid=None, parallel=6, transfer_syntax='stored',
+                              thumbnails=False, range_bytes=None):
+        """Reproduzir a abertura de um estudo no Stone Web Viewer via WADO-RS
+        
+        Busca as séries (QIDO-RS) e os metadados de cada série; depois os
+        frames em ordem de rolagem (InstanceNumber) com `parallel` conexões,
+        como o navegador; por fim, opcionalmente, miniaturas /rendered.
+        `transfer_syntax` escolhe a representação pedida no Accept e
+        `range_bytes` pede só os primeiros bytes de cada frame (parte única
+        com Range, como numa pré-visualização progressiva).
+        """
+        media_type, syntax_uid = FRAME_TRANSFER_SYNTAXES[transfer_syntax]
+        print(f"👁️ Benchmark do viewer (WADO-RS, {parallel} conexões, frames {transfer_syntax})...")
+        
+        study_uid = study_uid or self._first_study_uid()
+        if not study_uid:
+            print("❌ Nenhum estudo disponível para o benchmark")
+            return False
+        print(f"   Estudo: {study_uid}")
+        
+        if range_bytes:
+            frame_headers = {'Accept': f'{media_type}; transfer-syntax={syntax_uid}',
+                             'Range': f'bytes=0-{range_bytes - 1}'}
+        else:
+            frame_headers = {'Accept': f'multipart/related; type="{media_type}"; '
+                                       f'transfer-syntax={syntax_uid}'}
+        
+        session = self._pooled_session(parallel)
+        study_url = f"{self.base_url}/dicom-web/studies/{study_uid}"
+        counters = {'metadata_bytes': 0, 'frame_bytes': 0, 'thumbnail_bytes': 0,
+                    'frames': 0, 'partial': 0, 'errors': 0}
+        frame_latency = LatencyHistogram()
+        lock = threading.Lock()
+        
+        start_time = time.perf_counter()
+        try:
+            response = session.get(f"{study_url}/series", timeout=self.timeout,
+                                   headers={'Accept': 'application/dicom+json'})
+            response.raise_for_status()
+            series_uids = [item['0020000E']['Value'][0] for item in response.json()]
+            
+            def fetch_metadata(series_uid):
+                response = session.get(f"{study_url}/series/{series_uid}/metadata",
+                                       headers={'Accept': 'application/dicom+json'},
+                                       timeout=self.timeout)
+                response.raise_for_status()
+                with lock:
+                    counters['metadata_bytes'] += len(response.content)
+                return response.json()
+            
+            with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+                futures = [executor.submit(contextvars.copy_context().run, fetch_metadata, uid)
+                           for uid in series_uids]
+                metadata = [future.result() for future in futures]
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            print(f"❌ Erro ao obter séries/metadados: {e}")
+            session.close()
+            return False
+        metadata_time = time.perf_counter() - start_time
+        
+        def tag_value(item, tag, default=None):
+            values = item.get(tag, {}).get('Value')
+            return values[0] if values else default
+        
+        # Frames em ordem de rolagem: séries na ordem do QIDO, instâncias por InstanceNumber
+        frame_jobs = []
+        for series_uid, instances in zip(series_uids, metadata):
+            instances = sorted(instances, key=lambda item: int(tag_value(item, '00200013', 0)))
+            for item in instances:
+                for frame in range(1, int(tag_value(item, '00280008', 1)) + 1):
+                    frame_jobs.append((series_uid, tag_value(item, '00080018'), frame))
+        
+        pending_frames = {uid: 0 for uid in series_uids}
+        for series_uid, _, _ in frame_jobs:
+            pending_frames[series_uid] += 1
+        series_done = {}
+        first_frame = [None]
+        
+        def fetch_frame(series_uid, instance_uid, frame):
+            url = f"{study_url}/series/{series_uid}/instances/{instance_uid}/frames/{frame}"
+            request_start = time.perf_counter()
+            try:
+                response = session.get(url, headers=frame_headers, timeout=self.timeout)
+                status, size = response.status_code, len(response.content)
+            except requests.exceptions.RequestException:
+                status, size = 'erro de conexão', 0
+            now = time.perf_counter()
+            
+            with lock:
+                frame_latency.record(now - request_start)
+                if status not in (200, 206):
+                    counters['errors'] += 1
+                    if counters['errors'] == 1:
+                        print(f"   ❌ Frame {frame} de {instance_uid}: {status}")
+                    return
+                counters['frames'] += 1
+                counters['frame_bytes'] += size
+                counters['partial'] += status == 206
+                if first_frame[0] is None:
+                    first_frame[0] = now - start_time
+                pending_frames[series_uid] -= 1
+                if not pending_frames[series_uid]:
+                    series_done[series_uid] = now - start_time
+        
+        self._run_bounded(frame_jobs, parallel, fetch_frame)
+        frames_time = time.perf_counter() - start_time
+        
+        thumbnails_time = None
+        if thumbnails:
+            def fetch_thumbnail(series_uid, instances):
+                instances = sorted(instances, key=lambda item: int(tag_value(item, '00200013', 0)))
+                middle = tag_value(instances[len(instances) // 2], '00080018')
+                try:
+                    response = session.get(
+                        f"{study_url}/series/{series_uid}/instances/{middle}/rendered",
+                        params={'viewport': '128,128'}, headers={'Accept': 'image/jpeg, image/png'},
+                        timeout=self.timeout)
+                    ok = response.status_code == 200
+                except requests.exceptions.RequestException:
+                    ok = False
+                with lock:
+                    if ok:
+                        counters['thumbnail_bytes'] += len(response.content)
+                    else:
+                        counters['errors'] += 1
+            
+            self._run_bounded(((uid, items) for uid, items in zip(series_uids, metadata) if items),
+                              parallel, fetch_thumbnail)
+            thumbnails_time = time.perf_counter() - start_time
+        session.close()
+        
+        total_frames = len(frame_jobs)
+        megabytes = counters['frame_bytes'] / 1024 / 1024
+        status = "✅" if not counters['errors'] and counters['frames'] else "❌"
+        print(f"{status} Viewer: {len(series_uids)} séries, {counters['frames']}/{total_frames} frames")
+        print(f"   Metadados: {metadata_time * 1000:.0f} ms ({counters['metadata_bytes'] / 1024:.0f} KB)")
+        if first_frame[0] is not None:
+            print(f"   Primeiro frame (TTFF): {first_frame[0] * 1000:.0f} ms")
+        for series_uid in series_uids:
+            if series_uid in series_done:
+                print(f"   Série completa: {series_done[series_uid] * 1000:.0f} ms ({series_uid})")
+        print(f"   Todos os frames: {frames_time:.2f}s, {megabytes:.1f} MB "
+              f"({megabytes / frames_time:.1f} MB/s)")
+        print(f"   Latência por frame: {frame_latency.summary()}")
+        if range_bytes:
+            print(f"   Respostas parciais (206): {counters['partial']}/{counters['frames']}")
+        if thumbnails_time is not None:
+            print(f"   Miniaturas: {thumbnails_time:.2f}s ({counters['thumbnail_bytes'] / 1024:.0f} KB)")
+        if counters['errors']:
+            print(f"   Erros: {counters['errors']}")
+        
+        metrics = {'series': len(series_uids), 'frames': counters['frames'],
+                   'errors': counters['errors'], 'metadata_ms': metadata_time * 1000,
+                   'frames_s': frames_time, 'frames_per_s': counters['frames'] / frames_time,
+                   'mb_per_s': megabytes / frames_time, **histogram_metrics('frame', frame_latency)}
+        if first_frame[0] is not None:
+            metrics['ttff_ms'] = first_frame[0] * 1000
+        if thumbnails_time is not None:
+            metrics['thumbnails_s'] = thumbnails_time
+        params = {'study_uid': study_uid, 'parallel': parallel, 'transfer_syntax': transfer_syntax,
+                  'thumbnails': thumbnails, 'range_bytes': range_bytes}
+        return self.record_result('http.viewer', params, metrics, {'frame': frame_latency},
+                                  primary='frame',
+                                  passed=counters['errors'] == 0 and counters['frames'] > 0)
+    
     def test_upload_dicom(self, dicom_file):
         """Testar upload de arquivo DICOM"""
         print(f"📤 Testando upload DICOM: {dicom_file}")
         
         try:
             with open(dicom_file, 'rb') as f:
-                files = {'file': f}
                 headers = {'Content-Type': 'application/dicom'}
                 
+                # O arquivo é enviado em blocos, sem carregá-lo inteiro na memória
                 response = self.session.post(
                     f"{self.base_url}/instances",
-                    data=f.read(),
+                    data=f,
                     headers=headers,
                     timeout=self.timeout
                 )
@@ -216,52 +560,681 @@ class OrthancAPITester:
             print(f"❌ Erro no upload: {e}")
             return False
     
-    def test_performance(self, iterations=10):
-        """Testar performance da API"""
-        print(f"⚡ Testando performance ({iterations} requisições)...")
+    def _upload_source(self, session, size, opener, retries, done=()):
+        """Enviar um arquivo para POST /instances com novas tentativas em 5xx
         
-        def make_request():
-            start_time = time.time()
+        Retorna (status, SOPInstanceUID, tentativas extras); status é
+        'Success', 'AlreadyStored', 'Skipped' (já no checkpoint), 'Ignored'
+        (não é DICOM) ou a mensagem de erro.
+        """
+        try:
+            with opener() as f:
+                header = dcmread(f, stop_before_pixels=True, specific_tags=['SOPInstanceUID'])
+            sop_uid = str(header.SOPInstanceUID)
+        except (InvalidDicomError, AttributeError):
+            return 'Ignored', None, 0
+        if sop_uid in done:
+            return 'Skipped', sop_uid, 0
+        
+        for attempt in range(retries + 1):
             try:
-                response = self.session.get(f"{self.base_url}/system", timeout=self.timeout)
-                end_time = time.time()
-                
+                with opener() as f:
+                    response = session.post(f"{self.base_url}/instances",
+                                            data=SizedStream(f, size),
+                                            headers={'Content-Type': 'application/dicom'},
+                                            timeout=self.timeout)
                 if response.status_code == 200:
-                    return end_time - start_time
+                    return response.json().get('Status', 'Success'), sop_uid, attempt
+                if response.status_code < 500:
+                    return f"HTTP {response.status_code}", sop_uid, attempt
+                error = f"HTTP {response.status_code}"
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+            
+            if attempt < retries:
+                # Backoff exponencial com jitter: 0,5s, 1s, 2s...
+                time.sleep(0.5 * 2 ** attempt * random.uniform(0.5, 1.5))
+        
+        return error, sop_uid, retries
+    
+    def _pooled_session(self, workers):
+        """Sessão autenticada com pool de `workers` conexões keep-alive"""
+        session = requests.Session()
+        session.auth = self.auth
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    
+    @staticmethod
+    def _run_bounded(jobs, workers, func):
+        """Executar func(*job) em `workers` threads, consumindo o gerador `jobs` aos poucos"""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for job in jobs:
+                pending.add(executor.submit(contextvars.copy_context().run, func, *job))
+                if len(pending) >= workers * 4:
+                    # Limitar a fila para não listar o arquivo inteiro de uma vez
+                    finished, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+            for future in pending:
+                future.result()
+    
+    def _bulk_upload(self, paths, workers=8, retries=3, done=(), checkpoint_file=None):
+        """Uma requisição POST /instances por arquivo; retorna (contadores, duração)"""
+        session = self._pooled_session(workers)
+        counters = {'Success': 0, 'AlreadyStored': 0, 'Ignored': 0, 'Skipped': 0,
+                    'Failed': 0, 'retries': 0, 'bytes': 0, 'requests': 0}
+        lock = threading.Lock()
+        
+        def upload(name, size, opener):
+            status, sop_uid, extra = self._upload_source(session, size, opener, retries, done)
+            with lock:
+                counters['retries'] += extra
+                if status in ('Success', 'AlreadyStored', 'Skipped', 'Ignored'):
+                    counters[status] += 1
+                    if status in ('Success', 'AlreadyStored'):
+                        counters['bytes'] += size
+                        counters['requests'] += 1 + extra
+                        if checkpoint_file:
+                            checkpoint_file.write(sop_uid + '\n')
+                            checkpoint_file.flush()
                 else:
-                    return None
-            except:
-                return None
+                    counters['Failed'] += 1
+                    counters['requests'] += 1 + extra
+                    if counters['Failed'] <= 10:
+                        print(f"   ❌ {name}: {status}")
+        
+        start_time = time.time()
+        try:
+            with contextlib.ExitStack() as archives:
+                self._run_bounded(iter_upload_sources(paths, archives), workers, upload)
+        finally:
+            session.close()
+        return counters, time.time() - start_time
+    
+    def test_bulk_upload(self, paths, workers=8, checkpoint=None, retries=3):
+        """Upload em massa paralelo de diretórios, arquivos ou ZIPs para POST /instances
+        
+        Cada arquivo é enviado em streaming por um pool de `workers`
+        conexões keep-alive. Os SOPInstanceUID concluídos são anexados ao
+        arquivo `checkpoint`, e uma nova execução pula esses arquivos.
+        """
+        print(f"📦 Upload em massa ({workers} conexões, {len(paths)} origem(ns))...")
+        
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            print(f"❌ Origem não encontrada: {', '.join(missing)}")
+            return False
+        
+        done = set()
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                done = set(line.strip() for line in f if line.strip())
+            print(f"   Checkpoint: {len(done)} instâncias já enviadas serão puladas")
+        
+        checkpoint_file = open(checkpoint, 'a') if checkpoint else None
+        try:
+            counters, wall_time = self._bulk_upload(paths, workers, retries, done, checkpoint_file)
+        finally:
+            if checkpoint_file:
+                checkpoint_file.close()
+        
+        uploaded = counters['Success'] + counters['AlreadyStored']
+        megabytes = counters['bytes'] / 1024 / 1024
+        status = "✅" if not counters['Failed'] else "❌"
+        print(f"{status} Upload em massa: {uploaded} instâncias, {megabytes:.1f} MB "
+              f"em {wall_time:.1f}s ({megabytes / wall_time:.1f} MB/s, "
+              f"{uploaded / wall_time:.1f} instâncias/s)")
+        print(f"   Novas: {counters['Success']}, já existentes: {counters['AlreadyStored']}, "
+              f"puladas (checkpoint): {counters['Skipped']}, ignoradas (não DICOM): {counters['Ignored']}")
+        print(f"   Falhas: {counters['Failed']}, novas tentativas: {counters['retries']}")
+        
+        metrics = {'uploaded': uploaded, 'skipped': counters['Skipped'],
+                   'failed': counters['Failed'], 'retries': counters['retries'],
+                   'wall_s': wall_time, 'instances_per_s': uploaded / wall_time,
+                   'mb_per_s': megabytes / wall_time}
+        params = {'paths': sorted(paths), 'workers': workers, 'retries': retries,
+                  'resumed': len(done)}
+        return self.record_result('http.bulk_upload', params, metrics,
+                                  passed=counters['Failed'] == 0 and uploaded + counters['Skipped'] > 0)
+    
+    def _stow_batch(self, session, batch, retries):
+        """Enviar um lote via STOW-RS; retorna (armazenadas, falhas, tentativas extras, erro)"""
+        error = None
+        for attempt in range(retries + 1):
+            body = MultipartStream([(size, opener) for _, size, opener in batch])
+            try:
+                response = session.post(f"{self.base_url}/dicom-web/studies", data=body,
+                                        headers={'Content-Type': body.content_type,
+                                                 'Accept': 'application/dicom+json'},
+                                        timeout=self.timeout)
+                if response.status_code in (200, 202, 409):
+                    result = response.json() if response.content else {}
+                    stored = len(result.get('00081199', {}).get('Value', []))
+                    failed = len(result.get('00081198', {}).get('Value', []))
+                    return stored, failed, attempt, None
+                error = f"HTTP {response.status_code}"
+                if response.status_code < 500:
+                    return 0, len(batch), attempt, error
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+            
+            if attempt < retries:
+                time.sleep(0.5 * 2 ** attempt * random.uniform(0.5, 1.5))
+        
+        return 0, len(batch), retries, error
+    
+    def _stow_upload(self, paths, batch_size=50, workers=4, retries=3):
+        """Lotes de `batch_size` instâncias por requisição STOW-RS; retorna (contadores, duração)"""
+        session = self._pooled_session(workers)
+        counters = {'Success': 0, 'Failed': 0, 'retries': 0, 'bytes': 0, 'requests': 0}
+        lock = threading.Lock()
+        
+        def upload(batch):
+            stored, failed, extra, error = self._stow_batch(session, batch, retries)
+            with lock:
+                counters['Success'] += stored
+                counters['Failed'] += failed
+                counters['retries'] += extra
+                counters['requests'] += 1 + extra
+                if stored:
+                    counters['bytes'] += sum(size for _, size, _ in batch)
+                if error and counters['Failed'] <= 10 * batch_size:
+                    print(f"   ❌ Lote de {len(batch)} a partir de {batch[0][0]}: {error}")
+        
+        start_time = time.time()
+        try:
+            with contextlib.ExitStack() as archives:
+                batches = iter_batches(iter_upload_sources(paths, archives), batch_size)
+                self._run_bounded(((batch,) for batch in batches), workers, upload)
+        finally:
+            session.close()
+        return counters, time.time() - start_time
+    
+    def test_stow_upload(self, paths, batch_size=50, workers=4, retries=3):
+        """Upload via STOW-RS com vários arquivos por requisição multipart/related"""
+        print(f"📦 Upload STOW-RS (lotes de {batch_size}, {workers} conexões)...")
+        
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            print(f"❌ Origem não encontrada: {', '.join(missing)}")
+            return False
+        
+        counters, wall_time = self._stow_upload(paths, batch_size, workers, retries)
+        
+        megabytes = counters['bytes'] / 1024 / 1024
+        status = "✅" if not counters['Failed'] else "❌"
+        print(f"{status} STOW-RS: {counters['Success']} instâncias em {counters['requests']} "
+              f"requisições, {megabytes:.1f} MB em {wall_time:.1f}s "
+              f"({megabytes / wall_time:.1f} MB/s, {counters['Success'] / wall_time:.1f} instâncias/s)")
+        print(f"   Falhas: {counters['Failed']}, novas tentativas: {counters['retries']}")
+        
+        metrics = {'uploaded': counters['Success'], 'requests': counters['requests'],
+                   'failed': counters['Failed'], 'retries': counters['retries'],
+                   'wall_s': wall_time, 'instances_per_s': counters['Success'] / wall_time,
+                   'mb_per_s': megabytes / wall_time}
+        params = {'paths': sorted(paths), 'batch_size': batch_size, 'workers': workers,
+                  'retries': retries}
+        return self.record_result('http.stow_upload', params, metrics,
+                                  passed=counters['Failed'] == 0 and counters['Success'] > 0)
+    
+    def test_upload_benchmark(self, paths=None, synthetic=200, batch_size=50, workers=4):
+        """Comparar upload por instância (POST /instances) com lotes STOW-RS
+        
+        Sem `paths`, cada método recebe um corpus sintético próprio (semente
+        diferente), para que nenhum deles encontre instâncias já armazenadas.
+        """
+        print(f"🏁 Benchmark de upload: REST por instância x STOW-RS (lotes de {batch_size})...")
+        
+        methods = [
+            ('REST /instances', lambda source: self._bulk_upload(source, workers)),
+            (f'STOW-RS x{batch_size}', lambda source: self._stow_upload(source, batch_size, workers))
+        ]
+        
+        results = []
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for seed, (name, run) in enumerate(methods, 1):
+                source = paths
+                if not source:
+                    from create_test_dicom import create_test_corpus
+                    
+                    source = [os.path.join(temp_dir, f"seed{seed}")]
+                    slices = min(synthetic, 50)
+                    create_test_corpus(source[0], -(-synthetic // slices), 1, 1, slices, seed=seed)
+                    print()
+                elif seed > 1:
+                    print("   ⚠️ Mesmos arquivos nos dois métodos: o segundo recebe 'AlreadyStored'")
+                
+                counters, wall_time = run(source)
+                uploaded = counters['Success'] + counters.get('AlreadyStored', 0)
+                results.append((name, uploaded, counters['requests'], counters['bytes'],
+                                counters['Failed'], wall_time))
+        
+        print(f"   {'Método':<18}{'Inst.':>8}{'Req':>7}{'MB/s':>9}{'Inst/s':>9}{'Falhas':>8}")
+        for name, uploaded, requests_count, size, failed, wall_time in results:
+            print(f"   {name:<18}{uploaded:>8}{requests_count:>7}"
+                  f"{size / 1024 / 1024 / wall_time:>9.1f}{uploaded / wall_time:>9.1f}{failed:>8}")
+        
+        rest_time, stow_time = results[0][5], results[1][5]
+        print(f"📊 STOW-RS {rest_time / stow_time:.2f}x em relação ao REST por instância")
+        
+        metrics = {'stow_speedup': rest_time / stow_time}
+        for key, (_, uploaded, requests_count, size, failed, wall_time) in zip(('rest', 'stow'), results):
+            metrics.update({f'{key}_uploaded': uploaded, f'{key}_requests': requests_count,
+                            f'{key}_failed': failed, f'{key}_wall_s': wall_time,
+                            f'{key}_instances_per_s': uploaded / wall_time,
+                            f'{key}_mb_per_s': size / 1024 / 1024 / wall_time})
+        params = {'paths': sorted(paths) if paths else None, 'synthetic': None if paths else synthetic,
+                  'batch_size': batch_size, 'workers': workers}
+        return self.record_result('http.upload_bench', params, metrics,
+                                  passed=all(failed == 0 for *_, failed, _ in results))
+    
+    async def _run_load(self, mix, concurrency, duration=None, rate=None, max_requests=None,
+                        instance_ids=None, seed=None):
+        """Motor de carga assíncrono (aiohttp) com pool de conexões keep-alive
+        
+        Sem `rate`, `concurrency` clientes fazem requisições em sequência
+        (malha fechada). Com `rate` (req/s), as chegadas seguem um processo
+        de Poisson independente das respostas (malha aberta) e a latência é
+        medida a partir do instante agendado, incluindo a espera por uma
+        das `concurrency` conexões do pool.
+        """
+        rng = random.Random(seed)
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        stats = {name: {'latency': LatencyHistogram(), 'ok': 0, 'errors': 0, 'bytes': 0}
+                 for name in names}
+        loop = asyncio.get_running_loop()
+        
+        connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        credentials = f"{self.auth.username}:{self.auth.password}".encode()
+        headers = {'Authorization': 'Basic ' + base64.b64encode(credentials).decode()}
+        
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers=headers) as session:
+            
+            async def request(name, scheduled):
+                method, path, body = LOAD_ENDPOINTS[name]
+                if '{id}' in path:
+                    path = path.format(id=rng.choice(instance_ids))
+                
+                size = 0
+                try:
+                    async with session.request(method, f"{self.base_url}{path}", json=body) as response:
+                        async for chunk in response.content.iter_chunked(65536):
+                            size += len(chunk)
+                        ok = response.status < 400
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    ok = False
+                
+                entry = stats[name]
+                entry['latency'].record(loop.time() - scheduled)
+                entry['bytes'] += size
+                entry['ok' if ok else 'errors'] += 1
+            
+            start_time = loop.time()
+            deadline = start_time + duration if duration else None
+            
+            if rate:
+                # Malha aberta: chegadas de Poisson até o fim da duração
+                tasks = set()
+                scheduled = start_time
+                issued = 0
+                while max_requests is None or issued < max_requests:
+                    scheduled += rng.expovariate(rate)
+                    if deadline and scheduled >= deadline:
+                        break
+                    await asyncio.sleep(max(scheduled - loop.time(), 0))
+                    task = asyncio.create_task(
+                        request(rng.choices(names, weights)[0], scheduled))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    issued += 1
+                if tasks:
+                    await asyncio.gather(*tasks)
+            else:
+                # Malha fechada: cada cliente envia a próxima ao receber a resposta
+                issued = [0]
+                
+                async def client():
+                    while (max_requests is None or issued[0] < max_requests) and \
+                            (deadline is None or loop.time() < deadline):
+                        issued[0] += 1
+                        await request(rng.choices(names, weights)[0], loop.time())
+                
+                await asyncio.gather(*[client() for _ in range(concurrency)])
+            
+            wall_time = loop.time() - start_time
+        
+        return stats, wall_time
+    
+    def _sample_instance_ids(self, limit=100):
+        """Obter IDs de instâncias para os downloads da carga"""
+        try:
+            response = self.session.get(f"{self.base_url}/instances", params={'limit': limit},
+                                        timeout=self.timeout)
+            if response.status_code == 200:
+                return response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        return []
+    
+    def test_load(self, mix=None, concurrency=50, duration=30, rate=None, max_requests=None):
+        """Teste de carga assíncrono com mistura ponderada de endpoints"""
+        if aiohttp is None:
+            print("❌ aiohttp não está instalado. Instale com: pip install aiohttp")
+            return False
+        
+        mix = dict(mix or DEFAULT_LOAD_MIX)
+        instance_ids = []
+        if 'instance' in mix:
+            instance_ids = self._sample_instance_ids()
+            if not instance_ids:
+                print("   ⚠️ Nenhuma instância no servidor - downloads removidos da mistura")
+                del mix['instance']
+        if not mix:
+            print("❌ Mistura de endpoints vazia")
+            return False
+        
+        mode = f"malha aberta, {rate} req/s" if rate else "malha fechada"
+        print(f"🚀 Teste de carga ({mode}, {concurrency} conexões, {duration}s)...")
+        print(f"   Mistura: {', '.join(f'{name}={weight:g}' for name, weight in mix.items())}")
+        
+        stats, wall_time = asyncio.run(
+            self._run_load(mix, concurrency, duration, rate, max_requests, instance_ids))
+        
+        total_ok = sum(entry['ok'] for entry in stats.values())
+        total_errors = sum(entry['errors'] for entry in stats.values())
+        total = total_ok + total_errors
+        
+        if not total:
+            print("❌ Nenhuma requisição concluída")
+            return False
+        
+        print(f"   {'Endpoint':<10}{'Req':>8}{'Req/s':>9}{'p50 ms':>9}{'p90 ms':>9}"
+              f"{'p99 ms':>9}{'Erros':>8}{'MB':>9}")
+        for name, entry in stats.items():
+            count = entry['ok'] + entry['errors']
+            if not count:
+                continue
+            latency = entry['latency']
+            print(f"   {name:<10}{count:>8}{count / wall_time:>9.1f}"
+                  f"{latency.percentile(50) * 1000:>9.1f}{latency.percentile(90) * 1000:>9.1f}"
+                  f"{latency.percentile(99) * 1000:>9.1f}{entry['errors'] / count:>7.1%}"
+                  f"{entry['bytes'] / 1024 / 1024:>9.1f}")
+        
+        error_rate = total_errors / total
+        status = "✅" if error_rate < 0.01 else "❌"
+        print(f"{status} Carga: {total} requisições em {wall_time:.1f}s "
+              f"({total / wall_time:.1f} req/s), erros {error_rate:.2%}")
+        
+        histograms = {'all': LatencyHistogram()}
+        for name, entry in stats.items():
+            if entry['latency'].count:
+                histograms[name] = entry['latency']
+                histograms['all'].merge(entry['latency'])
+        metrics = {'requests': total, 'error_rate': error_rate, 'requests_per_s': total / wall_time}
+        for name, hist in histograms.items():
+            metrics.update(histogram_metrics(name, hist))
+        params = {'mix': mix, 'concurrency': concurrency, 'duration': duration, 'rate': rate,
+                  'max_requests': max_requests}
+        return self.record_result('http.load', params, metrics, histograms, primary='all',
+                                  passed=error_rate < 0.01)
+    
+    def test_metadata_cache(self, passes=3, ttl=60.0, max_studies=200):
+        """Navegar estudo -> séries -> paciente com o cliente em cache e medir a economia"""
+        print(f"🗃️ Testando cache de metadados ({passes} passadas, TTL {ttl:g}s)...")
+        
+        client = OrthancClient.from_tester(self, ttl=ttl, max_entries=max_studies * 8)
+        pass_times = []
+        
+        def browse():
+            count = 0
+            for study_id in client.list_studies()[:max_studies]:
+                study = client.get_study(study_id)
+                client.get_patient(study['ParentPatient'])
+                for series_id in study.get('Series', []):
+                    client.get_series(series_id)
+                count += 1
+            return count
+        
+        try:
+            client.start_invalidation()
+            for number in range(1, passes + 1):
+                start = time.time()
+                studies = browse()
+                pass_times.append(time.time() - start)
+                print(f"   Passada {number}: {studies} estudos em {pass_times[-1]:.3f}s")
+            
+            # Passada final com o TTL vencido: tudo revalidado por ETag
+            client.ttl = 0
+            start = time.time()
+            browse()
+            revalidation_time = time.time() - start
+            print(f"   Revalidação: {revalidation_time:.3f}s")
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Erro no cache de metadados: {e}")
+            return False
+        finally:
+            client.stop()
+        
+        stats = client.stats()
+        print(f"✅ Cache: {client.summary()}")
+        
+        metrics = {'studies': studies, 'cold_pass_s': pass_times[0],
+                   'warm_pass_s': min(pass_times[1:], default=pass_times[0]),
+                   'revalidation_s': revalidation_time, 'hit_rate': stats['hit_rate'],
+                   'requests_avoided': stats['requests_avoided'],
+                   'bytes_fetched': stats['bytes_fetched'], 'bytes_saved': stats['bytes_saved']}
+        return self.record_result('http.metadata_cache',
+                                  {'passes': passes, 'ttl': ttl, 'max_studies': max_studies},
+                                  metrics, passed=stats['misses'] < stats['lookups'])
+    
+    def test_find_benchmark(self, max_studies=10000, workers=8, page_size=1000):
+        """Listar estudos com tags: laço N+1 x GETs paralelos x ?expand x /tools/find paginado"""
+        print(f"🔎 Benchmark de consultas em lote (até {max_studies} estudos, {workers} conexões, "
+              f"páginas de {page_size})...")
+        
+        session = self._pooled_session(workers)
+        round_trips = {'count': 0}
+        lock = threading.Lock()
+        
+        def count_round_trip(response, *args, **kwargs):
+            # Chamado também nas threads de get_many: incremento sob o lock
+            with lock:
+                round_trips['count'] += 1
+        
+        session.hooks['response'].append(count_round_trip)
+        # Sem cache: cada estratégia paga todas as suas requisições
+        client = OrthancClient(session, self.base_url, max_entries=0, ttl=0, timeout=self.timeout)
+        
+        def naive():
+            ids = client.get_json('/studies', limit=max_studies)
+            return [client.get_study(study_id) for study_id in ids]
+        
+        def bounded():
+            ids = client.get_json('/studies', limit=max_studies)
+            return client.get_many('studies', ids, workers)
+        
+        strategies = [
+            ('naive', 'GET /studies + 1 GET por estudo', naive),
+            ('bounded', f'GET /studies + GETs em {workers} conexões', bounded),
+            ('expand', 'GET /studies?expand paginado',
+             lambda: client.list_expanded('studies', page_size=page_size, limit=max_studies)),
+            ('find', 'POST /tools/find (Expand) paginado',
+             lambda: client.find('Study', page_size=page_size, limit=max_studies))
+        ]
+        
+        results = {}
+        try:
+            for name, description, func in strategies:
+                with lock:
+                    round_trips['count'] = 0
+                start = time.time()
+                studies = func()
+                results[name] = (description, round_trips['count'], time.time() - start,
+                                 sorted(study['ID'] for study in studies))
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Erro no benchmark de consultas: {e}")
+            return False
+        finally:
+            session.close()
+        
+        reference = results['naive'][3]
+        if not reference:
+            print("❌ Nenhum estudo no servidor para listar")
+            return False
+        consistent = all(ids == reference for _, _, _, ids in results.values())
+        
+        naive_time = results['naive'][2]
+        print(f"   {'Estratégia':<44} {'Requisições':>11} {'Tempo (s)':>10} {'Estudos/s':>10} {'Ganho':>7}")
+        metrics = {'studies': len(reference)}
+        for name, (description, requests_made, wall_time, _) in results.items():
+            print(f"   {description:<44} {requests_made:>11} {wall_time:>10.2f} "
+                  f"{len(reference) / wall_time:>10.0f} {naive_time / wall_time:>6.1f}x")
+            metrics.update({f'{name}_requests': requests_made, f'{name}_wall_s': wall_time,
+                            f'{name}_studies_per_s': len(reference) / wall_time})
+        
+        status = "✅" if consistent else "❌"
+        print(f"{status} {len(reference)} estudos; resultados "
+              f"{'idênticos' if consistent else 'DIVERGENTES'} entre as estratégias")
+        return self.record_result('http.find_bench', {'max_studies': max_studies, 'workers': workers,
+                                                      'page_size': page_size},
+                                  metrics, passed=consistent)
+    
+    def _rest_worklist(self, patient_id):
+        """Lista de trabalho pelo REST como em getPatientStudies: paciente + um GET por estudo"""
+        response = self.session.get(f"{self.base_url}/patients/{orthanc_id(patient_id)}",
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        studies = []
+        for study_id in response.json().get('Studies', []):
+            response = self.session.get(f"{self.base_url}/studies/{study_id}", timeout=self.timeout)
+            response.raise_for_status()
+            studies.append(response.json())
+        return studies
+    
+    def test_study_index(self, max_patients=100):
+        """Lista de trabalho por paciente: N+1 no REST x uma consulta no índice SQLite local"""
+        print(f"🗂️ Testando índice local de estudos (até {max_patients} pacientes)...")
+        
+        rest_latency, local_latency = LatencyHistogram(), LatencyHistogram()
+        mismatches = requests_made = 0
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index = StudyIndex.from_tester(self, os.path.join(temp_dir, 'index.db'))
+            try:
+                build_time = index.sync()
+                sync_time = index.sync()
+                stats = index.stats()
+                print(f"   Cópia inicial: {stats['studies']} estudos em {build_time:.2f}s "
+                      f"({stats['requests']} requisições), sincronização incremental {sync_time:.3f}s")
+                
+                patients = index.patient_ids()[:max_patients]
+                for patient_id in patients:
+                    start = time.perf_counter()
+                    studies = self._rest_worklist(patient_id)
+                    rest_latency.record(time.perf_counter() - start)
+                    requests_made += 1 + len(studies)
+                    
+                    start = time.perf_counter()
+                    worklist = index.worklist(patient_id)
+                    local_latency.record(time.perf_counter() - start)
+                    
+                    if sorted(s['ID'] for s in studies) != sorted(s['study_id'] for s in worklist):
+                        mismatches += 1
+            except requests.exceptions.RequestException as e:
+                print(f"❌ Erro no índice local: {e}")
+                return False
+            finally:
+                index.close()
+        
+        if not patients:
+            print("❌ Nenhum estudo no servidor para consultar")
+            return False
+        
+        status = "✅" if not mismatches else "❌"
+        print(f"{status} Índice local: {len(patients)} pacientes, {mismatches} listas divergentes do REST")
+        print(f"   REST (N+1, {requests_made / len(patients):.1f} requisições/paciente): {rest_latency.summary()}")
+        print(f"   SQLite local (1 consulta): {local_latency.summary()}")
+        print(f"   Aceleração (p50): {rest_latency.percentile(50) / max(local_latency.percentile(50), 1e-9):.0f}x")
+        
+        metrics = {'patients': len(patients), 'studies': stats['studies'], 'build_s': build_time,
+                   'sync_s': sync_time, 'rest_requests': requests_made, 'mismatches': mismatches,
+                   **histogram_metrics('rest', rest_latency), **histogram_metrics('local', local_latency)}
+        return self.record_result('http.study_index', {'max_patients': max_patients}, metrics,
+                                  histograms={'rest': rest_latency, 'local': local_latency},
+                                  primary='local', passed=not mismatches)
+    
+    def _run_system_requests(self, concurrency, iterations):
+        """GET /system com requests em `concurrency` threads (sem aiohttp)"""
+        entry = {'latency': LatencyHistogram(), 'ok': 0, 'errors': 0, 'bytes': 0}
+        lock = threading.Lock()
+        session = self._pooled_session(concurrency)
+        
+        def request():
+            start_time = time.perf_counter()
+            try:
+                response = session.get(f"{self.base_url}/system", timeout=self.timeout)
+                ok, size = response.status_code < 400, len(response.content)
+            except requests.exceptions.RequestException:
+                ok, size = False, 0
+            with lock:
+                entry['latency'].record(time.perf_counter() - start_time)
+                entry['bytes'] += size
+                entry['ok' if ok else 'errors'] += 1
+        
+        try:
+            self._run_bounded(((),) * iterations, concurrency, request)
+        finally:
+            session.close()
+        return entry
+    
+    def test_performance(self, iterations=10):
+        """Testar performance da API
+        
+        Usa o motor assíncrono (aiohttp) quando instalado; sem ele, as mesmas
+        requisições saem de threads com requests.
+        """
+        print(f"⚡ Testando performance ({iterations} requisições)...")
+        
+        if aiohttp is None:
+            print("   ⚠️ aiohttp não instalado - usando requests com threads")
+        
+        def run(concurrency):
+            if aiohttp is None:
+                return self._run_system_requests(concurrency, iterations)
+            stats, _ = asyncio.run(self._run_load({'system': 1}, concurrency, max_requests=iterations))
+            return stats['system']
         
         # Teste sequencial
         print("   📊 Teste sequencial...")
-        sequential_times = []
-        for i in range(iterations):
-            response_time = make_request()
-            if response_time:
-                sequential_times.append(response_time)
+        sequential = run(1)
         
         # Teste paralelo
         print("   📊 Teste paralelo...")
-        parallel_times = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            futures = [executor.submit(make_request) for _ in range(iterations)]
-            for future in concurrent.futures.as_completed(futures):
-                response_time = future.result()
-                if response_time:
-                    parallel_times.append(response_time)
+        parallel = run(5)
         
         # Análise dos resultados
-        if sequential_times and parallel_times:
-            seq_avg = sum(sequential_times) / len(sequential_times)
-            par_avg = sum(parallel_times) / len(parallel_times)
+        if sequential['ok'] and parallel['ok']:
+            seq_avg = sequential['latency'].mean
+            par_avg = parallel['latency'].mean
             
             print(f"✅ Performance:")
-            print(f"   Sequencial: {seq_avg:.3f}s (média)")
-            print(f"   Paralelo: {par_avg:.3f}s (média)")
-            print(f"   Sucessos: {len(sequential_times)}/{iterations} seq, {len(parallel_times)}/{iterations} par")
+            print(f"   Sequencial: {seq_avg:.3f}s (média), {sequential['latency'].summary()}")
+            print(f"   Paralelo: {par_avg:.3f}s (média), {parallel['latency'].summary()}")
+            print(f"   Sucessos: {sequential['ok']}/{iterations} seq, {parallel['ok']}/{iterations} par")
             
-            return seq_avg < 2.0 and par_avg < 5.0  # Limites aceitáveis
+            metrics = {**histogram_metrics('sequential', sequential['latency']),
+                       **histogram_metrics('parallel', parallel['latency'])}
+            # Limites aceitáveis, usados enquanto não houver linha de base
+            return self.record_result('http.performance', {'iterations': iterations}, metrics,
+                                      {'sequential': sequential['latency'],
+                                       'parallel': parallel['latency']},
+                                      limits={'sequential_mean_ms': 2000, 'parallel_mean_ms': 5000})
         else:
             print("❌ Falha nos testes de performance")
             return False
@@ -375,13 +1348,65 @@ def main():
                        help='Arquivo DICOM para teste de upload')
     parser.add_argument('--test', 
                        choices=['connection', 'auth', 'endpoints', 'dicomweb', 
-                               'stone', 'upload', 'performance', 'cors', 'all'],
+                               'stone', 'viewer-bench', 'upload', 'bulk-upload', 'stow-upload', 'upload-bench', 'cache', 'study-index', 'find-bench', 'performance', 'load', 'cors', 'all'],
                        default='all', help='Tipo de teste a executar')
+    parser.add_argument('--upload-path', action='append', default=[],
+                       help='Arquivo, diretório ou ZIP para o upload em massa (pode repetir)')
+    parser.add_argument('--workers', type=int, default=8,
+                       help='Uploads simultâneos no upload em massa')
+    parser.add_argument('--checkpoint',
+                       help='Arquivo de SOPInstanceUID concluídos para retomar o upload em massa')
+    parser.add_argument('--batch-size', type=int, default=50,
+                       help='Instâncias por requisição STOW-RS')
+    parser.add_argument('--synthetic', type=int, default=200,
+                       help='Instâncias sintéticas por método no benchmark de upload (sem --upload-path)')
+    parser.add_argument('--retries', type=int, default=3,
+                       help='Novas tentativas por arquivo em erros 5xx/conexão')
+    parser.add_argument('--study-uid',
+                       help='Estudo aberto no benchmark do viewer (padrão: primeiro do QIDO-RS)')
+    parser.add_argument('--parallel', type=int, default=6,
+                       help='Conexões simultâneas do viewer (navegadores usam 6 por host)')
+    parser.add_argument('--frame-syntax', choices=list(FRAME_TRANSFER_SYNTAXES), default='stored',
+                       help='Representação dos frames pedida no Accept')
+    parser.add_argument('--thumbnails', action='store_true',
+                       help='Buscar também miniaturas /rendered de cada série')
+    parser.add_argument('--range-bytes', type=int,
+                       help='Pedir apenas os primeiros N bytes de cada frame (HTTP Range)')
+    parser.add_argument('--passes', type=int, default=3,
+                       help='Passadas de navegação no teste de cache de metadados')
+    parser.add_argument('--ttl', type=float, default=60,
+                       help='TTL (segundos) do cache de metadados')
+    parser.add_argument('--max-studies', type=int, default=10000,
+                       help='Estudos listados no benchmark de consultas em lote')
+    parser.add_argument('--page-size', type=int, default=1000,
+                       help='Itens por página de /tools/find e ?expand')
+    parser.add_argument('--max-patients', type=int, default=100,
+                       help='Pacientes consultados no teste do índice local')
+    parser.add_argument('--concurrency', type=int, default=50,
+                       help='Conexões keep-alive simultâneas no teste de carga')
+    parser.add_argument('--duration', type=float, default=30,
+                       help='Duração do teste de carga (segundos)')
+    parser.add_argument('--rate', type=float,
+                       help='Taxa de chegada em req/s (malha aberta); sem ela, malha fechada')
+    parser.add_argument('--json-output',
+                       help='Exportar os resultados estruturados dos benchmarks em JSON')
+    parser.add_argument('--results-store',
+                       help='Anexar os resultados a este arquivo JSONL e comparar com a execução anterior')
+    parser.add_argument('--baseline', action='append',
+                       help='Execução fixada como linha de base do seu benchmark (pode repetir)')
+    parser.add_argument('--mix', type=parse_load_mix,
+                       help='Mistura ponderada, ex.: studies=30,find=20,qido=20,instance=20,system=10')
     
     args = parser.parse_args()
     
     # Criar testador
     tester = OrthancAPITester(args.url, args.username, args.password, args.timeout)
+    if args.results_store:
+        try:
+            tester.results_store = ResultsStore(args.results_store, args.baseline)
+        except KeyError as e:
+            print(f"❌ Linha de base não encontrada ou ambígua: {e}")
+            sys.exit(1)
     
     # Executar testes
     if args.test == 'all':
@@ -396,16 +1421,45 @@ def main():
         success = tester.test_dicomweb()
     elif args.test == 'stone':
         success = tester.test_stone_viewer()
+    elif args.test == 'viewer-bench':
+        success = tester.test_viewer_benchmark(args.study_uid, args.parallel, args.frame_syntax,
+                                               args.thumbnails, args.range_bytes)
     elif args.test == 'upload':
         if not args.dicom_file:
             print("❌ Arquivo DICOM necessário para teste de upload")
             sys.exit(1)
         success = tester.test_upload_dicom(args.dicom_file)
+    elif args.test == 'bulk-upload':
+        if not args.upload_path:
+            print("❌ Informe --upload-path para o upload em massa")
+            sys.exit(1)
+        success = tester.test_bulk_upload(args.upload_path, args.workers, args.checkpoint,
+                                          args.retries)
+    elif args.test == 'stow-upload':
+        if not args.upload_path:
+            print("❌ Informe --upload-path para o upload STOW-RS")
+            sys.exit(1)
+        success = tester.test_stow_upload(args.upload_path, args.batch_size, args.workers,
+                                          args.retries)
+    elif args.test == 'upload-bench':
+        success = tester.test_upload_benchmark(args.upload_path, args.synthetic, args.batch_size,
+                                               args.workers)
+    elif args.test == 'cache':
+        success = tester.test_metadata_cache(args.passes, args.ttl)
+    elif args.test == 'find-bench':
+        success = tester.test_find_benchmark(args.max_studies, args.workers, args.page_size)
+    elif args.test == 'study-index':
+        success = tester.test_study_index(args.max_patients)
     elif args.test == 'performance':
         success = tester.test_performance()
+    elif args.test == 'load':
+        success = tester.test_load(args.mix, args.concurrency, args.duration, args.rate)
     elif args.test == 'cors':
         success = tester.test_cors()
     
+    if args.json_output:
+        tester.export_results(args.json_output)
+    
     # Código de saída
     sys.exit(0 if success else 1)
 
@@ -5,38 +5,184 @@ Autor: Manus AI
 Data: 2024-01-01
 """
 
+import os
 import sys
 import time
 import argparse
+import tempfile
+import threading
+import contextvars
+import contextlib
+import concurrent.futures
 from datetime import datetime
 
 try:
-    from pynetdicom import AE, debug_logger
+    from pynetdicom import AE, debug_logger, evt, build_role
+    from pynetdicom import StoragePresentationContexts, ALL_TRANSFER_SYNTAXES, _config
+    from pynetdicom.pdu import P_DATA_TF
     from pynetdicom.sop_class import (
-        VerificationSOPClass, 
+        Verification, 
         CTImageStorage, 
         MRImageStorage,
+        PatientRootQueryRetrieveInformationModelFind,
         StudyRootQueryRetrieveInformationModelFind,
-        StudyRootQueryRetrieveInformationModelMove
+        StudyRootQueryRetrieveInformationModelMove,
+        StudyRootQueryRetrieveInformationModelGet,
+        EnhancedCTImageStorage,
+        EnhancedMRImageStorage,
+        UltrasoundImageStorage,
+        UltrasoundMultiFrameImageStorage,
+        ComputedRadiographyImageStorage,
+        DigitalXRayImageStorageForPresentation,
+        DigitalMammographyXRayImageStorageForPresentation,
+        BreastTomosynthesisImageStorage,
+        SecondaryCaptureImageStorage,
+        NuclearMedicineImageStorage,
+        PositronEmissionTomographyImageStorage,
+        XRayAngiographicImageStorage,
+        EncapsulatedPDFStorage,
+        BasicTextSRStorage,
+        EnhancedSRStorage,
+        ComprehensiveSRStorage,
+        GrayscaleSoftcopyPresentationStateStorage
     )
-    from pydicom.dataset import Dataset
+    from pydicom import dcmread
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian
 except ImportError:
     print("❌ pynetdicom não está instalado. Instale com: pip install pynetdicom")
     sys.exit(1)
 
-class DicomTester:
+from latency_histogram import LatencyHistogram
+from results_store import BenchmarkResults, ResultsStore, histogram_metrics
+
+# Chaves de retorno solicitadas em cada nível do C-FIND
+FIND_RETURN_KEYS = {
+    'PATIENT': ['PatientID', 'PatientName', 'PatientBirthDate', 'PatientSex'],
+    'STUDY': ['PatientID', 'PatientName', 'StudyInstanceUID', 'StudyDate', 'StudyTime',
+              'AccessionNumber', 'StudyDescription', 'ModalitiesInStudy'],
+    'SERIES': ['PatientID', 'StudyInstanceUID', 'SeriesInstanceUID', 'Modality',
+               'SeriesNumber', 'SeriesDescription'],
+    'IMAGE': ['PatientID', 'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID',
+              'SOPClassUID', 'InstanceNumber']
+}
+
+# Status DIMSE pendentes do C-FIND (há mais respostas a caminho)
+FIND_PENDING = (0xFF00, 0xFF01)
+
+# SOP Classes aceitas via C-GET (o SCU também atua como Storage SCP na
+# mesma associação; limite de 128 contextos por associação)
+RETRIEVE_STORAGE_CLASSES = [
+    CTImageStorage, EnhancedCTImageStorage, MRImageStorage, EnhancedMRImageStorage,
+    UltrasoundImageStorage, UltrasoundMultiFrameImageStorage, ComputedRadiographyImageStorage,
+    DigitalXRayImageStorageForPresentation, DigitalMammographyXRayImageStorageForPresentation,
+    BreastTomosynthesisImageStorage, SecondaryCaptureImageStorage, NuclearMedicineImageStorage,
+    PositronEmissionTomographyImageStorage, XRayAngiographicImageStorage, EncapsulatedPDFStorage,
+    BasicTextSRStorage, EnhancedSRStorage, ComprehensiveSRStorage,
+    GrayscaleSoftcopyPresentationStateStorage
+]
+
+# Fases de cada C-STORE medidas por StoreTimer
+STORE_PHASES = [('read', 'Leitura'), ('encode', 'Codificação'), ('transmit', 'Transmissão'),
+                ('wait', 'Espera SCP'), ('total', 'Total')]
+
+# Status C-STORE considerados sucesso (inclui os avisos de coerção)
+STORE_SUCCESS = (0x0000, 0xB000, 0xB007, 0xB006)
+
+class StoreTimer:
+    """Instantes de cada C-STORE marcados pelos eventos do pynetdicom
+
+    EVT_PDU_SENT dispara quando um P-DATA-TF foi escrito no socket e
+    EVT_DIMSE_RECV quando a resposta do SCP foi decodificada. Assim:
+    codificação = chamada até o primeiro P-DATA (inclui a fila do DUL),
+    transmissão = primeiro ao último P-DATA, espera = último P-DATA até a
+    resposta (esvaziar o buffer TCP + processamento no SCP + resposta).
+    """
+    
+    def __init__(self):
+        self.handlers = [(evt.EVT_PDU_SENT, self._pdu_sent), (evt.EVT_DIMSE_RECV, self._dimse_recv)]
+        self.start()
+    
+    def start(self):
+        self.started = time.perf_counter()
+        self.first_pdu = self.last_pdu = self.response = None
+    
+    def _pdu_sent(self, event):
+        if isinstance(event.pdu, P_DATA_TF):
+            now = time.perf_counter()
+            if self.first_pdu is None:
+                self.first_pdu = now
+            self.last_pdu = now
+    
+    def _dimse_recv(self, event):
+        self.response = time.perf_counter()
+    
+    def phases(self, read=0.0):
+        """Duração (s) de cada fase do último C-STORE; `read` é a leitura feita antes"""
+        end = self.response or time.perf_counter()
+        first = self.first_pdu or end
+        last = self.last_pdu or first
+        return {'read': read, 'encode': first - self.started, 'transmit': last - first,
+                'wait': end - last, 'total': read + end - self.started}
+
+_chunked_lock = threading.Lock()
+_chunked_users = [0, None]  # envios em andamento, valor original da opção
+
+@contextlib.contextmanager
+def _chunked_dataset():
+    """Ligar STORE_SEND_CHUNKED_DATASET enquanto houver envios brutos em andamento"""
+    with _chunked_lock:
+        if not _chunked_users[0]:
+            _chunked_users[1] = _config.STORE_SEND_CHUNKED_DATASET
+            _config.STORE_SEND_CHUNKED_DATASET = True
+        _chunked_users[0] += 1
+    try:
+        yield
+    finally:
+        with _chunked_lock:
+            _chunked_users[0] -= 1
+            if not _chunked_users[0]:
+                _config.STORE_SEND_CHUNKED_DATASET = _chunked_users[1]
+
+def send_raw_c_store(assoc, path):
+    """C-STORE dos bytes do arquivo Part-10, sem decodificar nem recodificar o dataset
+    
+    O pynetdicom envia o arquivo em blocos do tamanho do PDU a partir do fim
+    do File Meta. Exige um contexto aceito com a mesma SOP Class e a mesma
+    transfer syntax do arquivo (não há conversão).
+    """
+    # Só afeta send_c_store com caminho de arquivo; Datasets seguem o fluxo normal.
+    # A opção é global: restaurada quando o último envio simultâneo termina
+    with _chunked_dataset():
+        return assoc.send_c_store(path)
+
+def store_breakdown(phases):
+    """Resumo de uma linha das fases de um C-STORE (ms)"""
+    return ', '.join(f"{label.lower()} {phases[name] * 1000:.1f} ms" for name, label in STORE_PHASES)
+
+def iter_dicom_files(directory):
+    """Listar arquivos DICOM de um diretório (recursivo)"""
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith('.dcm'):
+                yield os.path.join(root, name)
+
+class DicomTester(BenchmarkResults):
     def __init__(self, host, port, ae_title, calling_ae='TEST_AE'):
         self.host = host
         self.port = port
         self.ae_title = ae_title
         self.calling_ae = calling_ae
+        self.target = {'protocol': 'dicom', 'host': host, 'port': port, 'ae_title': ae_title}
+        self.results = []
         self.ae = AE(ae_title=calling_ae)
         
         # Configurar contextos
-        self.ae.add_requested_context(VerificationSOPClass)
+        self.ae.add_requested_context(Verification)
         self.ae.add_requested_context(CTImageStorage)
         self.ae.add_requested_context(MRImageStorage)
         self.ae.add_requested_context(StudyRootQueryRetrieveInformationModelFind)
+        self.ae.add_requested_context(PatientRootQueryRetrieveInformationModelFind)
         self.ae.add_requested_context(StudyRootQueryRetrieveInformationModelMove)
     
     def test_echo(self):
@@ -73,28 +219,39 @@ class DicomTester:
         
         return result
     
-    def test_store(self, dicom_file):
-        """Testar C-STORE (envio de imagem)"""
-        print(f"📤 Testando C-STORE com {dicom_file}...")
+    def test_store(self, dicom_file, raw=False):
+        """Testar C-STORE (envio de imagem)
+        
+        Com `raw`, os bytes do arquivo são enviados sem decodificar o dataset.
+        """
+        print(f"📤 Testando C-STORE com {dicom_file}{' (bytes originais)' if raw else ''}...")
         
         try:
-            from pydicom import dcmread
-            
-            # Ler arquivo DICOM
-            ds = dcmread(dicom_file)
+            # Ler arquivo DICOM (sem raw, o dataset completo é decodificado e recodificado)
+            start_time = time.perf_counter()
+            ds = dcmread(dicom_file, stop_before_pixels=raw)
+            read_time = 0.0 if raw else time.perf_counter() - start_time
             print(f"   Paciente: {ds.PatientName}")
             print(f"   Modalidade: {ds.Modality}")
             print(f"   Study UID: {ds.StudyInstanceUID}")
             
-            # Estabelecer associação
-            assoc = self.ae.associate(self.host, self.port, ae_title=self.ae_title)
+            # Estabelecer associação (raw: contexto exato do arquivo, sem conversão)
+            ae = self.ae
+            if raw:
+                ae = AE(ae_title=self.calling_ae)
+                ae.add_requested_context(ds.SOPClassUID, ds.file_meta.TransferSyntaxUID)
+            timer = StoreTimer()
+            assoc = ae.associate(self.host, self.port, ae_title=self.ae_title,
+                                 evt_handlers=timer.handlers)
             
             if assoc.is_established:
                 # Enviar C-STORE
-                status = assoc.send_c_store(ds)
+                timer.start()
+                status = send_raw_c_store(assoc, dicom_file) if raw else assoc.send_c_store(ds)
                 
                 if status:
                     print(f"✅ C-STORE bem-sucedido - Status: {status}")
+                    print(f"   Fases: {store_breakdown(timer.phases(read_time))}")
                     result = True
                 else:
                     print("❌ C-STORE falhou")
@@ -170,49 +327,647 @@ class DicomTester:
         
         return result
     
-    def test_connection_speed(self, iterations=5):
-        """Testar velocidade de conexão"""
-        print(f"⚡ Testando velocidade de conexão ({iterations} iterações)...")
+    def build_find_query(self, level='STUDY', patient_id=None, date_range=None, modality=None,
+                         study_uid=None, series_uid=None):
+        """Montar identificador de C-FIND para o nível e filtros pedidos"""
+        ds = Dataset()
+        ds.QueryRetrieveLevel = level
+        for keyword in FIND_RETURN_KEYS[level]:
+            setattr(ds, keyword, '')
+        
+        if patient_id:
+            ds.PatientID = patient_id
+        if date_range and level != 'PATIENT':
+            ds.StudyDate = date_range  # 'AAAAMMDD', 'AAAAMMDD-AAAAMMDD', '-AAAAMMDD'...
+        if modality:
+            if level == 'STUDY':
+                ds.ModalitiesInStudy = modality
+            elif level in ('SERIES', 'IMAGE'):
+                ds.Modality = modality
+        if study_uid and level != 'PATIENT':
+            ds.StudyInstanceUID = study_uid
+        if series_uid and level in ('SERIES', 'IMAGE'):
+            ds.SeriesInstanceUID = series_uid
+        
+        return ds
+    
+    def iter_find(self, query, limit=None, stats=None):
+        """Executar C-FIND consumindo as respostas sob demanda (gerador)
+        
+        Produz cada identificador assim que chega, sem acumular o resultado.
+        Ao atingir `limit` correspondências envia C-CANCEL e descarta as
+        respostas ainda em trânsito; se o SCP ignorar o cancelamento, a
+        associação é abortada. `stats` (dict) recebe tempo de associação,
+        status final, se houve cancelamento e se a associação foi abortada
+        pelo limite (único caso legítimo sem status final).
+        """
+        stats = stats if stats is not None else {}
+        stats.update({'associate_s': 0.0, 'cancelled': False, 'status': None,
+                      'aborted_by_limit': False})
+        
+        if query.QueryRetrieveLevel == 'PATIENT':
+            model = PatientRootQueryRetrieveInformationModelFind
+        else:
+            model = StudyRootQueryRetrieveInformationModelFind
+        
+        start_time = time.perf_counter()
+        assoc = self.ae.associate(self.host, self.port, ae_title=self.ae_title)
+        stats['associate_s'] = time.perf_counter() - start_time
+        
+        if not assoc.is_established:
+            raise ConnectionError(f"Não foi possível estabelecer associação com {self.host}:{self.port}")
+        
+        matches = 0
+        discarded = 0
+        try:
+            for status, identifier in assoc.send_c_find(query, model, msg_id=1):
+                if not status:
+                    # Sem resposta (timeout ou associação abortada)
+                    break
+                
+                if status.Status not in FIND_PENDING:
+                    stats['status'] = status.Status
+                    break
+                
+                if stats['cancelled']:
+                    discarded += 1
+                    if discarded > limit:
+                        # SCP não atende C-CANCEL: interromper a associação
+                        assoc.abort()
+                        stats['aborted_by_limit'] = True
+                        break
+                    continue
+                
+                matches += 1
+                if limit and matches >= limit:
+                    assoc.send_c_cancel(1, query_model=model)
+                    stats['cancelled'] = True
+                
+                yield identifier
+        finally:
+            if assoc.is_established:
+                assoc.release()
+    
+    def test_find_benchmark(self, level='STUDY', patient_id=None, date_range=None,
+                            modality=None, limit=None):
+        """Medir desempenho de C-FIND sem imprimir os resultados"""
+        print(f"🔍 Benchmark C-FIND (nível {level}, limite {limit or 'nenhum'})...")
+        
+        query = self.build_find_query(level, patient_id, date_range, modality)
+        stats = {}
+        matches = 0
+        first_result = None
+        
+        try:
+            start_time = time.perf_counter()
+            for _ in self.iter_find(query, limit, stats):
+                matches += 1
+                if first_result is None:
+                    first_result = time.perf_counter() - start_time
+            total_time = time.perf_counter() - start_time
+        except Exception as e:
+            print(f"❌ Erro no C-FIND: {e}")
+            return False
+        
+        query_time = total_time - stats['associate_s']
+        
+        status = stats['status']
+        if status is None:
+            # Sem status final: só é aceitável quando o próprio limite abortou a associação
+            passed = stats['aborted_by_limit']
+            if not passed:
+                print("❌ C-FIND sem status final (timeout ou associação abortada)")
+        else:
+            passed = status in (0x0000, 0xFE00)
+            if not passed:
+                print(f"❌ Status final do C-FIND: 0x{status:04X}")
+        
+        print(f"{'✅' if passed else '❌'} C-FIND {'concluído' if passed else 'incompleto'} - "
+              f"{matches} correspondências"
+              f"{' (cancelado por limite)' if stats['cancelled'] else ''}")
+        print(f"   Associação: {stats['associate_s'] * 1000:.1f} ms")
+        if first_result is not None:
+            print(f"   Tempo até o primeiro resultado: "
+                  f"{(first_result - stats['associate_s']) * 1000:.1f} ms")
+        print(f"   Tempo total da consulta: {query_time * 1000:.1f} ms")
+        if matches and query_time > 0:
+            print(f"   Vazão: {matches / query_time:.0f} resultados/s")
+        
+        metrics = {'matches': matches, 'associate_ms': stats['associate_s'] * 1000,
+                   'query_ms': query_time * 1000}
+        if first_result is not None:
+            metrics['first_result_ms'] = (first_result - stats['associate_s']) * 1000
+        if matches and query_time > 0:
+            metrics['results_per_s'] = matches / query_time
+        
+        params = {'level': level, 'patient_id': patient_id, 'date_range': date_range,
+                  'modality': modality, 'limit': limit}
+        return self.record_result('dicom.find', params, metrics, passed=passed)
+    
+    def test_retrieve_benchmark(self, study_uids=None, method='move', parallel=4,
+                                move_destination=None, scp_port=11113, spool_dir=None,
+                                limit=10):
+        """Benchmark de recuperação de estudos via C-MOVE ou C-GET
+        
+        C-MOVE: um Storage SCP local (AE `move_destination`, porta `scp_port`)
+        recebe as instâncias; o Orthanc precisa conhecer esse AE em
+        DicomModalities. C-GET: as instâncias chegam na própria associação.
+        Sem `spool_dir` os objetos recebidos são descartados (apenas
+        contados); com ele são gravados como Part-10. Sem `study_uids`, os
+        estudos são descobertos via C-FIND (até `limit`).
+        """
+        move_destination = move_destination or self.calling_ae
+        
+        if not study_uids:
+            try:
+                query = self.build_find_query('STUDY')
+                study_uids = [identifier.StudyInstanceUID
+                              for identifier in self.iter_find(query, limit)]
+            except Exception as e:
+                print(f"❌ Erro ao localizar estudos: {e}")
+                return False
+        
+        print(f"📥 Benchmark C-{method.upper()}: {len(study_uids)} estudos, {parallel} em paralelo")
+        if method == 'move':
+            print(f"   Destino: {move_destination} (porta local {scp_port})")
+        print(f"   Destino dos objetos: {spool_dir or 'descartados (null sink)'}")
+        
+        if not study_uids:
+            print("⚠️ Nenhum estudo para recuperar")
+            return False
         
-        times = []
-        successful = 0
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
         
-        for i in range(iterations):
-            start_time = time.time()
+        lock = threading.Lock()
+        study_by_msg_id = {index + 1: uid for index, uid in enumerate(study_uids)}
+        first_instance = {}
+        counters = {'instances': 0, 'bytes': 0, 'failed': 0}
+        start_time = time.perf_counter()
+        
+        def handle_store(event, study_uid=None):
+            size = event.request.DataSet.getbuffer().nbytes
+            now = time.perf_counter()
+            
+            if study_uid is None:
+                # C-MOVE: identificar o estudo pela mensagem de origem
+                study_uid = study_by_msg_id.get(event.request.MoveOriginatorMessageID)
+                if study_uid is None:
+                    study_uid = event.dataset.StudyInstanceUID
             
+            if spool_dir:
+                sop_uid = event.request.AffectedSOPInstanceUID
+                with open(os.path.join(spool_dir, f"{sop_uid}.dcm"), 'wb') as f:
+                    f.write(event.encoded_dataset())
+            
+            with lock:
+                counters['instances'] += 1
+                counters['bytes'] += size
+                first_instance.setdefault(study_uid, now)
+            return 0x0000
+        
+        if method == 'move':
+            scp_ae = AE(ae_title=move_destination)
+            for context in StoragePresentationContexts:
+                scp_ae.add_supported_context(context.abstract_syntax, ALL_TRANSFER_SYNTAXES)
             try:
-                assoc = self.ae.associate(self.host, self.port, ae_title=self.ae_title)
+                server = scp_ae.start_server(('', scp_port), block=False,
+                                             evt_handlers=[(evt.EVT_C_STORE, handle_store)])
+            except OSError as e:
+                print(f"❌ Não foi possível abrir o Storage SCP na porta {scp_port}: {e}")
+                return False
+            model = StudyRootQueryRetrieveInformationModelMove
+            retrieve_ae = self.ae
+            roles = []
+        else:
+            server = None
+            model = StudyRootQueryRetrieveInformationModelGet
+            retrieve_ae = AE(ae_title=self.calling_ae)
+            retrieve_ae.add_requested_context(model)
+            for sop_class in RETRIEVE_STORAGE_CLASSES:
+                retrieve_ae.add_requested_context(sop_class, ALL_TRANSFER_SYNTAXES)
+            roles = [build_role(sop_class, scp_role=True) for sop_class in RETRIEVE_STORAGE_CLASSES]
+        
+        study_times = LatencyHistogram()
+        first_instance_times = LatencyHistogram()
+        
+        def retrieve(msg_id, study_uid):
+            query = Dataset()
+            query.QueryRetrieveLevel = 'STUDY'
+            query.StudyInstanceUID = study_uid
+            
+            requested = time.perf_counter()
+            handlers = []
+            if method == 'get':
+                handlers = [(evt.EVT_C_STORE, handle_store, [study_uid])]
+            assoc = retrieve_ae.associate(self.host, self.port, ae_title=self.ae_title,
+                                          ext_neg=roles, evt_handlers=handlers)
+            if not assoc.is_established:
+                with lock:
+                    counters['failed'] += 1
+                return False
+            
+            try:
+                if method == 'move':
+                    responses = assoc.send_c_move(query, move_destination, model, msg_id=msg_id)
+                else:
+                    responses = assoc.send_c_get(query, model, msg_id=msg_id)
                 
+                final_status = None
+                for status, _ in responses:
+                    if status and status.Status not in (0xFF00,):
+                        final_status = status
+            finally:
                 if assoc.is_established:
-                    status = assoc.send_c_echo()
                     assoc.release()
-                    
-                    if status:
-                        end_time = time.time()
-                        connection_time = end_time - start_time
-                        times.append(connection_time)
-                        successful += 1
-                        print(f"   Teste {i+1}: {connection_time:.3f}s")
+            
+            finished = time.perf_counter()
+            ok = final_status is not None and final_status.Status in (0x0000, 0xB000)
+            with lock:
+                if not ok:
+                    counters['failed'] += 1
+                if study_uid in first_instance:
+                    first_instance_times.record(first_instance[study_uid] - requested)
+            study_times.record(finished - requested)
+            return ok
+        
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+                futures = [executor.submit(contextvars.copy_context().run, retrieve, msg_id, uid)
+                           for msg_id, uid in study_by_msg_id.items()]
+                for future in futures:
+                    future.result()
+        finally:
+            if server is not None:
+                server.shutdown()
+        
+        wall_time = time.perf_counter() - start_time
+        
+        if not counters['instances']:
+            print("❌ Nenhuma instância recebida")
+            return False
+        
+        overall_first = min(first_instance.values()) - start_time
+        
+        print(f"✅ Recuperação concluída em {wall_time:.2f}s")
+        print(f"   Estudos: {len(study_uids) - counters['failed']}/{len(study_uids)}")
+        print(f"   Instâncias: {counters['instances']} "
+              f"({counters['bytes'] / 1024 / 1024:.1f} MB)")
+        print(f"   Vazão: {counters['instances'] / wall_time:.1f} inst/s, "
+              f"{counters['bytes'] / 1024 / 1024 / wall_time:.2f} MB/s")
+        print(f"   Primeira instância: {overall_first * 1000:.1f} ms após o início")
+        print(f"   Tempo até a 1ª instância por estudo: {first_instance_times.summary()}")
+        print(f"   Tempo por estudo: {study_times.summary()}")
+        
+        metrics = {'studies': len(study_uids), 'failed': counters['failed'],
+                   'instances': counters['instances'], 'wall_s': wall_time,
+                   'instances_per_s': counters['instances'] / wall_time,
+                   'mb_per_s': counters['bytes'] / 1024 / 1024 / wall_time,
+                   'first_instance_ms': overall_first * 1000,
+                   **histogram_metrics('study', study_times),
+                   **histogram_metrics('first_study_instance', first_instance_times)}
+        params = {'method': method, 'parallel': parallel, 'studies': sorted(study_uids),
+                  'spool': bool(spool_dir)}
+        return self.record_result(f'dicom.{method}', params, metrics,
+                                  {'study': study_times, 'first_study_instance': first_instance_times},
+                                  primary='study', passed=counters['failed'] == 0)
+    
+    def test_connection_speed(self, iterations=5, concurrency=1):
+        """Testar velocidade de conexão
+        
+        Cada ciclo é dividido em estabelecimento da associação, ida e volta
+        do C-ECHO e liberação; os percentis vêm de histogramas HDR.
+        """
+        print(f"⚡ Testando velocidade de conexão ({iterations} iterações, "
+              f"concorrência {concurrency})...")
+        
+        phases = {
+            'associate': LatencyHistogram(),
+            'echo': LatencyHistogram(),
+            'release': LatencyHistogram(),
+            'total': LatencyHistogram()
+        }
+        failures = []
+        verbose = iterations <= 20
+        
+        def cycle(i):
+            try:
+                start_time = time.perf_counter()
+                assoc = self.ae.associate(self.host, self.port, ae_title=self.ae_title)
+                associated = time.perf_counter()
+                
+                if not assoc.is_established:
+                    failures.append(i)
+                    if verbose:
+                        print(f"   Teste {i+1}: Falhou - associação rejeitada")
+                    return
+                
+                status = assoc.send_c_echo()
+                echoed = time.perf_counter()
+                assoc.release()
+                released = time.perf_counter()
+                
+                if status:
+                    phases['associate'].record(associated - start_time)
+                    phases['echo'].record(echoed - associated)
+                    phases['release'].record(released - echoed)
+                    phases['total'].record(released - start_time)
+                    if verbose:
+                        print(f"   Teste {i+1}: {released - start_time:.3f}s "
+                              f"(associação {associated - start_time:.3f}s, "
+                              f"echo {echoed - associated:.3f}s, "
+                              f"liberação {released - echoed:.3f}s)")
+                else:
+                    failures.append(i)
                     
             except Exception as e:
+                failures.append(i)
                 print(f"   Teste {i+1}: Falhou - {e}")
         
-        if times:
-            avg_time = sum(times) / len(times)
-            min_time = min(times)
-            max_time = max(times)
+        start_time = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, cycle, i)
+                       for i in range(iterations)]
+            for future in futures:
+                future.result()
+        wall_time = time.perf_counter() - start_time
+        
+        successful = phases['total'].count
+        
+        if successful:
+            total = phases['total']
             
             print(f"✅ Velocidade de conexão:")
             print(f"   Sucessos: {successful}/{iterations}")
-            print(f"   Tempo médio: {avg_time:.3f}s")
-            print(f"   Tempo mínimo: {min_time:.3f}s")
-            print(f"   Tempo máximo: {max_time:.3f}s")
+            print(f"   Tempo médio: {total.mean:.3f}s")
+            print(f"   Tempo mínimo: {total.min / 1_000_000:.3f}s")
+            print(f"   Tempo máximo: {total.max / 1_000_000:.3f}s")
+            print(f"   Ciclos/s: {successful / wall_time:.1f}")
+            for name, label in (('associate', 'Associação'), ('echo', 'C-ECHO'),
+                                ('release', 'Liberação'), ('total', 'Total')):
+                print(f"   {label:<11} {phases[name].summary()}")
             
-            return avg_time < 2.0  # Considerado bom se < 2s
+            metrics = {'successful': successful, 'failed': len(failures),
+                       'cycles_per_s': successful / wall_time}
+            for name, hist in phases.items():
+                metrics.update(histogram_metrics(name, hist))
+            # Sem linha de base, considerado bom se a média < 2s
+            return self.record_result('dicom.speed',
+                                      {'iterations': iterations, 'concurrency': concurrency},
+                                      metrics, phases, primary='total',
+                                      limits={'total_mean_ms': 2000})
         else:
             print("❌ Nenhuma conexão bem-sucedida")
             return False
     
+    def _storage_contexts(self, source):
+        """Descobrir os pares (SOP Class, transfer syntax) usados pelos arquivos"""
+        contexts = set()
+        for path in source:
+            meta = dcmread(path, stop_before_pixels=True, specific_tags=['SOPClassUID'])
+            contexts.add((meta.SOPClassUID, meta.file_meta.TransferSyntaxUID))
+        return contexts
+    
+    def test_store_load(self, dicom_dir=None, synthetic=0, associations=4,
+                        modality='CT', max_per_association=None):
+        """Teste de carga C-STORE com associações longas e concorrentes
+        
+        Mantém `associations` associações abertas (uma por thread), cada uma
+        enviando várias instâncias, lidas de `dicom_dir` ou geradas em memória
+        (`synthetic` instâncias). Só os contextos necessários são negociados.
+        """
+        if dicom_dir:
+            files = list(iter_dicom_files(dicom_dir))
+            contexts = self._storage_contexts(files)
+            source = iter(files)
+            total = len(files)
+            origin = dicom_dir
+        else:
+            from create_test_dicom import iter_test_instances
+            source = iter_test_instances(synthetic, modality)
+            sop_class = next(iter_test_instances(1, modality)).SOPClassUID
+            contexts = {(sop_class, ExplicitVRLittleEndian)}
+            total = synthetic
+            origin = f"gerador sintético ({modality})"
+        
+        print(f"🚚 Teste de carga C-STORE: {total} instâncias de {origin}")
+        print(f"   Associações simultâneas: {associations}")
+        print(f"   Contextos negociados: {len(contexts)}")
+        
+        if total == 0:
+            print("❌ Nenhuma instância para enviar")
+            return False
+        
+        # AE dedicado: apenas os contextos de armazenamento necessários
+        ae = AE(ae_title=self.calling_ae)
+        for sop_class, transfer_syntax in sorted(contexts):
+            ae.add_requested_context(sop_class, transfer_syntax)
+        
+        source_lock = threading.Lock()
+        results_lock = threading.Lock()
+        latencies = LatencyHistogram()
+        counters = {'sent': 0, 'failed': 0, 'bytes': 0, 'associations': 0}
+        
+        def next_item():
+            with source_lock:
+                return next(source, None)
+        
+        def load(item):
+            if isinstance(item, str):
+                return dcmread(item), os.path.getsize(item)
+            # Dataset gerado em memória: basta informar a transfer syntax
+            item.file_meta = FileMetaDataset()
+            item.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+            return item, len(item.PixelData)
+        
+        def worker():
+            assoc = None
+            sent_on_assoc = 0
+            try:
+                while True:
+                    item = next_item()
+                    if item is None:
+                        break
+                    
+                    if assoc is None or not assoc.is_established or (
+                            max_per_association and sent_on_assoc >= max_per_association):
+                        if assoc is not None and assoc.is_established:
+                            assoc.release()
+                        assoc = ae.associate(self.host, self.port, ae_title=self.ae_title)
+                        sent_on_assoc = 0
+                        with results_lock:
+                            counters['associations'] += 1
+                        if not assoc.is_established:
+                            with results_lock:
+                                counters['failed'] += 1
+                            continue
+                    
+                    try:
+                        ds, size = load(item)
+                        start_time = time.perf_counter()
+                        status = assoc.send_c_store(ds)
+                        elapsed = time.perf_counter() - start_time
+                        ok = bool(status) and status.Status in STORE_SUCCESS
+                    except Exception as e:
+                        print(f"   ❌ Falha no envio: {e}")
+                        ok, elapsed, size = False, 0.0, 0
+                    
+                    sent_on_assoc += 1
+                    with results_lock:
+                        if ok:
+                            counters['sent'] += 1
+                            counters['bytes'] += size
+                            latencies.record(elapsed)
+                        else:
+                            counters['failed'] += 1
+            finally:
+                if assoc is not None and assoc.is_established:
+                    assoc.release()
+        
+        start_time = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=associations) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, worker)
+                       for _ in range(associations)]
+            for future in futures:
+                future.result()
+        wall_time = time.perf_counter() - start_time
+        
+        if not latencies.count:
+            print("❌ Nenhuma instância armazenada com sucesso")
+            return False
+        
+        print(f"✅ Carga C-STORE concluída em {wall_time:.2f}s")
+        print(f"   Sucessos: {counters['sent']}/{total} ({counters['failed']} falhas, "
+              f"{counters['associations']} associações)")
+        print(f"   Vazão: {counters['sent'] / wall_time:.1f} inst/s, "
+              f"{counters['bytes'] / 1024 / 1024 / wall_time:.2f} MB/s")
+        print(f"   Latência por instância: {latencies.summary()}")
+        
+        metrics = {'sent': counters['sent'], 'failed': counters['failed'],
+                   'associations': counters['associations'], 'wall_s': wall_time,
+                   'instances_per_s': counters['sent'] / wall_time,
+                   'mb_per_s': counters['bytes'] / 1024 / 1024 / wall_time,
+                   **histogram_metrics('latency', latencies)}
+        params = {'source': dicom_dir or 'synthetic', 'instances': total,
+                  'associations': associations, 'modality': None if dicom_dir else modality,
+                  'max_per_association': max_per_association}
+        return self.record_result('dicom.store_load', params, metrics, {'latency': latencies},
+                                  primary='latency', passed=counters['failed'] == 0)
+    
+    def test_store_breakdown(self, dicom_dir=None, synthetic=20, modality='CT',
+                             modes=('decode', 'raw')):
+        """Decompor cada C-STORE em leitura/codificação, transmissão e espera pelo SCP
+        
+        Para cada modo, uma associação envia todos os arquivos em sequência:
+        'decode' lê o dataset com dcmread e deixa o pynetdicom recodificá-lo;
+        'raw' envia os bytes do arquivo (send_raw_c_store). A fase dominante
+        indica se o gargalo é o cliente, a rede ou a ingestão no SCP.
+        """
+        with contextlib.ExitStack() as stack:
+            if dicom_dir:
+                files = list(iter_dicom_files(dicom_dir))
+                origin = dicom_dir
+            else:
+                from create_test_dicom import iter_test_instances
+                temp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+                files = []
+                for number, buffer in enumerate(iter_test_instances(synthetic, modality,
+                                                                    output='bytesio')):
+                    files.append(os.path.join(temp_dir, f"{number:06d}.dcm"))
+                    with open(files[-1], 'wb') as f:
+                        f.write(buffer.getvalue())
+                origin = f"gerador sintético ({modality})"
+            
+            print(f"⏱️ Decomposição do C-STORE: {len(files)} instâncias de {origin}, "
+                  f"modos {', '.join(modes)}")
+            if not files:
+                print("❌ Nenhuma instância para enviar")
+                return False
+            
+            # Contextos exatos dos arquivos: o modo raw não converte a transfer syntax
+            ae = AE(ae_title=self.calling_ae)
+            for sop_class, transfer_syntax in sorted(self._storage_contexts(files)):
+                ae.add_requested_context(sop_class, transfer_syntax)
+            
+            phases = {mode: {name: LatencyHistogram() for name, _ in STORE_PHASES} for mode in modes}
+            failures = {mode: 0 for mode in modes}
+            total_bytes = sum(os.path.getsize(path) for path in files)
+            
+            for mode in modes:
+                timer = StoreTimer()
+                assoc = ae.associate(self.host, self.port, ae_title=self.ae_title,
+                                     evt_handlers=timer.handlers)
+                if not assoc.is_established:
+                    print(f"❌ Não foi possível estabelecer associação ({mode})")
+                    return False
+                try:
+                    for path in files:
+                        try:
+                            if mode == 'raw':
+                                timer.start()
+                                status = send_raw_c_store(assoc, path)
+                                read_time = 0.0
+                            else:
+                                start_time = time.perf_counter()
+                                ds = dcmread(path)
+                                read_time = time.perf_counter() - start_time
+                                timer.start()
+                                status = assoc.send_c_store(ds)
+                        except Exception as e:
+                            print(f"   ❌ Falha no envio ({mode}): {e}")
+                            failures[mode] += 1
+                            continue
+                        if not status or status.Status not in STORE_SUCCESS:
+                            failures[mode] += 1
+                            continue
+                        for name, seconds in timer.phases(read_time).items():
+                            phases[mode][name].record(seconds)
+                finally:
+                    if assoc.is_established:
+                        assoc.release()
+        
+        if not any(hists['total'].count for hists in phases.values()):
+            print("❌ Nenhuma instância armazenada com sucesso")
+            return False
+        
+        print(f"   {'Fase':<12}" + ''.join(f"{mode + ' p50':>13}{'média':>9}{'%':>6}" for mode in modes))
+        for name, label in STORE_PHASES:
+            row = f"   {label:<12}"
+            for mode in modes:
+                hist, total = phases[mode][name], phases[mode]['total'].mean or 1
+                row += (f"{hist.percentile(50) * 1000:>10.2f} ms{hist.mean * 1000:>6.2f} ms"
+                        f"{hist.mean / total:>6.0%}")
+            print(row)
+        
+        metrics = {'instances': len(files), 'mb': total_bytes / 1024 / 1024}
+        histograms = {}
+        for mode in modes:
+            hists = phases[mode]
+            if not hists['total'].count:
+                continue
+            client = hists['read'].mean + hists['encode'].mean
+            shares = {'cliente (leitura/codificação)': client, 'rede (transmissão)': hists['transmit'].mean,
+                      'SCP (espera pela resposta)': hists['wait'].mean}
+            bottleneck = max(shares, key=shares.get)
+            print(f"   {mode}: {hists['total'].count} enviadas, {failures[mode]} falhas, "
+                  f"{total_bytes / 1024 / 1024 / (hists['total'].mean * hists['total'].count):.1f} MB/s; "
+                  f"gargalo: {bottleneck} ({shares[bottleneck] / hists['total'].mean:.0%})")
+            metrics[f'{mode}_failed'] = failures[mode]
+            for name, _ in STORE_PHASES:
+                metrics.update(histogram_metrics(f'{mode}_{name}', hists[name]))
+                histograms[f'{mode}_{name}'] = hists[name]
+        
+        if 'decode' in modes and 'raw' in modes and phases['raw']['total'].count:
+            saved = phases['decode']['total'].mean - phases['raw']['total'].mean
+            print(f"✅ Envio dos bytes originais: {saved * 1000:+.2f} ms economizados por instância em relação "
+                  f"a dcmread + recodificação")
+        
+        params = {'source': dicom_dir or 'synthetic', 'instances': len(files),
+                  'modality': None if dicom_dir else modality, 'modes': list(modes)}
+        primary = 'raw_total' if 'raw' in modes else f'{modes[0]}_total'
+        return self.record_result('dicom.store_breakdown', params, metrics, histograms,
+                                  primary=primary, passed=not any(failures.values()))
+    
     def run_all_tests(self, dicom_file=None):
         """Executar todos os testes"""
         print(f"🏥 Iniciando testes DICOM para {self.host}:{self.port}")
@@ -274,12 +1029,57 @@ def main():
                        help='AE Title do cliente')
     parser.add_argument('--dicom-file',
                        help='Arquivo DICOM para teste de C-STORE')
+    parser.add_argument('--raw', action='store_true',
+                       help='C-STORE com os bytes originais do arquivo, sem decodificar o dataset')
+    parser.add_argument('--store-modes', default='decode,raw',
+                       help='Modos comparados na decomposição do C-STORE (decode, raw)')
     parser.add_argument('--patient-id',
                        help='ID do paciente para busca C-FIND')
     parser.add_argument('--verbose', action='store_true',
                        help='Ativar logs detalhados')
-    parser.add_argument('--test', choices=['echo', 'find', 'store', 'speed', 'all'],
+    parser.add_argument('--test', choices=['echo', 'find', 'find-bench', 'store', 'store-load',
+                                           'store-breakdown', 'retrieve', 'speed', 'all'],
                        default='all', help='Tipo de teste a executar')
+    parser.add_argument('--level', choices=list(FIND_RETURN_KEYS), default='STUDY',
+                       help='Nível do C-FIND no benchmark')
+    parser.add_argument('--date-range',
+                       help='Filtro de data do estudo (AAAAMMDD ou AAAAMMDD-AAAAMMDD)')
+    parser.add_argument('--query-modality',
+                       help='Filtro de modalidade do C-FIND (ex.: CT)')
+    parser.add_argument('--limit', type=int,
+                       help='Enviar C-CANCEL após N correspondências')
+    parser.add_argument('--dicom-dir',
+                       help='Diretório com arquivos DICOM para o teste de carga C-STORE')
+    parser.add_argument('--synthetic', type=int, default=100,
+                       help='Instâncias geradas em memória para a carga (sem --dicom-dir)')
+    parser.add_argument('--associations', type=int, default=4,
+                       help='Associações simultâneas no teste de carga')
+    parser.add_argument('--max-per-association', type=int,
+                       help='Renovar a associação após N instâncias (padrão: nunca)')
+    parser.add_argument('--modality', choices=['CT', 'MR', 'US'], default='CT',
+                       help='Modalidade das instâncias sintéticas')
+    parser.add_argument('--study-uid', action='append',
+                       help='StudyInstanceUID a recuperar (pode repetir; padrão: via C-FIND)')
+    parser.add_argument('--retrieve-method', choices=['move', 'get'], default='move',
+                       help='C-MOVE (Storage SCP local) ou C-GET')
+    parser.add_argument('--parallel', type=int, default=4,
+                       help='Estudos recuperados em paralelo')
+    parser.add_argument('--move-destination',
+                       help='AE Title de destino do C-MOVE (padrão: --calling-ae)')
+    parser.add_argument('--scp-port', type=int, default=11113,
+                       help='Porta do Storage SCP local para C-MOVE')
+    parser.add_argument('--spool-dir',
+                       help='Gravar objetos recuperados neste diretório (padrão: descartar)')
+    parser.add_argument('--iterations', type=int, default=5,
+                       help='Ciclos associação/C-ECHO/liberação no teste de velocidade')
+    parser.add_argument('--concurrency', type=int, default=1,
+                       help='Ciclos simultâneos no teste de velocidade')
+    parser.add_argument('--json-output',
+                       help='Exportar os resultados estruturados dos benchmarks em JSON')
+    parser.add_argument('--results-store',
+                       help='Anexar os resultados a este arquivo JSONL e comparar com a execução anterior')
+    parser.add_argument('--baseline', action='append',
+                       help='Execução fixada como linha de base do seu benchmark (pode repetir)')
     
     args = parser.parse_args()
     
@@ -289,6 +1089,12 @@ def main():
     
     # Criar testador
     tester = DicomTester(args.host, args.port, args.ae_title, args.calling_ae)
+    if args.results_store:
+        try:
+            tester.results_store = ResultsStore(args.results_store, args.baseline)
+        except KeyError as e:
+            print(f"❌ Linha de base não encontrada ou ambígua: {e}")
+            sys.exit(1)
     
     # Executar testes
     if args.test == 'all':
@@ -297,13 +1103,30 @@ def main():
         success = tester.test_echo()
     elif args.test == 'find':
         success = tester.test_find(args.patient_id)
+    elif args.test == 'find-bench':
+        success = tester.test_find_benchmark(args.level, args.patient_id, args.date_range,
+                                             args.query_modality, args.limit)
     elif args.test == 'store':
         if not args.dicom_file:
             print("❌ Arquivo DICOM necessário para teste de C-STORE")
             sys.exit(1)
-        success = tester.test_store(args.dicom_file)
+        success = tester.test_store(args.dicom_file, args.raw)
+    elif args.test == 'store-breakdown':
+        success = tester.test_store_breakdown(args.dicom_dir, args.synthetic, args.modality,
+                                              tuple(args.store_modes.split(',')))
+    elif args.test == 'store-load':
+        success = tester.test_store_load(args.dicom_dir, args.synthetic, args.associations,
+                                         args.modality, args.max_per_association)
+    elif args.test == 'retrieve':
+        success = tester.test_retrieve_benchmark(args.study_uid, args.retrieve_method,
+                                                 args.parallel, args.move_destination,
+                                                 args.scp_port, args.spool_dir,
+                                                 args.limit or 10)
     elif args.test == 'speed':
-        success = tester.test_connection_speed()
+        success = tester.test_connection_speed(args.iterations, args.concurrency)
+    
+    if args.json_output:
+        tester.export_results(args.json_output)
     
     # Código de saída
     sys.exit(0 if success else 1)